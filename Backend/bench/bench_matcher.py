@@ -0,0 +1,89 @@
+"""
+Micro-benchmark: SymptomMatcher vs the old difflib scans from main.py.
+
+    python bench/bench_matcher.py --sizes 100 1000 5000 --terms 200
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from difflib import get_close_matches
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from matcher import SymptomMatcher  # noqa: E402
+
+
+def legacy_normalize_and_match(extracted: list[str], known: list[str]) -> list[str]:
+    matched = []
+    for e in extracted:
+        e_norm = e.strip().lower()
+        for k in known:
+            if e_norm == k.lower():
+                matched.append(k)
+                break
+        else:
+            close = get_close_matches(e_norm, [k.lower() for k in known], n=1, cutoff=0.6)
+            if close:
+                for k in known:
+                    if k.lower() == close[0]:
+                        matched.append(k)
+                        break
+    return list(dict.fromkeys(matched))
+
+
+def make_catalogue(n: int, rng: random.Random) -> list[str]:
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(max(50, n // 4))]
+    keys = set()
+    while len(keys) < n:
+        keys.add(" ".join(rng.sample(words, rng.randint(1, 3))).title())
+    return sorted(keys)
+
+
+def make_terms(known: list[str], count: int, rng: random.Random) -> list[str]:
+    terms = []
+    for _ in range(count):
+        k = rng.choice(known).lower()
+        roll = rng.random()
+        if roll < 0.3:
+            terms.append(k)                                   # exact
+        elif roll < 0.8:
+            i = rng.randrange(len(k))
+            terms.append(k[:i] + rng.choice(string.ascii_lowercase) + k[i + 1:])  # typo
+        else:
+            terms.append("".join(rng.choices(string.ascii_lowercase, k=len(k))))  # noise
+    return terms
+
+
+def timed(fn, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--terms", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'size':>6} {'legacy ms':>10} {'build ms':>9} {'matcher ms':>11} {'speedup':>8} {'agree':>7}")
+    for size in args.sizes:
+        known = make_catalogue(size, rng)
+        terms = make_terms(known, args.terms, rng)
+
+        t_legacy, _ = timed(legacy_normalize_and_match, terms, known)
+        t_build, matcher = timed(SymptomMatcher, known)
+        t_new, _ = timed(matcher.match_all, terms)
+        # per-term agreement with difflib (the shortlist can differ on near-ties)
+        same = sum(matcher.match(t) == (legacy_normalize_and_match([t], known) or [None])[0] for t in terms)
+        print(f"{size:>6} {t_legacy * 1000:>10.1f} {t_build * 1000:>9.1f} {t_new * 1000:>11.1f} "
+              f"{t_legacy / max(t_new, 1e-9):>7.1f}x {same / len(terms):>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
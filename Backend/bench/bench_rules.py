@@ -0,0 +1,285 @@
+"""
+Micro-benchmark: rule and matching hot paths from main.py at catalogue scale.
+
+    python bench/bench_rules.py --sizes 10 100 1000 10000 --out bench/results/rules.json
+    python bench/bench_rules.py --baseline bench/results/rules.json --threshold 0.25   # exit 1 on regression
+
+Cases (per catalogue size unless noted):
+  matcher_build          SymptomMatcher over the whole catalogue (once per rule version)
+  normalize_and_match    extracted terms against the catalogue matcher
+  normalize_to_canonical one term against a consult's own symptoms
+  determine_urgency      full recompute of a consult, judge_rule_match stubbed out
+  merge_related_answers  one symptom's answer list (sized by --answer-sizes)
+
+Timings are best-of-repeats per call, so baselines only compare on the same machine;
+raise --threshold on noisy (shared/virtualised) hosts. main.get_rule_index and
+main.judge_rule_match are patched only while a case runs.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+# main.py builds its engine, LLM backend and notifier from the environment at import
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("NOTIFY_BACKEND", "off")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import logging  # noqa: E402
+
+import main  # noqa: E402
+from bench_matcher import make_catalogue, make_terms  # noqa: E402
+from matcher import SymptomMatcher  # noqa: E402
+from models import FollowUpRule, SymptomRule  # noqa: E402
+from rules import RuleIndex  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+# (question pattern, question texts it matches, trigger values)
+FOLLOWUP_TEMPLATES = [
+    ("spread|radiat", ["Does it spread to your arm?", "Does the pain radiate anywhere?"], ["yes", "arm", "jaw"]),
+    ("exertion|stairs", ["Is it worse with exertion?", "Does it happen on the stairs?"], ["yes", "always"]),
+    ("faint|pass(ed)? out", ["Have you fainted?", "Have you passed out?"], ["yes", "once", "twice"]),
+    ("lie flat|lying down", ["Can you lie flat?", "Is it worse lying down?"], ["no", "can't", "worse"]),
+    ("fever|temperature", ["Do you have a fever?", "Have you taken your temperature?"], ["yes", "38", "39"]),
+    ("blood|bleed", ["Have you noticed any blood?", "Any bleeding?"], ["yes", "some", "lots"]),
+    ("night|sleep", ["Does it wake you at night?", "Does it affect your sleep?"], ["yes", "every night"]),
+    ("swell", ["Is there any swelling?", "Has the swelling spread?"], ["yes", "both legs"]),
+]
+ONSET_QUESTIONS = ["When did it start?", "What date did you first notice it?", "Which year did it begin?"]
+OTHER_QUESTIONS = ["How long does it last?", "What makes it better?", "Have you had this before?"]
+ANSWERS = ["Yes, sometimes", "No", "About ten minutes", "Only when I climb stairs", "Since last week",
+           "It spreads to my arm", "I can't lie flat", "Not that I noticed", "Twice this month"]
+ESCALATIONS = ["semi-urgent", "urgent", "very_urgent"]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+# ---------------- Synthetic data ---------------- #
+def make_rules(catalogue: list[str], followups: int, rng: random.Random):
+    """Transient SymptomRule/FollowUpRule rows: `followups` per symptom."""
+    symptom_rules, followup_rules = [], []
+    for i, key in enumerate(catalogue, start=1):
+        symptom_rules.append(SymptomRule(id=i, symptom_key=key, urgency="normal",
+                                         follow_up_questions=rng.sample(OTHER_QUESTIONS + ONSET_QUESTIONS, 3)))
+        for _ in range(followups):
+            pattern, _, triggers = rng.choice(FOLLOWUP_TEMPLATES)
+            followup_rules.append(FollowUpRule(id=len(followup_rules) + 1, symptom_key=key, question_pattern=pattern,
+                                               trigger_values=rng.sample(triggers, rng.randint(1, len(triggers))),
+                                               new_urgency=rng.choice(ESCALATIONS)))
+    return symptom_rules, followup_rules
+
+
+def make_answers(count: int, rng: random.Random) -> list[dict]:
+    answers = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.2:
+            question = rng.choice(ONSET_QUESTIONS)
+        elif roll < 0.8:
+            question = rng.choice(rng.choice(FOLLOWUP_TEMPLATES)[1])
+        else:
+            question = rng.choice(OTHER_QUESTIONS)
+        answers.append({"question": question, "answer": rng.choice(ANSWERS), "doctor_note": "Noted."})
+    return answers
+
+
+def make_consult(catalogue: list[str], symptoms: int, answers: int, rng: random.Random):
+    keys = rng.sample(catalogue, min(symptoms, len(catalogue)))
+    per_symptom = {k: [] for k in keys}
+    for qa in make_answers(answers, rng):
+        per_symptom[rng.choice(keys)].append(qa)
+    return keys, per_symptom
+
+
+async def stub_judge_rule_match(question: str, answer: str, rule) -> bool:
+    # deterministic stand-in for the LLM verdict
+    return (rule.id + len(answer)) % 3 == 0
+
+
+@contextlib.contextmanager
+def patched(module, **attrs):
+    """Set module attributes for the duration of the block, then restore them."""
+    saved = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+# ---------------- Timing ---------------- #
+def _calibrate(run_batch, min_time: float) -> int:
+    number = 1
+    while True:
+        elapsed = run_batch(number)
+        if elapsed >= min_time / 10 or number >= 1 << 20:
+            return max(1, int(number * min_time / max(elapsed, 1e-9)))
+        number *= 2
+
+
+def _best_of(run_batch, min_time: float, repeats: int) -> float:
+    """Best per-call seconds over `repeats` batches of about `min_time` each; GC off as in timeit."""
+    number = _calibrate(run_batch, min_time)
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return min(run_batch(number) / number for _ in range(repeats))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def measure(fn, min_time: float, repeats: int) -> float:
+    def batch(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - start
+
+    return _best_of(batch, min_time, repeats)
+
+
+def measure_async(loop, coro_fn, min_time: float, repeats: int) -> float:
+    async def batch(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            await coro_fn()
+        return time.perf_counter() - start
+
+    return _best_of(lambda number: loop.run_until_complete(batch(number)), min_time, repeats)
+
+
+# ---------------- Cases ---------------- #
+def run_catalogue_cases(size: int, args, loop, rng: random.Random) -> dict[str, float]:
+    catalogue = make_catalogue(size, rng)
+    index = RuleIndex(1, *make_rules(catalogue, args.followups, rng))
+    terms = make_terms(catalogue, args.terms, rng)
+    consult_keys, consult_answers = make_consult(catalogue, args.consult_symptoms, args.answers, rng)
+    consult_terms = make_terms(consult_keys, 16, rng)
+
+    async def fixed_index(db=None, refresh=False):
+        return index
+
+    matcher = index.matcher
+    it = itertools.count()
+
+    with patched(main, get_rule_index=fixed_index, judge_rule_match=stub_judge_rule_match):
+        return {
+            "matcher_build": measure(lambda: SymptomMatcher(catalogue), args.min_time, args.repeats),
+            "normalize_and_match": measure(lambda: main.normalize_and_match(terms, catalogue, matcher),
+                                           args.min_time, args.repeats),
+            "normalize_to_canonical": measure(
+                lambda: main.normalize_to_canonical(consult_terms[next(it) % len(consult_terms)], consult_keys),
+                args.min_time, args.repeats),
+            "determine_urgency": measure_async(
+                loop, lambda: main.determine_urgency(consult_keys, consult_answers, None), args.min_time,
+                args.repeats),
+        }
+
+
+def run_answer_cases(count: int, args, rng: random.Random) -> dict[str, float]:
+    answers = make_answers(count, rng)
+    return {"merge_related_answers": measure(lambda: main.merge_related_answers(answers), args.min_time, args.repeats)}
+
+
+# ---------------- Report ---------------- #
+def print_curves(results: dict):
+    """One row per case: µs/call at each size and the growth per 10x of input."""
+    by_case: dict[str, list[tuple[int, float]]] = {}
+    for key, us in results.items():
+        case, n = key.rsplit("@", 1)
+        by_case.setdefault(case, []).append((int(n), us))
+    for case, points in by_case.items():
+        points.sort()
+        cells = "  ".join(f"n={n}: {us:,.1f}µs" for n, us in points)
+        growth = ""
+        if len(points) > 1 and points[-1][0] > points[0][0]:
+            decades = math.log10(points[-1][0] / points[0][0])
+            growth = f"  (x{(points[-1][1] / points[0][1]) ** (1 / decades):.1f} per 10x n)"
+        print(f"{case:<24} {cells}{growth}")
+
+
+def check_regressions(results: dict, baseline: dict, threshold: float, floor_us: float) -> list[str]:
+    print(f"\nvs baseline {baseline.get('meta', {}).get('commit')} (threshold +{threshold:.0%}):")
+    regressions = []
+    for key, new in results.items():
+        old = baseline.get("results_us", {}).get(key)
+        if not old:
+            continue
+        change = (new - old) / old
+        flag = ""
+        if change > threshold and new - old > floor_us:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"  {key:<36} {old:>12,.1f} -> {new:>12,.1f} µs ({change:+.1%}){flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10, 100, 1000, 10000],
+                        help="symptom catalogue sizes")
+    parser.add_argument("--followups", type=int, default=20, help="FollowUpRules per symptom")
+    parser.add_argument("--answers", type=int, default=60, help="answers in the determine_urgency consult")
+    parser.add_argument("--consult-symptoms", type=int, default=6)
+    parser.add_argument("--answer-sizes", type=int, nargs="*", default=[50, 200, 1000],
+                        help="answer list lengths for merge_related_answers")
+    parser.add_argument("--terms", type=int, default=20, help="extracted terms per normalize_and_match call")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing batch")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON to compare against; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--floor-us", type=float, default=1.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    results = {}
+    for size in args.sizes:
+        for case, sec in run_catalogue_cases(size, args, loop, random.Random(args.seed + size)).items():
+            results[f"{case}@{size}"] = round(sec * 1e6, 3)
+    for count in args.answer_sizes:
+        for case, sec in run_answer_cases(count, args, random.Random(args.seed + count)).items():
+            results[f"{case}@{count}"] = round(sec * 1e6, 3)
+    loop.close()
+
+    print_curves(results)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = check_regressions(results, json.load(f), args.threshold, args.floor_us)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        config = {k: v for k, v in vars(args).items() if k not in ("out", "baseline")}
+        with open(args.out, "w") as f:
+            json.dump({"meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                                "config": config}, "results_us": results}, f, indent=2)
+        print(f"results written to {args.out}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) past +{args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
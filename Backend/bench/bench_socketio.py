@@ -0,0 +1,309 @@
+"""
+End-to-end load test: N simulated patients through the Socket.IO flow
+(connect -> name/age/email -> symptoms -> answers until the summary),
+against a local server on SQLite with the fake LLM backend. Fully offline.
+
+    python bench/bench_socketio.py --patients 200 --concurrency 50 --out bench/results/socketio.json
+    python bench/bench_socketio.py --compare bench/results/socketio.json   # run again, diff against a baseline
+
+Reports consults/s, p50/p95/p99 per event and LLM calls per consult.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+import socketio
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SYMPTOMS = {
+    "chest pain": ["When did the pain start?", "Does it spread to your arm or jaw?", "Is it worse with exertion?"],
+    "shortness of breath": ["When does it happen?", "Can you lie flat?"],
+    "palpitations": ["How long do they last?", "Do you feel dizzy with them?"],
+    "dizziness": ["Have you fainted?", "Does it happen when standing up?"],
+    "leg swelling": ["Is it one leg or both?", "Is it worse in the evening?"],
+}
+FOLLOWUP_RULES = [
+    ("chest pain", "spread", ["yes", "arm", "jaw"], "urgent"),
+    ("chest pain", "exertion", ["yes"], "semi-urgent"),
+    ("dizziness", "fainted", ["yes"], "very_urgent"),
+    ("shortness of breath", "lie flat", ["no", "can't"], "urgent"),
+]
+ANSWERS = ["Since yesterday evening", "Yes, sometimes", "No", "About ten minutes", "Only when I climb stairs"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(samples: list[float]) -> dict:
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 2) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+
+def parse_llm_requests(text: str) -> dict[str, float]:
+    out = {}
+    for m in re.finditer(r'^consult_llm_requests_total\{outcome="(\w+)"\} ([\d.e+]+)$', text, re.M):
+        out[m.group(1)] = float(m.group(2))
+    return out
+
+
+# ---------------- Server ---------------- #
+def dump_log(path: str, tail: int = 4000):
+    with open(path) as f:
+        sys.stderr.write("--- server log (tail) ---\n" + f.read()[-tail:] + "\n")
+
+
+def start_server(port: int, workdir: str, args, log) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_LATENCY": args.llm_latency,
+        "LLM_FAKE_SEED": str(args.seed),
+        "LLM_CACHE_BACKEND": args.llm_cache,
+        "LLM_STREAMING": "false",
+        "LLM_RPM": "0",
+        "LLM_TPM": "0",
+        "NOTIFY_BACKEND": "off",
+        "SESSION_BACKEND": "memory",
+        "DB_SLOW_QUERY_MS": "1000",
+    }
+    env.pop("SOCKETIO_REDIS_URL", None)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:socket_app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(base: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                if (await http.get(f"{base}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def seed_rules(base: str):
+    async with httpx.AsyncClient(base_url=base) as http:
+        for key, questions in SYMPTOMS.items():
+            await http.post("/symptoms", json={"symptom_key": key, "follow_up_questions": questions})
+        for key, pattern, triggers, urgency in FOLLOWUP_RULES:
+            await http.post("/followup-rules", json={"symptom_key": key, "question_pattern": pattern,
+                                                     "trigger_values": triggers, "new_urgency": urgency})
+
+
+# ---------------- Patients ---------------- #
+class Patient:
+    def __init__(self, i: int, base: str, rng: random.Random, timings, timeout: float):
+        self.i = i
+        self.base = base
+        self.rng = rng
+        self.timings = timings
+        self.timeout = timeout
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.client.on("*", self._on_event)
+
+    async def _on_event(self, event, data=None):
+        await self.events.put((event, data))
+
+    async def wait_for(self, names: set[str], predicate=None):
+        while True:
+            event, data = await asyncio.wait_for(self.events.get(), self.timeout)
+            if event == "bot_message" and str((data or {}).get("msg", "")).startswith(("❌", "⚠️")):
+                raise RuntimeError(data["msg"])
+            if event in names and (predicate is None or predicate(data)):
+                return event, data
+
+    async def step(self, label: str, event: str, payload, names: set[str], predicate=None):
+        start = time.perf_counter()
+        await self.client.emit(event, payload)
+        got = await self.wait_for(names, predicate)
+        self.timings[label].append(time.perf_counter() - start)
+        return got
+
+    async def run(self):
+        start = time.perf_counter()
+        t0 = time.perf_counter()
+        await self.client.connect(self.base, transports=["websocket"])
+        await self.wait_for({"bot_message"})
+        self.timings["connect"].append(time.perf_counter() - t0)
+
+        await self.step("start_consult:name", "start_consult", {"name": f"Patient {self.i}"}, {"bot_message"})
+        await self.step("start_consult:age", "start_consult", {"age": str(self.rng.randint(30, 85))}, {"bot_message"})
+        await self.step("start_consult:email", "start_consult", {"email": f"patient{self.i}@bench.local"}, {"bot_message"})
+
+        picked = self.rng.sample(list(SYMPTOMS), self.rng.randint(1, 2))
+        event, data = await self.step("patient_symptoms", "patient_symptoms",
+                                      {"symptoms_text": "I have " + " and ".join(picked)},
+                                      {"ask_question", "bot_message"})
+        done = lambda d: "I have all your answers" in (d or {}).get("msg", "")
+        while event == "ask_question":
+            event, data = await self.step(
+                "answer_question", "answer_question",
+                {"symptoms": data.get("symptoms") or [], "questionText": data.get("text") or "",
+                 "answerText": self.rng.choice(ANSWERS)},
+                {"ask_question", "bot_message"},
+                predicate=lambda d: not isinstance(d, dict) or "question" in d or done(d),
+            )
+        if not done(data):
+            # the summary and the thank-you arrive as two bot_messages
+            await self.wait_for({"bot_message"}, done)
+        self.timings["consult"].append(time.perf_counter() - start)
+        await self.client.disconnect()
+
+
+async def run_load(base: str, args) -> dict:
+    timings = defaultdict(list)
+    errors = []
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        async with sem:
+            p = Patient(i, base, random.Random(args.seed + i), timings, args.timeout)
+            try:
+                await p.run()
+            except Exception as e:
+                errors.append(f"patient {i}: {type(e).__name__}: {e}")
+                if p.client.connected:
+                    await p.client.disconnect()
+
+    async with httpx.AsyncClient() as http:
+        before = parse_llm_requests((await http.get(f"{base}/metrics")).text)
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.patients)))
+        wall = time.perf_counter() - start
+        after = parse_llm_requests((await http.get(f"{base}/metrics")).text)
+
+    llm = {k: after.get(k, 0) - before.get(k, 0) for k in set(before) | set(after)}
+    completed = len(timings["consult"])
+    return {
+        "patients": args.patients,
+        "completed": completed,
+        "errors": errors[:20],
+        "error_count": len(errors),
+        "wall_s": round(wall, 3),
+        "throughput_consults_per_s": round(completed / wall, 3) if wall else 0.0,
+        "llm_calls": llm,
+        "llm_calls_per_consult": round(llm.get("ok", 0) / completed, 2) if completed else None,
+        "events": {k: summarize(v) for k, v in sorted(timings.items())},
+    }
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\nvs baseline {baseline.get('meta', {}).get('commit')}:")
+    rows = [("throughput_consults_per_s", current["throughput_consults_per_s"], baseline.get("throughput_consults_per_s")),
+            ("llm_calls_per_consult", current["llm_calls_per_consult"], baseline.get("llm_calls_per_consult"))]
+    for ev, stats in current["events"].items():
+        old = baseline.get("events", {}).get(ev)
+        if old:
+            rows.append((f"{ev} p95_ms", stats["p95_ms"], old["p95_ms"]))
+    for name, new, old in rows:
+        if old:
+            print(f"  {name:<32} {old:>10} -> {new:>10} ({(new - old) / old * 100:+.1f}%)")
+
+
+def print_report(result: dict):
+    print(f"{result['completed']}/{result['patients']} consults in {result['wall_s']}s "
+          f"-> {result['throughput_consults_per_s']} consults/s, "
+          f"{result['llm_calls_per_consult']} LLM calls/consult, {result['error_count']} errors")
+    print(f"{'event':<24} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for ev, s in result["events"].items():
+        print(f"{ev:<24} {s['count']:>6} {s['p50_ms']:>10} {s['p95_ms']:>10} {s['p99_ms']:>10}")
+    for e in result["errors"][:5]:
+        print("  !", e)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--patients", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=25)
+    ap.add_argument("--llm-latency", default="lognormal:300,0.5", help="fake LLM latency (see llm_backends)")
+    ap.add_argument("--llm-cache", default="off", choices=["off", "memory"])
+    ap.add_argument("--timeout", type=float, default=60.0, help="per-event timeout, seconds")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON to diff against")
+    args = ap.parse_args()
+
+    port = args.port or free_port()
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "server.log")
+        with open(log_path, "w") as log:
+            proc = start_server(port, workdir, args, log)
+            try:
+                await wait_ready(base, proc)
+                await seed_rules(base)
+                result = await run_load(base, args)
+                if result["error_count"]:
+                    dump_log(log_path)
+            except Exception:
+                dump_log(log_path)
+                raise
+            finally:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+    result["meta"] = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+    }
+    print_report(result)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,68 @@
 import os
+import time
+import random
+import asyncio
+import logging
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
+import metrics
 
 load_dotenv()
 
+logger = logging.getLogger("db")
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# dev | prod; every knob below can still be overridden on its own
+DB_PROFILE = os.getenv("DB_PROFILE", "dev")
+_PROFILES = {
+    "dev":  {"pool_size": 5,  "max_overflow": 5,  "pre_ping": False, "warmup": 0},
+    "prod": {"pool_size": 20, "max_overflow": 10, "pre_ping": True,  "warmup": 5},
+}
+_profile = _PROFILES.get(DB_PROFILE, _PROFILES["dev"])
+
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", _profile["pool_size"]))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", _profile["max_overflow"]))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", str(_profile["pre_ping"])).lower() in ("1", "true", "yes")
+# connections opened at startup so the first requests don't pay for the handshake
+DB_WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS", _profile["warmup"]))
+# SQLAlchemy's compiled-SQL cache and asyncpg's per-connection prepared statements
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1000"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+# behind pgbouncer in transaction mode prepared statements must be off
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# fraction of all statements logged at DEBUG with their duration (replaces echo)
+DB_LOG_SAMPLE_RATE = float(os.getenv("DB_LOG_SAMPLE_RATE", "0"))
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {"echo": DB_ECHO, "future": True, "query_cache_size": DB_QUERY_CACHE_SIZE}
+    if url.startswith("sqlite"):
+        return kwargs  # SQLite picks its own pool
+    kwargs.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if "+asyncpg" in url:
+        stmt_cache = 0 if DB_PGBOUNCER else DB_STATEMENT_CACHE_SIZE
+        kwargs["connect_args"] = {
+            "statement_cache_size": stmt_cache,
+            "prepared_statement_cache_size": stmt_cache,
+        }
+    return kwargs
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL))
 
 async_session_maker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
@@ -16,3 +71,37 @@ Base = declarative_base()
 async def get_db():
     async with async_session_maker() as session:
         yield session
+
+
+# ---------------- Query timing ---------------- #
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    ms = (time.perf_counter() - starts.pop()) * 1000
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    metrics.DB_QUERY_SECONDS.labels(verb).observe(ms / 1000)
+    if ms >= DB_SLOW_QUERY_MS:
+        metrics.DB_SLOW_QUERIES.inc()
+        logger.warning("Slow query (%.1f ms): %s", ms, " ".join(statement.split())[:500])
+    elif DB_LOG_SAMPLE_RATE and random.random() < DB_LOG_SAMPLE_RATE:
+        logger.debug("Query (%.1f ms): %s", ms, " ".join(statement.split())[:500])
+
+
+async def warm_up(n: int = DB_WARMUP_CONNECTIONS):
+    """Open `n` pooled connections concurrently; they stay in the pool."""
+    if n <= 0:
+        return
+
+    async def _ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(_ping() for _ in range(n)))
+    logger.info("Warmed up %d DB connections", n)
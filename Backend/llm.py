@@ -1,12 +1,32 @@
 # llm.py
 import os
 import json
+import asyncio
+import logging
 import httpx
-import json
+import llm_cache
+import llm_limits
+import metrics
+from llm_limits import LLMUnavailable
+from llm_backends import LLMBackend, build_backend
+from prefilter import prefill_field, prefill_symptoms
+
+logger = logging.getLogger("llm")
 
-OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-OPENAI_API = "https://api.openai.com/v1/chat/completions"
+
+# Stream rephrased bot messages to the client token by token
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+
+# Max LLM calls in flight for a single fan-out (explain notes, rule judgements)
+LLM_FANOUT_LIMIT = int(os.getenv("LLM_FANOUT_LIMIT", "8"))
+LLM_FANOUT_TIMEOUT = float(os.getenv("LLM_FANOUT_TIMEOUT", "15.0"))
+# One structured call per answer (vagueness + notes + rule verdicts) instead of 2+N+M
+LLM_BATCH_EVAL = os.getenv("LLM_BATCH_EVAL", "true").lower() in ("1", "true", "yes")
+
+# Transport selected by LLM_BACKEND (see llm_backends); swap with set_backend()
+_backend: LLMBackend | None = None
+_fanout_sem: asyncio.Semaphore | None = None
 
 SYSTEM_PROMPT = """
 You are a friendly, concise assistant that only rewrites or wraps follow-up questions provided by the system.
@@ -17,8 +37,57 @@ RULES:
 4. Do not give medical advice or interpret answers.
 """
 
-async def call_llm(prompt: str, system: str = "You are a helpful assistant.", max_tokens: int = 150, temperature: float = 0.2) -> str:
-    headers = {"Authorization": f"Bearer {OPENAI_KEY}", "Content-Type": "application/json"}
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = build_backend()
+    return _backend
+
+
+def set_backend(backend: LLMBackend) -> LLMBackend | None:
+    """Replace the active backend (benchmarks, load tests); returns the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+def _cache_model() -> str:
+    # keep fake-backend completions out of the real cache namespace
+    backend = get_backend()
+    return MODEL if backend.name == "openai" else f"{backend.name}:{MODEL}"
+
+
+async def init_client():
+    """Called once from the app startup hook; safe to call again."""
+    await get_backend().start()
+
+
+async def close_client():
+    if _backend is not None:
+        await _backend.close()
+
+
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "call_llm")
+async def call_llm(prompt: str, system: str = "You are a helpful assistant.", max_tokens: int = 150, temperature: float = 0.2, timeout: float | None = None, use_cache: bool | None = None, response_format: dict | None = None, kind: str = "other") -> str:
+    """
+    use_cache=None caches only deterministic (temperature 0) prompts;
+    callers pass True for prompts whose output may be reused as-is.
+    response_format is passed through (e.g. a json_schema for structured output).
+    kind names the prompt for backends (payload metadata; not sent upstream).
+    """
+    cache = llm_cache.cache
+    if use_cache is None:
+        use_cache = temperature == 0
+    key = None
+    if use_cache and cache is not None:
+        extra = {"response_format": response_format} if response_format is not None else {}
+        key = llm_cache.make_key(_cache_model(), system, prompt, max_tokens=max_tokens, temperature=temperature, **extra)
+        cached = await cache.get(key)
+        if cached is not None:
+            metrics.LLM_REQUESTS.labels("cache_hit").inc()
+            return cached
+
     payload = {
         "model": MODEL,
         "messages": [
@@ -26,16 +95,144 @@ async def call_llm(prompt: str, system: str = "You are a helpful assistant.", ma
             {"role": "user", "content": prompt}
         ],
         "max_tokens": max_tokens,
-        "temperature": temperature
+        "temperature": temperature,
+        "metadata": {"kind": kind},
     }
+    if response_format is not None:
+        payload["response_format"] = response_format
+
+    backend = get_backend()
+    estimated = llm_limits.estimate_tokens(system, prompt) + max_tokens
+    try:
+        for attempt in range(llm_limits.LLM_MAX_RETRIES + 1):
+            try:
+                # every attempt is admitted on its own: buckets, per-sid cap and breaker
+                async with llm_limits.admit(estimated):
+                    resp = await backend.complete(payload, timeout=timeout)
+                break
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                if attempt == llm_limits.LLM_MAX_RETRIES or not llm_limits.is_retryable(e):
+                    raise
+                metrics.LLM_REQUESTS.labels("retry").inc()
+                delay = llm_limits.retry_delay(e, attempt)
+                logger.info("LLM call failed (%s), retry %d in %.2fs", e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+    except LLMUnavailable:
+        metrics.LLM_REQUESTS.labels("unavailable").inc()
+        raise
+    except Exception:
+        metrics.LLM_REQUESTS.labels("error").inc()
+        raise
+    metrics.LLM_REQUESTS.labels("ok").inc()
+    _record_usage(resp.get("usage"), estimated)
+    content = resp["choices"][0]["message"]["content"].strip()
+    if key is not None:
+        await cache.set(key, content)
+    return content
+
+def _record_usage(usage: dict | None, estimated: int):
+    usage = usage or {}
+    metrics.LLM_TOKENS.labels(MODEL, "prompt").inc(usage.get("prompt_tokens") or 0)
+    metrics.LLM_TOKENS.labels(MODEL, "completion").inc(usage.get("completion_tokens") or 0)
+    if usage.get("total_tokens"):
+        llm_limits.tokens_bucket.adjust(estimated - usage["total_tokens"])
+
+async def stream_llm(prompt: str, system: str = "You are a helpful assistant.", max_tokens: int = 150, temperature: float = 0.2, timeout: float | None = None, use_cache: bool = False, kind: str = "other"):
+    """
+    Async generator over the chat-completions SSE stream, yielding text
+    deltas as they arrive. A cached completion is yielded as one chunk.
+    """
+    cache = llm_cache.cache
+    key = None
+    if use_cache and cache is not None:
+        key = llm_cache.make_key(_cache_model(), system, prompt, max_tokens=max_tokens, temperature=temperature)
+        cached = await cache.get(key)
+        if cached is not None:
+            metrics.LLM_REQUESTS.labels("cache_hit").inc()
+            yield cached
+            return
+
+    payload = {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "metadata": {"kind": kind},
+    }
+
+    parts = []
+    estimated = llm_limits.estimate_tokens(system, prompt) + max_tokens
+    try:
+        for attempt in range(llm_limits.LLM_MAX_RETRIES + 1):
+            try:
+                async with llm_limits.admit(estimated):
+                    async for delta in get_backend().stream(payload, timeout=timeout,
+                                                            on_usage=lambda u: _record_usage(u, estimated)):
+                        parts.append(delta)
+                        yield delta
+                break
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                # no retries once streaming: text may already be on the client
+                if parts or attempt == llm_limits.LLM_MAX_RETRIES or not llm_limits.is_retryable(e):
+                    raise
+                metrics.LLM_REQUESTS.labels("retry").inc()
+                delay = llm_limits.retry_delay(e, attempt)
+                logger.info("LLM stream failed (%s), retry %d in %.2fs", e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+    except LLMUnavailable:
+        metrics.LLM_REQUESTS.labels("unavailable").inc()
+        raise
+    except Exception:
+        metrics.LLM_REQUESTS.labels("error").inc()
+        raise
+    metrics.LLM_REQUESTS.labels("ok").inc()
+
+    if key is not None and parts:
+        await cache.set(key, "".join(parts).strip())
 
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        r = await client.post(OPENAI_API, headers=headers, json=payload)
-        r.raise_for_status()
-        resp = r.json()
-        return resp["choices"][0]["message"]["content"].strip()
 
+async def gather_limited(coros, timeout: float | None = LLM_FANOUT_TIMEOUT, default=None) -> list:
+    """
+    Run independent LLM coroutines concurrently under a shared semaphore.
+    Each call gets its own timeout; a call that fails or times out yields
+    `default` instead of failing the whole batch. Results keep input order.
+    """
+    global _fanout_sem
+    if _fanout_sem is None:
+        _fanout_sem = asyncio.Semaphore(LLM_FANOUT_LIMIT)
+
+    async def _run(coro):
+        async with _fanout_sem:
+            try:
+                if timeout is None:
+                    return await coro
+                return await asyncio.wait_for(coro, timeout)
+            except asyncio.TimeoutError:
+                logger.warning("LLM call timed out after %.1fs", timeout)
+                return default
+            except Exception as e:
+                logger.warning("LLM call failed: %s", e)
+                return default
+
+    # wrap every coroutine up front so unscheduled ones are closed if we get cancelled
+    tasks = [asyncio.ensure_future(_run(c)) for c in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        for t in tasks:
+            t.cancel()
+        raise
+
+
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "extract_symptoms")
 async def extract_symptoms(user_text: str, known_symptoms: list[str]) -> list[str]:
+    local = prefill_symptoms(user_text, known_symptoms)
+    if local is not None:
+        return local
+
     prompt = f"""
     Extract from this text all symptoms that match or are similar to this known list:
     {", ".join(known_symptoms)}.
@@ -45,7 +242,11 @@ async def extract_symptoms(user_text: str, known_symptoms: list[str]) -> list[st
     Respond with ONLY a JSON list of symptoms exactly as in the known list, if present.
     Example: ["chest pain", "shortness of breath"]
     """
-    raw = await call_llm(prompt, system="You are a strict symptom extractor.", max_tokens=150, temperature=0.0)
+    try:
+        raw = await call_llm(prompt, system="You are a strict symptom extractor.", max_tokens=150, temperature=0.0,
+                             kind="extract_symptoms")
+    except LLMUnavailable:
+        return []
     try:
         parsed = json.loads(raw)
         if isinstance(parsed, list) and all(isinstance(x, str) for x in parsed):
@@ -61,13 +262,33 @@ async def extract_symptoms(user_text: str, known_symptoms: list[str]) -> list[st
                 pass
     return []
 
-async def rephrase_followup(patient_name: str, follow_up_question: str, prev_user_text: str | None = None) -> str:
+def _rephrase_prompt(patient_name: str, follow_up_question: str, prev_user_text: str | None = None) -> str:
     prompt_user = f"Patient name: {patient_name}\nFollow-up question (do not change meaning): {follow_up_question}\n"
     if prev_user_text:
         prompt_user += f"Patient said previously: {prev_user_text}\n"
     prompt_user += "Return a single short message that asks this question politely."
-    return await call_llm(prompt_user, system=SYSTEM_PROMPT, max_tokens=80, temperature=0.2)
+    return prompt_user
 
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "rephrase_followup")
+async def rephrase_followup(patient_name: str, follow_up_question: str, prev_user_text: str | None = None) -> str:
+    prompt_user = _rephrase_prompt(patient_name, follow_up_question, prev_user_text)
+    # Without patient context the wording only depends on the inputs, so it's safe to reuse
+    try:
+        return await call_llm(prompt_user, system=SYSTEM_PROMPT, max_tokens=80, temperature=0.2,
+                              use_cache=prev_user_text is None, kind="rephrase")
+    except (LLMUnavailable, httpx.HTTPError) as e:
+        # the system text is already a valid question; keep the chat moving
+        logger.warning("Rephrase unavailable, sending system text: %s", e)
+        return follow_up_question
+
+async def rephrase_followup_stream(patient_name: str, follow_up_question: str, prev_user_text: str | None = None):
+    """Streaming variant of rephrase_followup; yields text deltas."""
+    prompt_user = _rephrase_prompt(patient_name, follow_up_question, prev_user_text)
+    async for delta in stream_llm(prompt_user, system=SYSTEM_PROMPT, max_tokens=80, temperature=0.2,
+                                  use_cache=prev_user_text is None, kind="rephrase"):
+        yield delta
+
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "explain_answer")
 async def explain_answer(question: str, answer: str, symptom: str) -> str:
     prompt = (
         f"Patient symptom: {symptom}\n"
@@ -77,8 +298,9 @@ async def explain_answer(question: str, answer: str, symptom: str) -> str:
         "Use clinical wording (e.g., 'acute onset', 'intermittent', 'worse with exertion'). "
         "If the answer is vague, summarize the gist and mention uncertainty."
     )
-    return await call_llm(prompt, system="You are a medical scribe.", max_tokens=80, temperature=0.3)
+    return await call_llm(prompt, system="You are a medical scribe.", max_tokens=80, temperature=0.3, kind="explain")
 
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "is_vague_answer")
 async def is_vague_answer(question: str, answer: str) -> tuple[bool, str | None]:
     """
     Detect vague answers. If vague, suggest a clarifying follow-up.
@@ -96,18 +318,142 @@ async def is_vague_answer(question: str, answer: str) -> tuple[bool, str | None]
     or
     {{"vague": false}}
     """
-    raw = await call_llm(prompt, system="You are a strict JSON generator.", max_tokens=100, temperature=0.3)
+    try:
+        raw = await call_llm(prompt, system="You are a strict JSON generator.", max_tokens=100, temperature=0.3,
+                             kind="vague")
+    except LLMUnavailable:
+        return False, None
     try:
         parsed = json.loads(raw)
         return parsed.get("vague", False), parsed.get("clarify")
     except Exception:
         return False, None
 
-async def extract_field(field: str, user_text: str) -> str | None:
+def parse_json_object(raw: str) -> dict | None:
+    """
+    Lenient JSON-object parse for model output: tolerates ``` fences and
+    prose around the object. Returns None if no object can be recovered.
+    """
+    if not raw:
+        return None
+    text = raw.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.lower().startswith("json"):
+            text = text[4:]
+    for candidate in (text, text[text.find("{"): text.rfind("}") + 1] if "{" in text else ""):
+        try:
+            parsed = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    return None
+
+EVALUATE_SYSTEM = """
+You are a medical scribe reviewing one patient answer in a cardiology intake chat.
+Do not give medical advice. Output only JSON matching the schema.
+"""
+
+EVALUATE_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "answer_evaluation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "additionalProperties": False,
+            "required": ["vague", "clarify", "notes", "rule_matches"],
+            "properties": {
+                "vague": {"type": "boolean"},
+                "clarify": {"type": ["string", "null"]},
+                "notes": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": ["symptom", "note"],
+                        "properties": {"symptom": {"type": "string"}, "note": {"type": "string"}},
+                    },
+                },
+                "rule_matches": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "required": ["rule_id", "match"],
+                        "properties": {"rule_id": {"type": "integer"}, "match": {"type": "boolean"}},
+                    },
+                },
+            },
+        },
+    },
+}
+
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "evaluate_answer")
+async def evaluate_answer(question: str, answer: str, symptoms: list[str], rules=()) -> dict | None:
+    """
+    Combined is_vague_answer + explain_answer (per symptom) + rule judgement
+    (per candidate FollowUpRule) in one schema-constrained call. Returns
+    {"vague", "clarify", "notes": {symptom: note}, "rule_matches": {rule_id: bool}},
+    or None when the call or parse fails so callers can fall back to the
+    individual calls. Symptoms or rules missing from the reply are simply absent.
+    """
+    rule_lines = "\n".join(
+        f"- rule_id {r.id}: symptom {r.symptom_key}; question pattern {r.question_pattern}; "
+        f"trigger values {r.trigger_values}; urgency {r.new_urgency}"
+        for r in rules
+    ) or "- (none)"
+    prompt = f"""
+    The bot asked: "{question}"
+    Patient answered: "{answer}"
+    Symptoms this answer is about: {", ".join(symptoms) or "(none)"}
+
+    1. vague: is the answer vague or unclear? If so, clarify is ONE clarifying question, else null.
+    2. notes: for each symptom, rewrite the answer as a concise clinician-friendly note (1-2 short sentences,
+       clinical wording such as 'acute onset', 'intermittent', 'worse with exertion'; mention uncertainty if vague).
+    3. rule_matches: for each rule below, does the answer satisfy the rule's intent even if it doesn't
+       literally contain the trigger values?
+    {rule_lines}
+    """
+    try:
+        raw = await call_llm(prompt, system=EVALUATE_SYSTEM, max_tokens=120 + 80 * len(symptoms) + 20 * len(rules),
+                             temperature=0.0, response_format=EVALUATE_SCHEMA, kind="evaluate")
+    except Exception as e:
+        logger.warning("evaluate_answer call failed: %s", e)
+        return None
+
+    data = parse_json_object(raw)
+    if data is None or not isinstance(data.get("vague"), bool):
+        logger.warning("evaluate_answer returned unparseable output")
+        return None
+    notes, verdicts = {}, {}
+    for item in data.get("notes") or []:
+        if isinstance(item, dict) and item.get("symptom") in symptoms and isinstance(item.get("note"), str):
+            notes[item["symptom"]] = item["note"].strip()
+    rule_ids = {r.id for r in rules}
+    for item in data.get("rule_matches") or []:
+        if isinstance(item, dict) and item.get("rule_id") in rule_ids and isinstance(item.get("match"), bool):
+            verdicts[item["rule_id"]] = item["match"]
+    clarify = data.get("clarify")
+    return {
+        "vague": data["vague"],
+        "clarify": clarify if isinstance(clarify, str) and clarify.strip() else None,
+        "notes": notes,
+        "rule_matches": verdicts,
+    }
+
+@metrics.timed(metrics.LLM_FUNCTION_SECONDS, "extract_field")
+async def extract_field(field: str, user_text: str, known_symptoms=()) -> str | None:
     """
     Use LLM to extract a specific field (name, age, or email) from user_text.
     Returns a clean string or None if not found.
+    Unambiguous input (a bare email, "42", "twenty four", "my name is Ann") is handled locally.
     """
+    local = prefill_field(field, user_text, known_symptoms)
+    if local is not None:
+        return local
+
     prompt = f"""
     Extract the {field} from this patient response: "{user_text}".
 
@@ -118,7 +464,11 @@ async def extract_field(field: str, user_text: str) -> str | None:
     - Respond in JSON format: {{"{field}": "value"}}
     """
 
-    raw = await call_llm(prompt, system="You are a strict extractor that only outputs JSON.", max_tokens=50)
+    try:
+        raw = await call_llm(prompt, system="You are a strict extractor that only outputs JSON.", max_tokens=50,
+                             kind="extract_field")
+    except LLMUnavailable:
+        return None
 
     try:
         data = json.loads(raw)
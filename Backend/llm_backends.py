@@ -0,0 +1,293 @@
+# llm_backends.py
+"""
+Chat-completion transports behind llm.call_llm / llm.stream_llm.
+
+    LLM_BACKEND=openai   # default, real API
+    LLM_BACKEND=fake     # in-process, deterministic, offline (load tests, benchmarks)
+
+Both take an OpenAI-style payload and return an OpenAI-style response, so
+caching, limits and parsing in llm.py don't care which one is active.
+payload["metadata"]["kind"] names the prompt (see FakeBackend.KINDS); it is
+for the backend only and is not sent upstream.
+"""
+import os
+import re
+import json
+import math
+import random
+import asyncio
+import logging
+from collections import Counter
+import httpx
+
+logger = logging.getLogger("llm")
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")  # openai | fake
+
+# Shared HTTP client (pool settings are env-driven)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20.0"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5.0"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30.0"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Fake backend: "fixed:200", "uniform:100,400", "lognormal:300,0.5" (median ms, sigma),
+# or a JSON object of those per prompt kind with a "default" entry
+LLM_FAKE_LATENCY = os.getenv("LLM_FAKE_LATENCY", "lognormal:300,0.5")
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+# JSON file of {prompt kind: reply or [replies, cycled]} overriding the built-in replies
+LLM_FAKE_SCRIPT = os.getenv("LLM_FAKE_SCRIPT")
+LLM_FAKE_SEED = os.getenv("LLM_FAKE_SEED")
+
+
+class LLMBackend:
+    name = "base"
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def complete(self, payload: dict, timeout: float | None = None) -> dict:
+        raise NotImplementedError
+
+    async def stream(self, payload: dict, timeout: float | None = None, on_usage=None):
+        """Async generator of text deltas; on_usage(usage_dict) is called once if usage is known."""
+        raise NotImplementedError
+        yield
+
+
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, api_key: str | None = None, url: str | None = None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.url = url or os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+        self._client: httpx.AsyncClient | None = None
+
+    async def start(self) -> httpx.AsyncClient:
+        """
+        Create the long-lived pooled client used by every LLM call.
+        Called once from the app startup hook; safe to call again.
+        """
+        if self._client is not None and not self._client.is_closed:
+            return self._client
+
+        http2 = LLM_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401  (httpx needs the h2 extra for HTTP/2)
+            except ImportError:
+                logger.warning("LLM_HTTP2 is set but the 'h2' package is missing; falling back to HTTP/1.1")
+                http2 = False
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        # Lazily created for code paths that run outside the app lifespan (scripts, workers)
+        if self._client is None or self._client.is_closed:
+            return await self.start()
+        return self._client
+
+    @staticmethod
+    def _body(payload: dict) -> dict:
+        return {k: v for k, v in payload.items() if k != "metadata"}
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    @staticmethod
+    def _timeout(timeout):
+        # Per-call timeout overrides the pool default (e.g. short budget for vagueness checks)
+        return httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT) if timeout is not None else httpx.USE_CLIENT_DEFAULT
+
+    async def complete(self, payload: dict, timeout: float | None = None) -> dict:
+        client = await self._get_client()
+        r = await client.post(self.url, headers=self._headers(), json=self._body(payload),
+                              timeout=self._timeout(timeout))
+        r.raise_for_status()
+        return r.json()
+
+    async def stream(self, payload: dict, timeout: float | None = None, on_usage=None):
+        client = await self._get_client()
+        body = {**self._body(payload), "stream": True, "stream_options": {"include_usage": True}}
+        async with client.stream("POST", self.url, headers=self._headers(), json=body,
+                                 timeout=self._timeout(timeout)) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                    if chunk.get("usage") and on_usage:
+                        on_usage(chunk["usage"])  # final chunk, empty choices
+                    delta = chunk["choices"][0]["delta"].get("content")
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
+
+
+# ---------------- Fake ---------------- #
+def parse_latency(spec: str):
+    """'lognormal:300,0.5' -> callable(rng) returning seconds."""
+    spec = (spec or "0").strip()
+    kind, _, args = spec.partition(":")
+    nums = [float(x) for x in args.split(",") if x.strip()] if args else []
+    if kind == "fixed":
+        return lambda rng: nums[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(nums[0], nums[1]) / 1000
+    if kind == "lognormal":
+        mu = math.log(nums[0])
+        return lambda rng: rng.lognormvariate(mu, nums[1]) / 1000
+    return lambda rng: float(kind) / 1000
+
+
+class FakeBackend(LLMBackend):
+    """
+    Offline stand-in that answers each prompt kind llm.py sends with a
+    plausible, deterministic reply after a sampled delay. Counts calls per
+    prompt kind so benchmarks can report LLM calls per consult.
+    """
+    name = "fake"
+
+    KNOWN_LIST_RE = re.compile(r"known list:\s*(.*?)\.\s*\n", re.S)
+    TEXT_RE = re.compile(r'Text:\s*"(.*)"', re.S)
+    FIELD_RE = re.compile(r'Extract the (\w+) from this patient response: "(.*?)"\.', re.S)
+    FOLLOWUP_RE = re.compile(r"Follow-up question \(do not change meaning\): (.*)")
+    ANSWER_RE = re.compile(r'(?:Patient answer|Patient answered): "(.*?)"', re.S)
+    SYMPTOMS_RE = re.compile(r"Symptoms this answer is about: (.*)")
+    RULE_ID_RE = re.compile(r"rule_id (\d+)")
+    EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+    KINDS = ("rephrase", "extract_symptoms", "extract_field", "vague", "explain", "judge", "evaluate")
+
+    def __init__(self, latency: str = LLM_FAKE_LATENCY, error_rate: float = LLM_FAKE_ERROR_RATE,
+                 script: dict | None = None, seed=LLM_FAKE_SEED):
+        self.rng = random.Random(seed)
+        if latency.strip().startswith("{"):
+            specs = json.loads(latency)
+            self.latency = {k: parse_latency(v) for k, v in specs.items()}
+        else:
+            self.latency = {"default": parse_latency(latency)}
+        self.error_rate = error_rate
+        if script is None and LLM_FAKE_SCRIPT:
+            with open(LLM_FAKE_SCRIPT) as f:
+                script = json.load(f)
+        self.script = script or {}
+        self._script_pos = Counter()
+        self.calls = Counter()
+
+    def classify(self, payload: dict) -> str:
+        kind = (payload.get("metadata") or {}).get("kind")
+        return kind if kind in self.KINDS else "other"
+
+    def reply(self, kind: str, payload: dict) -> str:
+        if kind in self.script:
+            entry = self.script[kind]
+            if isinstance(entry, list):
+                i = self._script_pos[kind]
+                self._script_pos[kind] += 1
+                entry = entry[i % len(entry)]
+            return entry if isinstance(entry, str) else json.dumps(entry)
+
+        prompt = payload["messages"][-1]["content"]
+        if kind == "rephrase":
+            m = self.FOLLOWUP_RE.search(prompt)
+            return m.group(1).strip() if m else "Could you tell me more?"
+        if kind == "extract_symptoms":
+            known = self.KNOWN_LIST_RE.search(prompt)
+            text = self.TEXT_RE.search(prompt)
+            known = [k.strip() for k in known.group(1).split(",")] if known else []
+            text = text.group(1).lower() if text else ""
+            return json.dumps([k for k in known if k and k.lower() in text])
+        if kind == "extract_field":
+            m = self.FIELD_RE.search(prompt)
+            field, text = (m.group(1), m.group(2)) if m else ("value", "")
+            if field == "age":
+                value = next(iter(re.findall(r"\d+", text)), None)
+            elif field == "email":
+                value = next(iter(self.EMAIL_RE.findall(text)), None)
+            else:
+                value = text.strip().title() or None
+            return json.dumps({field: value})
+        if kind == "vague":
+            return json.dumps({"vague": False})
+        if kind == "explain":
+            m = self.ANSWER_RE.search(prompt)
+            return f"Patient reports: {m.group(1) if m else 'no detail'}."
+        if kind == "judge":
+            return json.dumps({"match": False})
+        if kind == "evaluate":
+            m = self.ANSWER_RE.search(prompt)
+            answer = m.group(1) if m else ""
+            sm = self.SYMPTOMS_RE.search(prompt)
+            symptoms = [s.strip() for s in sm.group(1).split(",")] if sm and sm.group(1) != "(none)" else []
+            return json.dumps({
+                "vague": False,
+                "clarify": None,
+                "notes": [{"symptom": s, "note": f"Patient reports: {answer}."} for s in symptoms],
+                "rule_matches": [{"rule_id": int(r), "match": False} for r in self.RULE_ID_RE.findall(prompt)],
+            })
+        return "OK"
+
+    async def _delay(self, kind: str):
+        sample = self.latency.get(kind, self.latency.get("default"))
+        if sample:
+            await asyncio.sleep(max(0.0, sample(self.rng)))
+        if self.error_rate and self.rng.random() < self.error_rate:
+            req = httpx.Request("POST", "http://fake-llm/v1/chat/completions")
+            raise httpx.HTTPStatusError("fake upstream error", request=req, response=httpx.Response(503, request=req))
+
+    async def complete(self, payload: dict, timeout: float | None = None) -> dict:
+        kind = self.classify(payload)
+        self.calls[kind] += 1
+        await self._delay(kind)
+        content = self.reply(kind, payload)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": self._usage(payload, content),
+        }
+
+    async def stream(self, payload: dict, timeout: float | None = None, on_usage=None):
+        kind = self.classify(payload)
+        self.calls[kind] += 1
+        await self._delay(kind)
+        content = self.reply(kind, payload)
+        for i, w in enumerate(content.split(" ")):
+            yield w if i == 0 else " " + w
+        if on_usage:
+            on_usage(self._usage(payload, content))
+
+    @staticmethod
+    def _usage(payload: dict, content: str) -> dict:
+        prompt_tokens = sum(len(m["content"]) for m in payload["messages"]) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+
+def build_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    if name == "fake":
+        logger.info("Using fake LLM backend (latency %s)", LLM_FAKE_LATENCY)
+        return FakeBackend()
+    return OpenAIBackend()
@@ -0,0 +1,178 @@
+# llm_cache.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+from collections import OrderedDict
+import metrics
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")  # memory | sqlite | off
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TRIM_EVERY = int(os.getenv("LLM_CACHE_TRIM_EVERY", "64"))  # sqlite: writes between trims
+
+
+def make_key(model: str, system: str, prompt: str, **params) -> str:
+    """
+    Stable cache key over everything that affects the completion.
+    """
+    blob = json.dumps(
+        {"model": model, "system": system, "prompt": prompt, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _counters(backend: str) -> dict:
+    return {event: metrics.LLM_CACHE.labels(backend, event) for event in ("hit", "miss", "set", "eviction")}
+
+
+class MemoryCache:
+    """
+    In-process LRU with a per-entry TTL.
+    """
+
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._count = _counters("memory")
+        self._data: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> str | None:
+        item = self._data.get(key)
+        if item is None:
+            self._count["miss"].inc()
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self._count["miss"].inc()
+            return None
+        self._data.move_to_end(key)
+        self._count["hit"].inc()
+        return value
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        self._count["set"].inc()
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self._count["eviction"].inc()
+
+    async def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    Shared cache for several workers on one host. Uses wall-clock expiry
+    since entries outlive a single process. The table is trimmed every
+    `trim_every` writes per worker, so it may run that many rows per
+    worker over max_size in between.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL,
+                 trim_every: int = LLM_CACHE_TRIM_EVERY):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.trim_every = max(1, trim_every)
+        self._writes = 0
+        self._count = _counters("sqlite")
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _get(self, key: str):
+        conn = self._connect()
+        try:
+            now = time.time()
+            row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+        finally:
+            conn.close()
+
+    def _set(self, key: str, value: str, ttl: float, trim: bool):
+        conn = self._connect()
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            evicted = 0
+            if trim:
+                conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+                # then least recently used rows past the size limit
+                cur = conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                )
+                evicted = cur.rowcount or 0
+            conn.commit()
+            return evicted
+        finally:
+            conn.close()
+
+    async def get(self, key: str) -> str | None:
+        value = await asyncio.to_thread(self._get, key)
+        if value is None:
+            self._count["miss"].inc()
+        else:
+            self._count["hit"].inc()
+        return value
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        self._writes += 1
+        trim = self._writes % self.trim_every == 0
+        evicted = await asyncio.to_thread(self._set, key, value, ttl or self.ttl, trim)
+        self._count["set"].inc()
+        self._count["eviction"].inc(evicted)
+
+    async def clear(self):
+        def _clear():
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            conn.close()
+        await asyncio.to_thread(_clear)
+
+
+def build_cache():
+    if LLM_CACHE_BACKEND == "off":
+        return None
+    if LLM_CACHE_BACKEND == "sqlite":
+        return SQLiteCache()
+    return MemoryCache()
+
+
+cache = build_cache()
+
@@ -0,0 +1,214 @@
+# llm_limits.py
+import os
+import time
+import random
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import httpx
+import metrics
+
+logger = logging.getLogger("llm")
+
+# Global budget in front of the upstream (0 disables a bucket)
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+# Longest a call waits for budget before it is treated as unavailable
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+# LLM calls in flight for one socket (evaluation, prefetch, fallbacks)
+LLM_SID_CONCURRENCY = int(os.getenv("LLM_SID_CONCURRENCY", "3"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.5"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "8"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Socket handlers set this so nested LLM calls (gather_limited, prefetch tasks) count against their sid
+current_sid: ContextVar[str | None] = ContextVar("llm_sid", default=None)
+
+
+class LLMUnavailable(Exception):
+    """Raised instead of calling upstream while the breaker is open or the budget is exhausted."""
+
+
+class TokenBucket:
+    """
+    Refills `per_minute` units evenly; waiters are served in arrival order.
+    A caller reserves its units up front, running the bucket negative if it
+    has to, then sleeps until they have refilled, so later callers queue
+    behind earlier reservations without anyone sleeping on a lock.
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float = 1, timeout: float | None = None):
+        if self.rate <= 0:
+            return
+        n = min(n, self.capacity)
+        # no await between the check and the reservation, so no lock is needed
+        self._refill()
+        wait = max(0.0, (n - self.tokens) / self.rate)
+        if timeout is not None and wait > timeout:
+            raise LLMUnavailable("LLM budget exhausted")
+        self.tokens -= n
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.adjust(n)
+                raise
+
+    def adjust(self, delta: float):
+        """Give back (or take) the difference between estimated and actual usage."""
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive upstream failures; after
+    `cooldown` one trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._trial = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._trial = False
+        if self.state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("LLM circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                logger.warning("LLM circuit opened after %d failures", self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        # a half-open trial that was cancelled decides nothing
+        self._trial = False
+
+
+requests_bucket = TokenBucket(LLM_RPM)
+tokens_bucket = TokenBucket(LLM_TPM)
+breaker = CircuitBreaker()
+_sid_sems: weakref.WeakValueDictionary[str, asyncio.Semaphore] = weakref.WeakValueDictionary()
+
+
+def _sid_semaphore(sid: str) -> asyncio.Semaphore:
+    sem = _sid_sems.get(sid)
+    if sem is None:
+        sem = asyncio.Semaphore(LLM_SID_CONCURRENCY)
+        _sid_sems[sid] = sem
+    return sem
+
+
+def estimate_tokens(*texts: str) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return sum(len(t or "") for t in texts) // 4 + 1
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(exc, httpx.TransportError)
+
+
+def retry_delay(exc: BaseException, attempt: int) -> float:
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(LLM_RETRY_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** attempt))
+
+
+@asynccontextmanager
+async def admit(estimated_tokens: int):
+    """
+    Gate one upstream call: breaker check, per-sid cap, request and token
+    buckets. The outcome of the block feeds the breaker; only retryable
+    upstream errors count as failures.
+    """
+    if not breaker.allow():
+        raise LLMUnavailable("LLM circuit open")
+    sid = current_sid.get()
+    sem = _sid_semaphore(sid) if sid else None
+    try:
+        if sem is not None:
+            await sem.acquire()
+        try:
+            await requests_bucket.acquire(1, LLM_QUEUE_TIMEOUT)
+            try:
+                await tokens_bucket.acquire(estimated_tokens, LLM_QUEUE_TIMEOUT)
+            except (LLMUnavailable, asyncio.CancelledError):
+                # the call never goes out, so it must not cost a request either
+                requests_bucket.adjust(1)
+                raise
+            yield
+        finally:
+            if sem is not None:
+                sem.release()
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except LLMUnavailable:
+        breaker.release()
+        raise
+    except Exception as e:
+        if is_retryable(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    else:
+        breaker.record_success()
+
+
+def observe_metrics():
+    """Sample breaker and bucket state into the metrics registry (called per scrape)."""
+    for state in ("closed", "half_open", "open"):
+        metrics.LLM_BREAKER_STATE.labels(state).set(1 if breaker.state == state else 0)
+    metrics.LLM_BREAKER_FAILURES.set(breaker.failures)
+    for name, bucket in (("requests", requests_bucket), ("tokens", tokens_bucket)):
+        if bucket.rate > 0:
+            bucket._refill()
+            metrics.LLM_BUDGET.labels(name).set(round(bucket.tokens, 1))
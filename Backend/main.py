@@ -1,6 +1,8 @@
+import os
 import socketio
-from fastapi import FastAPI, Depends, Body
-from db import engine, Base, get_db, async_session_maker as AsyncSessionLocal
+from fastapi import FastAPI, Depends, Body, Query, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse
+from db import engine, Base, get_db, async_session_maker as AsyncSessionLocal, warm_up
 import schemas
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -8,23 +10,38 @@ from sqlalchemy.orm import selectinload
 import models
 from models import Patient, Consult, SymptomRule
 from fastapi.middleware.cors import CORSMiddleware
-from difflib import get_close_matches
+from matcher import SymptomMatcher, get_matcher
 import traceback
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_, literal
+import uuid
+import secrets
 import logging
 from fastapi import HTTPException
-from models import FollowUpRule
+from models import FollowUpRule, RuleVersion
 from schemas import FollowUpRuleOut
-from word2number import w2n
 
-from llm import rephrase_followup, extract_symptoms, explain_answer, is_vague_answer, extract_field
+import llm
+import llm_limits
+import metrics
+from session_store import build_session_store
+from repository import ConsultRepository, summary_etag
+from migrations import upgrade_schema, backfill_consult_answers
+from triage import TriageQueue, TRIAGE_STATUSES, serialize_item
+import notify
+from prefetch import RephrasePrefetcher, LLM_PREFETCH, LLM_PREFETCH_WAIT
+from rules import URGENCY_RANK, get_rule_index, bump_rule_version, invalidate_rule_index
+from llm import rephrase_followup, rephrase_followup_stream, extract_symptoms, explain_answer, is_vague_answer, extract_field
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("consult")
 
-import re
-
 app = FastAPI()
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+# With SOCKETIO_REDIS_URL set, emits reach sockets held by any worker
+SOCKETIO_REDIS_URL = os.getenv("SOCKETIO_REDIS_URL")
+client_manager = socketio.AsyncRedisManager(SOCKETIO_REDIS_URL) if SOCKETIO_REDIS_URL else None
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*", client_manager=client_manager)
 socket_app = socketio.ASGIApp(sio, app)
 
 app.add_middleware(
@@ -33,26 +50,144 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Globals
-SID_TO_STATE = {}       # sid -> { stage, name, age, email }
-SID_TO_CONSULT = {}     # sid -> { id, name, age, email }
-CONSULT_QUEUES = {}     # sid -> list of follow-up questions
-LAST_QUESTION = {}      # sid -> last asked question
-RETRY_COUNT = {}        # sid -> retry attempts
+# Per-sid conversation state (see session_store.new_session for the shape)
+sessions = build_session_store()
+
+# Doctor-facing priority queue; dashboards in this room get live updates
+triage = TriageQueue()
+TRIAGE_ROOM = "triage"
+
+# Rephrases the next queued question while the patient answers the current one
+prefetcher = RephrasePrefetcher(rephrase_followup) if LLM_PREFETCH else None
+
+# Drains notification_outbox (Telegram + calendar) in the background; None when NOTIFY_BACKEND=off
+notifier = None
 
 @app.on_event("startup")
 async def on_startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
+    # legacy consults otherwise show no answers until someone runs migrations.py
+    await backfill_consult_answers()
+    await warm_up()
+    async with AsyncSessionLocal() as db:
+        if not await db.get(RuleVersion, 1):
+            db.add(RuleVersion(id=1, version=0))
+            await db.commit()
+        await triage.rebuild(db)
+    await llm.init_client()
+    global notifier
+    notifier = notify.build_worker(on_status_change=publish_triage)
+    if notifier:
+        notifier.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if notifier:
+        await notifier.stop()
+    await llm.close_client()
+    await sessions.close()
 
 
 # ---------------- REST ---------------- #
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000
+EXPORT_BATCH = 1000
+
+
+def _encode_cursor(row) -> str:
+    raw = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset_page(stmt, model, cursor: str | None, limit: int):
+    """Newest first, continuing strictly after the (created_at, id) in `cursor`."""
+    if cursor:
+        ts, row_id = _decode_cursor(cursor)
+        # tuple_ doesn't type its elements from the columns; bind ts as the column's type
+        stmt = stmt.where(tuple_(model.created_at, model.id) < tuple_(literal(ts, model.created_at.type), row_id))
+    return stmt.order_by(model.created_at.desc(), model.id.desc()).limit(limit)
+
+
+def _ndjson_export(stmt, schema):
+    """
+    Stream every row matching `stmt` as NDJSON. Opens its own DB session,
+    since the request-scoped one may close before the body is sent.
+    """
+    async def rows():
+        async with AsyncSessionLocal() as db:
+            result = await db.stream_scalars(stmt.execution_options(yield_per=EXPORT_BATCH))
+            async for row in result:
+                yield schema.from_orm(row).json() + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+async def _paged(db, stmt, model, cursor, limit, response: Response):
+    rows = (await db.execute(_keyset_page(stmt, model, cursor, limit))).scalars().all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
+    return rows
+
+
 @app.get("/patients", response_model=list[schemas.PatientOut])
-async def get_patients(db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(models.Patient))
-    return res.scalars().all()
+async def get_patients(
+    response: Response,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: str | None = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Keyset-paginated, newest first. The next page's cursor comes back in the
+    X-Next-Cursor header; format=ndjson streams the whole table instead.
+    """
+    stmt = select(models.Patient)
+    if format == "ndjson":
+        return _ndjson_export(stmt.order_by(models.Patient.created_at.desc(), models.Patient.id.desc()), schemas.PatientOut)
+    return await _paged(db, stmt, models.Patient, cursor, limit, response)
+
+
+@app.get("/consults", response_model=list[schemas.ConsultListOut])
+async def list_consults(
+    response: Response,
+    urgency: str | None = None,
+    status: str | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    patient_id: int | None = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: str | None = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    stmt = select(Consult)
+    if urgency:
+        stmt = stmt.where(Consult.urgency == urgency)
+    if status:
+        stmt = stmt.where(Consult.status == status)
+    if created_from:
+        stmt = stmt.where(Consult.created_at >= created_from)
+    if created_to:
+        stmt = stmt.where(Consult.created_at < created_to)
+    if patient_id:
+        stmt = stmt.where(Consult.patient_id == patient_id)
+    if format == "ndjson":
+        return _ndjson_export(stmt.order_by(Consult.created_at.desc(), Consult.id.desc()), schemas.ConsultListOut)
+    return await _paged(db, stmt, Consult, cursor, limit, response)
 
 
 @app.get("/health")
@@ -60,6 +195,16 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    metrics.ACTIVE_SESSIONS.set(await sessions.count())
+    metrics.TRIAGE_OPEN.set(len(triage))
+    if prefetcher:
+        metrics.LLM_PREFETCH_INFLIGHT.set(prefetcher.inflight())
+    llm_limits.observe_metrics()
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/symptoms")
 async def get_symptoms(db: AsyncSession = Depends(get_db)):
     res = await db.execute(select(SymptomRule))
@@ -71,7 +216,9 @@ async def get_symptoms(db: AsyncSession = Depends(get_db)):
 async def add_symptom(rule: dict = Body(...), db: AsyncSession = Depends(get_db)):
     new_rule = SymptomRule(symptom_key=rule["symptom_key"], follow_up_questions=rule["follow_up_questions"])
     db.add(new_rule)
+    await bump_rule_version(db)
     await db.commit()
+    invalidate_rule_index()
     await db.refresh(new_rule)
     return {"symptom": new_rule.symptom_key, "questions": new_rule.follow_up_questions}
 
@@ -89,7 +236,9 @@ async def create_escalation(rule: dict = Body(...), db: AsyncSession = Depends(g
         new_urgency=rule["new_urgency"],
     )
     db.add(new_rule)
+    await bump_rule_version(db)
     await db.commit()
+    invalidate_rule_index()
     await db.refresh(new_rule)
     return new_rule
 
@@ -99,7 +248,9 @@ async def delete_escalation(rule_id: int, db: AsyncSession = Depends(get_db)):
     if not rule:
         raise HTTPException(status_code=404, detail="Escalation not found")
     await db.delete(rule)
+    await bump_rule_version(db)
     await db.commit()
+    invalidate_rule_index()
     return {"message": "Escalation deleted"}
 
 
@@ -117,402 +268,641 @@ async def create_followup_rule(rule: dict = Body(...), db: AsyncSession = Depend
         new_urgency=rule["new_urgency"],
     )
     db.add(new_rule)
+    await bump_rule_version(db)
     await db.commit()
+    invalidate_rule_index()
     await db.refresh(new_rule)
     return new_rule
 
+async def publish_triage(row):
+    """
+    Apply a consult's stored state (repository.TRIAGE_COLUMNS, as returned by
+    the write) to the triage queue and push it to doctor dashboards. A claimed
+    consult is not a triage status, so it is never queued again.
+    """
+    item = triage.upsert(row.id, row.urgency, row.status, row.created_at, row.patient_id)
+    if item:
+        await sio.emit("triage_update", {"action": "upsert", "consult": serialize_item(item)}, room=TRIAGE_ROOM)
+    else:
+        await sio.emit("triage_update", {"action": "remove", "consult": {"id": row.id}}, room=TRIAGE_ROOM)
+
+
+@app.get("/triage")
+async def get_triage(limit: int = Query(50, ge=1, le=PAGE_SIZE_MAX)):
+    """Open consults in the order doctors should take them."""
+    return [serialize_item(i) for i in triage.snapshot(limit)]
+
+
+@app.post("/triage/claim")
+async def claim_next_consult(db: AsyncSession = Depends(get_db)):
+    repo = ConsultRepository(db)
+    while True:
+        item = triage.pop()
+        if item is None:
+            raise HTTPException(status_code=404, detail="No consults waiting")
+        row = await repo.claim(item["id"], TRIAGE_STATUSES)
+        await db.commit()
+        await sio.emit("triage_update", {"action": "remove", "consult": {"id": item["id"]}}, room=TRIAGE_ROOM)
+        if row:
+            return serialize_item(dict(row._mapping))
+        # already claimed or closed elsewhere; try the next one
+
+
+@app.get("/consults/{consult_id}", response_model=schemas.ConsultOut)
+async def get_consult(consult_id: int, db: AsyncSession = Depends(get_db)):
+    repo = ConsultRepository(db)
+    consult = await repo.get_consult(consult_id)
+    if not consult:
+        raise HTTPException(status_code=404, detail="Consult not found")
+    return schemas.ConsultOut(
+        id=consult.id,
+        patient_id=consult.patient_id,
+        symptoms=consult.symptoms or [],
+        follow_up_answers=await repo.load_answers(consult_id, consult.symptoms),
+        urgency=consult.urgency or "normal",
+        status=consult.status or "in_progress",
+        created_at=consult.created_at,
+    )
+
+
+@app.get("/consults/{consult_id}/summary")
+async def get_consult_summary(consult_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Stored doctor summary with an ETag; If-None-Match gets a 304. Consults
+    without a stored summary (still in progress) are rendered on the fly.
+    """
+    repo = ConsultRepository(db)
+    row = await repo.get_summary(consult_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Consult not found")
+    text, etag, generated_at = row.summary_text, row.summary_etag, row.summary_at
+    if text is None:
+        consult = await repo.get_consult(consult_id)
+        patient = await db.get(Patient, consult.patient_id)
+        answers = await repo.load_answers(consult_id, consult.symptoms)
+        text = render_doctor_summary(_patient_info(patient), consult, answers, await repo.load_rule_hits(consult_id))
+        etag = summary_etag(text)
+
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag and (if_none_match == "*" or f'"{etag}"' in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(
+        {"consult_id": consult_id, "status": row.status, "summary": text,
+         "generated_at": generated_at.isoformat() if generated_at else None},
+        headers=headers,
+    )
+
+
+@app.post("/consults/{consult_id}/recompute-urgency")
+async def recompute_consult_urgency(consult_id: int, db: AsyncSession = Depends(get_db)):
+    """Full re-scan of a consult's answers, e.g. after the rules were edited."""
+    consult = await db.get(Consult, consult_id)
+    if not consult:
+        raise HTTPException(status_code=404, detail="Consult not found")
+    repo = ConsultRepository(db)
+    answers = await repo.load_answers(consult_id)
+    hits = []
+    row = await repo.update_consult(consult, await determine_urgency(consult.symptoms or [], answers, db, hits=hits))
+    await repo.replace_rule_hits(consult_id, hits)
+    if consult.summary_text is not None:
+        # a stored summary must reflect the new urgency and escalations
+        patient = await db.get(Patient, consult.patient_id)
+        text = render_doctor_summary(_patient_info(patient), consult, answers, hits)
+        await repo.store_summary(consult_id, text)
+    await db.commit()
+    await publish_triage(row)
+    return {"id": consult.id, "urgency": consult.urgency}
+
 @app.delete("/followup-rules/{rule_id}")
 async def delete_followup_rule(rule_id: int, db: AsyncSession = Depends(get_db)):
     rule = await db.get(FollowUpRule, rule_id)
     if not rule:
         raise HTTPException(status_code=404, detail="Rule not found")
     await db.delete(rule)
+    await bump_rule_version(db)
     await db.commit()
+    invalidate_rule_index()
     return {"message": "Rule deleted"}
 # ---------------- Helpers ---------------- #
-def normalize_and_match(extracted: list[str], known: list[str]) -> list[str]:
-    matched = []
-    for e in extracted:
-        e_norm = e.strip().lower()
-        for k in known:
-            if e_norm == k.lower():
-                matched.append(k)
-                break
-        else:
-            close = get_close_matches(e_norm, [k.lower() for k in known], n=1, cutoff=0.6)
-            if close:
-                for k in known:
-                    if k.lower() == close[0]:
-                        matched.append(k)
-                        break
-    return list(dict.fromkeys(matched))
+def build_question_queue(symptom_rules, answered: dict | None = None) -> list[dict]:
+    """
+    Follow-up questions in asking order. `answered` maps symptom_key to the
+    number of its questions already asked (Consult.followup_progress), which
+    are skipped.
+    """
+    queue = []
+    for m in symptom_rules:
+        skip = (answered or {}).get(m.symptom_key, 0)
+        for idx, q in enumerate(m.follow_up_questions or []):
+            if idx < skip:
+                continue
+            queue.append({
+                "symptoms": [m.symptom_key],
+                "qIndex": idx,
+                "text": q,
+                "questionText": q
+            })
+    return queue
+
+
+def normalize_and_match(extracted: list[str], known: list[str], matcher: SymptomMatcher | None = None) -> list[str]:
+    matcher = matcher or get_matcher(known)
+    return matcher.match_all(extracted)
 
 
 def normalize_to_canonical(sym_input: str, canonical_list: list[str]) -> str | None:
     if not sym_input or not canonical_list:
         return None
-    s = sym_input.strip()
-    for k in canonical_list:
-        if s.lower() == k.lower():
-            return k
-    close = get_close_matches(s.lower(), [k.lower() for k in canonical_list], n=1, cutoff=0.6)
-    if close:
-        for k in canonical_list:
-            if k.lower() == close[0]:
-                return k
-    return None
+    return get_matcher(canonical_list).match(sym_input)
+
+
+async def send_rephrased(sid, event: str, patient_name: str, text: str, prev_user_text: str | None = None, payload: dict | None = None):
+    """
+    Rephrase `text` and emit it as `event` ("bot_message" or "ask_question").
+    In streaming mode partial text goes out as `<event>_chunk` events first;
+    the final event carries the full payload plus the same stream_id.
+    """
+    if not llm.LLM_STREAMING:
+        phrased = await rephrase_followup(patient_name, text, prev_user_text=prev_user_text)
+        await sio.emit(event, _rephrased_payload(event, phrased, payload), to=sid)
+        return phrased
+
+    stream_id = uuid.uuid4().hex
+    parts = []
+    try:
+        async for delta in rephrase_followup_stream(patient_name, text, prev_user_text=prev_user_text):
+            parts.append(delta)
+            await sio.emit(f"{event}_chunk", {"stream_id": stream_id, "delta": delta}, to=sid)
+    except Exception as e:
+        logger.warning("Streaming rephrase failed, sending system text: %s", e)
+        parts = []
+    phrased = "".join(parts).strip() or text
+    await sio.emit(event, {**_rephrased_payload(event, phrased, payload), "stream_id": stream_id}, to=sid)
+    return phrased
+
+
+def _rephrased_payload(event: str, phrased: str, payload: dict | None) -> dict:
+    if event == "ask_question":
+        return {**(payload or {}), "question": phrased}
+    return {**(payload or {}), "msg": phrased}
+
+
+def _question_text(item: dict) -> str:
+    return f"For your {', '.join(item['symptoms'])}, {item['text']}"
+
+
+async def ask_next_question(sid, sess, patient_name: str):
+    """
+    Pop the next queued follow-up and ask it, using the prefetched phrasing
+    when it is ready within LLM_PREFETCH_WAIT, then start prefetching the
+    question(s) after it. Both paths rephrase from the same inputs (name and
+    question, no previous answer), so the wording doesn't depend on timing.
+    """
+    item = sess["queue"].pop(0)
+    sess["last_question"] = item
+    text = _question_text(item)
+    phrased = await prefetcher.take(sid, text, timeout=LLM_PREFETCH_WAIT) if prefetcher else None
+    if phrased:
+        await sio.emit("ask_question", _rephrased_payload("ask_question", phrased, item), to=sid)
+    else:
+        await send_rephrased(sid, "ask_question", patient_name, text, payload=item)
+    if prefetcher:
+        prefetcher.schedule(sid, patient_name, [_question_text(i) for i in sess["queue"]])
 
 
 # ---------------- SOCKET HANDLERS ---------------- #
 @sio.event
 async def connect(sid, environ):
+    llm_limits.current_sid.set(sid)
     logger.info("Socket connected: %s", sid)
-    SID_TO_STATE[sid] = {"stage": "ask_name"}
-    RETRY_COUNT[sid] = 0
-    phrased = await rephrase_followup("Patient", "Please tell me your name?")
-    await sio.emit("bot_message", {"msg": phrased}, to=sid)
+    async with sessions.session(sid, create=True) as sess:
+        sess["state"] = {"stage": "ask_name"}
+        sess["retry_count"] = 0
+    await send_rephrased(sid, "bot_message", "Patient", "Please tell me your name?")
 
 
 @sio.event
 async def disconnect(sid):
     logger.info("Socket disconnected: %s", sid)
-    SID_TO_STATE.pop(sid, None)
-    SID_TO_CONSULT.pop(sid, None)
-    CONSULT_QUEUES.pop(sid, None)
-    LAST_QUESTION.pop(sid, None)
-    RETRY_COUNT.pop(sid, None)
+    if prefetcher:
+        prefetcher.cancel(sid)
+    async with sessions.session(sid) as sess:
+        sess.clear()
 
 
 # Step 1: Name → Age → Email (uses LLM extract_field with safeties)
 @sio.event
 @sio.event
+@metrics.timed(metrics.SOCKET_EVENT_SECONDS, "start_consult")
 async def start_consult(sid, data):
+    llm_limits.current_sid.set(sid)
     try:
-        state = SID_TO_STATE.get(sid, {})
-        stage = state.get("stage")
-
-        # ---- Step 1: Name ----
-        if stage == "ask_name":
-            raw_name = data.get("name") if isinstance(data, dict) else str(data)
-            extracted_name = await extract_field("name", str(raw_name))
-            state["name"] = extracted_name or str(raw_name).strip()
-            state["stage"] = "ask_age"
-            phrased = await rephrase_followup(state["name"], "Now please tell me your age.")
-            await sio.emit("bot_message", {"msg": phrased}, to=sid)
-            return
-
-        # ---- Step 2: Age ----
-        if stage == "ask_age":
-            raw_age = data.get("age") if isinstance(data, dict) else str(data)
-            extracted_age = await extract_field("age", str(raw_age))
-            state["age"] = extracted_age or str(raw_age).strip()
-            state["stage"] = "ask_email"
-            phrased = await rephrase_followup(state["age"], "Now please provide your email ID.")
-            await sio.emit("bot_message", {"msg": phrased}, to=sid)
-            return
-        # ---- Step 3: Email ----
-        if stage == "ask_email":
-            raw_email = data.get("email") if isinstance(data, dict) else str(data)
-            extracted_email = await extract_field("email", str(raw_email))
-            state["email"] = extracted_email or str(raw_email).strip()
+        async with sessions.session(sid) as sess:
+            state = sess.get("state", {})
+            stage = state.get("stage")
+
+            # ---- Step 1: Name ----
+            if stage == "ask_name":
+                raw_name = data.get("name") if isinstance(data, dict) else str(data)
+                extracted_name = await extract_field("name", str(raw_name), (await get_rule_index()).symptom_keys)
+                state["name"] = extracted_name or str(raw_name).strip()
+                state["stage"] = "ask_age"
+                await send_rephrased(sid, "bot_message", state["name"], "Now please tell me your age.")
+                return
 
-            async with AsyncSessionLocal() as db:
-                existing = (
-                    await db.execute(select(Patient).where(Patient.email == state["email"]).limit(1))
-                ).scalar_one_or_none()
-
-                if existing:
-                    patient = existing
-                    if not patient.age and "age" in state:
-                        patient.age = state["age"]
-                        await db.commit()
-                else:
-                    patient = Patient(
-                        name=state["name"],
-                        age=state.get["age"],
-                        email=state["email"],
-                    )
-                    db.add(patient)
+            # ---- Step 2: Age ----
+            if stage == "ask_age":
+                raw_age = data.get("age") if isinstance(data, dict) else str(data)
+                extracted_age = await extract_field("age", str(raw_age))
+                state["age"] = extracted_age or str(raw_age).strip()
+                state["stage"] = "ask_email"
+                await send_rephrased(sid, "bot_message", state["age"], "Now please provide your email ID.")
+                return
+            # ---- Step 3: Email ----
+            if stage == "ask_email":
+                raw_email = data.get("email") if isinstance(data, dict) else str(data)
+                extracted_email = await extract_field("email", str(raw_email))
+                state["email"] = extracted_email or str(raw_email).strip()
+
+                resume_token = secrets.token_urlsafe(24)
+                async with AsyncSessionLocal() as db:
+                    repo = ConsultRepository(db)
+                    patient_id = await repo.upsert_patient(state.get("name"), state.get("age"), state["email"])
+                    row = await repo.create_consult(patient_id, resume_token)
                     await db.commit()
-                    await db.refresh(patient)
+                await publish_triage(row)
+                consult_id = row.id
 
-                consult = Consult(patient_id=patient.id, symptoms=[], follow_up_answers={})
-                db.add(consult)
-                await db.commit()
-                await db.refresh(consult)
-
-                SID_TO_CONSULT[sid] = {
-                    "id": consult.id,
-                    "name": state["name"],
-                    "age": state.get["age"],
+                sess["consult"] = {
+                    "id": consult_id,
+                    "name": state.get("name"),
+                    "age": state.get("age"),
                     "email": state["email"],
                 }
 
-            state["stage"] = "collect_symptoms"
-            phrased = await rephrase_followup(
-                state["name"], "Please tell me your symptoms (e.g., chest pain, shortness of breath)."
-            )
-            await sio.emit("bot_message", {"msg": phrased}, to=sid)
-            return
+                state["stage"] = "collect_symptoms"
+                # client keeps this to call resume_consult after a reconnect
+                await sio.emit("consult_token", {"consult_id": consult_id, "token": resume_token}, to=sid)
+                await send_rephrased(
+                    sid, "bot_message", state["name"], "Please tell me your symptoms (e.g., chest pain, shortness of breath)."
+                )
+                return
 
-        await sio.emit("bot_message", {"msg": "⚠️ Unexpected input."}, to=sid)
+            await sio.emit("bot_message", {"msg": "⚠️ Unexpected input."}, to=sid)
 
     except Exception:
         traceback.print_exc()
+        metrics.SOCKET_EVENT_ERRORS.labels("start_consult").inc()
         await sio.emit("bot_message", {"msg": "❌ Error while starting consult."}, to=sid)
-# Step 2: Collect Symptoms
+# Doctor dashboards subscribe to live triage updates
 @sio.event
-async def patient_symptoms(sid, data):
+async def join_triage(sid, data=None):
+    await sio.enter_room(sid, TRIAGE_ROOM)
+    await sio.emit("triage_snapshot", [serialize_item(i) for i in triage.snapshot()], to=sid)
+
+
+@sio.event
+async def leave_triage(sid, data=None):
+    await sio.leave_room(sid, TRIAGE_ROOM)
+
+
+# Resume: rebuild a session from the persisted consult after a reconnect
+@sio.event
+@metrics.timed(metrics.SOCKET_EVENT_SECONDS, "resume_consult")
+async def resume_consult(sid, data):
+    llm_limits.current_sid.set(sid)
     try:
-        state = SID_TO_STATE.get(sid, {})
-        if state.get("stage") != "collect_symptoms":
-            await sio.emit("bot_message", {"msg": "⚠️ Session not started."}, to=sid)
+        token = data.get("token") if isinstance(data, dict) else str(data or "")
+        if not token:
+            await sio.emit("bot_message", {"msg": "⚠️ Missing resume token."}, to=sid)
             return
 
-        consult_info = SID_TO_CONSULT.get(sid)
-        if not consult_info:
-            await sio.emit("bot_message", {"msg": "⚠️ No consult found."}, to=sid)
-            return
+        async with sessions.session(sid, create=True) as sess:
+            async with AsyncSessionLocal() as db:
+                res = await db.execute(
+                    select(Consult).options(selectinload(Consult.patient)).where(Consult.resume_token == token)
+                )
+                consult = res.scalar_one_or_none()
+                if not consult or consult.status != "in_progress":
+                    sess.clear()
+                    await sio.emit("resume_failed", {"reason": "not_found" if not consult else consult.status}, to=sid)
+                    return
+
+                patient = consult.patient
+                consult_info = {"id": consult.id, "name": patient.name, "age": patient.age, "email": patient.email}
+                sess["consult"] = consult_info
+                sess["state"] = {"stage": "collect_symptoms", "name": patient.name, "age": patient.age, "email": patient.email}
+                sess["retry_count"] = 0
+
+                if not consult.symptoms:
+                    await sio.emit("consult_resumed", {"consult_id": consult.id, "stage": "collect_symptoms"}, to=sid)
+                    await send_rephrased(
+                        sid, "bot_message", patient.name, "Please tell me your symptoms (e.g., chest pain, shortness of breath)."
+                    )
+                    return
+
+                rule_index = await get_rule_index(db)
+                answer_seq = await ConsultRepository(db).answer_counts(consult.id)
+                # answers stored under a fallback symptom don't mean its questions were asked;
+                # only consults from before followup_progress existed fall back to the counts
+                asked = consult.followup_progress if consult.followup_progress is not None else answer_seq
+                matched_rules = [rule_index.symptoms[k] for k in consult.symptoms if k in rule_index.symptoms]
+                sess["queue"] = build_question_queue(matched_rules, asked)
+                sess["answer_seq"] = answer_seq
+
+            sess["state"]["stage"] = "followups"
+            await sio.emit("consult_resumed", {"consult_id": consult_info["id"], "stage": "followups"}, to=sid)
+            if sess["queue"]:
+                await ask_next_question(sid, sess, consult_info["name"])
+            else:
+                await _send_doctor_summary_and_finish(sid, sess)
 
-        consult_id = consult_info["id"]
-        text = data.get("symptoms_text", "") if isinstance(data, dict) else str(data)
+    except Exception:
+        traceback.print_exc()
+        metrics.SOCKET_EVENT_ERRORS.labels("resume_consult").inc()
+        await sio.emit("bot_message", {"msg": "❌ Error while resuming consult."}, to=sid)
 
-        async with AsyncSessionLocal() as db:
-            all_rules = (await db.execute(select(SymptomRule))).scalars().all()
-            known_keys = [r.symptom_key for r in all_rules]
 
-            extracted = await extract_symptoms(text, known_keys)
-            matched_keys = normalize_and_match(extracted, known_keys)
+# Step 2: Collect Symptoms
+@sio.event
+@metrics.timed(metrics.SOCKET_EVENT_SECONDS, "patient_symptoms")
+async def patient_symptoms(sid, data):
+    llm_limits.current_sid.set(sid)
+    try:
+        async with sessions.session(sid) as sess:
+            state = sess.get("state", {})
+            if state.get("stage") != "collect_symptoms":
+                await sio.emit("bot_message", {"msg": "⚠️ Session not started."}, to=sid)
+                return
 
-            if not matched_keys:
-                all_keys = ", ".join(known_keys)
-                phrased = await rephrase_followup(
-                    consult_info["name"],
-                    f"Sorry, I couldn’t recognise your symptoms. Please choose from: {all_keys}"
-                )
-                await sio.emit("bot_message", {"msg": phrased}, to=sid)
+            consult_info = sess.get("consult")
+            if not consult_info:
+                await sio.emit("bot_message", {"msg": "⚠️ No consult found."}, to=sid)
                 return
 
-            matched_rules = []
-            for key in matched_keys:
-                r = await db.execute(select(SymptomRule).where(SymptomRule.symptom_key == key))
-                rule = r.scalar_one_or_none()
-                if rule:
-                    matched_rules.append(rule)
+            consult_id = consult_info["id"]
+            text = data.get("symptoms_text", "") if isinstance(data, dict) else str(data)
 
-            res = await db.execute(select(Consult).options(selectinload(Consult.patient)).where(Consult.id == consult_id))
-            consult = res.scalar_one()
+            async with AsyncSessionLocal() as db:
+                rule_index = await get_rule_index(db)
+                known_keys = rule_index.symptom_keys
 
-            if not consult.follow_up_answers:
-                consult.follow_up_answers = {k.symptom_key: [] for k in matched_rules}
+                extracted = await extract_symptoms(text, known_keys)
+                matched_keys = normalize_and_match(extracted, known_keys, rule_index.matcher)
 
-            consult.symptoms = [m.symptom_key for m in matched_rules]
-            await db.commit()
+                if not matched_keys:
+                    all_keys = ", ".join(known_keys)
+                    await send_rephrased(
+                        sid, "bot_message", consult_info["name"],
+                        f"Sorry, I couldn’t recognise your symptoms. Please choose from: {all_keys}"
+                    )
+                    return
 
-            CONSULT_QUEUES[sid] = []
-            for m in matched_rules:
-                for idx, q in enumerate(m.follow_up_questions or []):
-                    CONSULT_QUEUES[sid].append({
-                        "symptoms": [m.symptom_key],
-                        "qIndex": idx,
-                        "text": q,
-                        "questionText": q
-                    })
-
-        state["stage"] = "followups"
-        if CONSULT_QUEUES.get(sid):
-            first_item = CONSULT_QUEUES[sid].pop(0)
-            LAST_QUESTION[sid] = first_item
-            phrased = await rephrase_followup(
-                consult_info["name"],
-                f"For your {', '.join(first_item['symptoms'])}, {first_item['text']}"
-            )
-            await sio.emit("ask_question", {**first_item, "question": phrased}, to=sid)
-        else:
-            await _send_doctor_summary_and_finish(sid)
+                matched_rules = [rule_index.symptoms[k] for k in matched_keys if k in rule_index.symptoms]
+                symptoms = [m.symptom_key for m in matched_rules]
+
+                # seed the running urgency; answers only ever escalate it from here
+                urgency = base_urgency(symptoms, matched_rules)
+                row = await ConsultRepository(db).set_symptoms(consult_id, symptoms, urgency)
+                await db.commit()
+                await publish_triage(row)
+
+                sess["queue"] = build_question_queue(matched_rules)
+                sess["answer_seq"] = {}
+
+            state["stage"] = "followups"
+            if sess.get("queue"):
+                await ask_next_question(sid, sess, consult_info["name"])
+            else:
+                await _send_doctor_summary_and_finish(sid, sess)
 
     except Exception:
         traceback.print_exc()
+        metrics.SOCKET_EVENT_ERRORS.labels("patient_symptoms").inc()
         await sio.emit("bot_message", {"msg": "❌ Error while collecting symptoms."}, to=sid)
 
 
 # Step 3: Save Answer with vagueness check
 @sio.event
+@metrics.timed(metrics.SOCKET_EVENT_SECONDS, "answer_question")
 async def answer_question(sid, data):
+    llm_limits.current_sid.set(sid)
     try:
-        consult_info = SID_TO_CONSULT.get(sid)
-        if not consult_info:
-            await sio.emit("bot_message", {"msg": "⚠️ No consult found."}, to=sid)
-            return
-
-        consult_id = consult_info["id"]
-        symptoms_for_question = data.get("symptoms") or []
-        answer = (data.get("answerText") or data.get("answer") or "").strip()
-        q_obj = LAST_QUESTION.get(sid)
-        question_text = (data.get("questionText") or data.get("text") or (q_obj and (q_obj.get("questionText") or q_obj.get("text"))) or "").strip()
-        if not question_text:
-            question_text = "Follow-up question"
-
-        # ✅ vagueness check
-        is_vague, clarifying = await is_vague_answer(question_text, answer)
-        if is_vague and RETRY_COUNT.get(sid, 0) < 2:
-            RETRY_COUNT[sid] = RETRY_COUNT.get(sid, 0) + 1
-            phrased = clarifying or f"Could you clarify: {question_text}"
-            await sio.emit("ask_question", {
-                "symptoms": symptoms_for_question,
-                "qIndex": q_obj.get("qIndex") if q_obj else 0,
-                "text": question_text,
-                "question": phrased
-            }, to=sid)
-            return
-        RETRY_COUNT[sid] = 0  # reset
-
-        async with AsyncSessionLocal() as db:
-            res = await db.execute(select(Consult).options(selectinload(Consult.patient)).where(Consult.id == consult_id))
-            consult = res.scalar_one_or_none()
-            if not consult:
-                await sio.emit("bot_message", {"msg": "⚠️ Consult not found."}, to=sid)
+        async with sessions.session(sid) as sess:
+            consult_info = sess.get("consult")
+            if not consult_info:
+                await sio.emit("bot_message", {"msg": "⚠️ No consult found."}, to=sid)
                 return
 
-            if not consult.follow_up_answers:
-                consult.follow_up_answers = {}
-            for k in consult.symptoms or []:
-                consult.follow_up_answers.setdefault(k, [])
-
-            # Determine canonical targets
-            canonical_targets = []
-            for s in symptoms_for_question:
-                canonical = normalize_to_canonical(s, consult.symptoms or [])
-                if canonical:
-                    canonical_targets.append(canonical)
-            if not canonical_targets and q_obj:
-                for s in (q_obj.get("symptoms") or []):
+            consult_id = consult_info["id"]
+            symptoms_for_question = data.get("symptoms") or []
+            answer = (data.get("answerText") or data.get("answer") or "").strip()
+            q_obj = sess.get("last_question")
+            question_text = (data.get("questionText") or data.get("text") or (q_obj and (q_obj.get("questionText") or q_obj.get("text"))) or "").strip()
+            if not question_text:
+                question_text = "Follow-up question"
+
+            async with AsyncSessionLocal() as db:
+                repo = ConsultRepository(db)
+                consult = await repo.get_consult(consult_id)
+                if not consult:
+                    await sio.emit("bot_message", {"msg": "⚠️ Consult not found."}, to=sid)
+                    return
+
+                # Determine canonical targets
+                canonical_targets = []
+                for s in symptoms_for_question:
                     canonical = normalize_to_canonical(s, consult.symptoms or [])
                     if canonical:
                         canonical_targets.append(canonical)
-            if not canonical_targets:
-                canonical_targets = list(consult.symptoms or [])
-
-            updated = dict(consult.follow_up_answers or {})
-            for sym in canonical_targets:
-                updated.setdefault(sym, [])
-                new_entry = {"question": question_text, "answer": answer}
-                try:
-                    doctor_note = await explain_answer(question_text, answer, sym)
+                if not canonical_targets and q_obj:
+                    for s in (q_obj.get("symptoms") or []):
+                        canonical = normalize_to_canonical(s, consult.symptoms or [])
+                        if canonical:
+                            canonical_targets.append(canonical)
+                if not canonical_targets:
+                    canonical_targets = list(consult.symptoms or [])
+
+                # one structured call: vagueness, notes and rule verdicts together
+                evaluation = None
+                if llm.LLM_BATCH_EVAL:
+                    candidates = llm_rule_candidates(question_text, answer, canonical_targets,
+                                                     await get_rule_index(db), consult.urgency or "normal")
+                    evaluation = await llm.evaluate_answer(question_text, answer, canonical_targets, candidates)
+
+                # ✅ vagueness check
+                if evaluation is not None:
+                    is_vague, clarifying = evaluation["vague"], evaluation["clarify"]
+                else:
+                    is_vague, clarifying = await is_vague_answer(question_text, answer)
+                if is_vague and sess.get("retry_count", 0) < 2:
+                    sess["retry_count"] = sess.get("retry_count", 0) + 1
+                    phrased = clarifying or f"Could you clarify: {question_text}"
+                    await sio.emit("ask_question", {
+                        "symptoms": symptoms_for_question,
+                        "qIndex": q_obj.get("qIndex") if q_obj else 0,
+                        "text": question_text,
+                        "question": phrased
+                    }, to=sid)
+                    return
+                sess["retry_count"] = 0  # reset
+
+                # one clinician note per symptom; only ones the batched call missed are generated separately
+                notes_by_symptom = dict(evaluation["notes"]) if evaluation else {}
+                missing = [sym for sym in canonical_targets if sym not in notes_by_symptom]
+                if missing:
+                    extra = await llm.gather_limited(
+                        [explain_answer(question_text, answer, sym) for sym in missing]
+                    )
+                    notes_by_symptom.update(zip(missing, extra))
+                notes = [notes_by_symptom.get(sym) for sym in canonical_targets]
+
+                # append-only: one consult_answers row per target symptom
+                answer_seq = dict(sess.get("answer_seq") or {})
+                new_entries, rows = [], []
+                for sym, doctor_note in zip(canonical_targets, notes):
+                    answer_seq[sym] = answer_seq.get(sym, 0) + 1
+                    new_entry = {"question": question_text, "answer": answer, "seq": answer_seq[sym]}
                     if doctor_note:
                         new_entry["doctor_note"] = doctor_note
-                except Exception as e:
-                    logger.exception("explain_answer failed: %s", e)
-                updated[sym] = updated[sym] + [new_entry]
+                    new_entries.append((sym, new_entry))
+                    rows.append({"symptom_key": sym, "seq": answer_seq[sym], "doctor_note": doctor_note or None,
+                                 "question": question_text, "answer": answer})
+
+                # batched verdicts are per rule; key them by the entry they were given for
+                judged = {}
+                if evaluation:
+                    by_id = {r.id: r for r in candidates}
+                    for sym, entry in new_entries:
+                        for rule_id, match in evaluation["rule_matches"].items():
+                            if by_id[rule_id].symptom_key == sym:
+                                judged[(sym, entry["seq"], rule_id)] = match
+
+                # resume skips by the question actually asked, not by where answers were filed
+                progress = dict(consult.followup_progress or {})
+                for sym in (q_obj or {}).get("symptoms") or []:
+                    progress[sym] = max(progress.get(sym, 0), (q_obj.get("qIndex") or 0) + 1)
+
+                # the last answer also closes the consult, in the same commit
+                finished = not sess.get("queue")
+                hits = []
+                urgency = await update_urgency(consult.urgency, new_entries, db, judged=judged, hits=hits)
+                await repo.append_answers(consult_id, rows)
+                await repo.add_rule_hits(consult_id, hits)
+                row = await repo.update_consult(consult, urgency, status="completed" if finished else None,
+                                                progress=progress)
+                if finished:
+                    notify.enqueue_consult_notifications(db, consult_id)
+                await db.commit()
+                await publish_triage(row)
+                sess["answer_seq"] = answer_seq
 
-            consult.follow_up_answers = updated
-            consult.urgency = await determine_urgency(consult.symptoms, updated, db)
-            await db.commit()
-
-        # next question or finish
-        if CONSULT_QUEUES.get(sid):
-            next_item = CONSULT_QUEUES[sid].pop(0)
-            LAST_QUESTION[sid] = next_item
-            phrased = await rephrase_followup(
-                consult_info["name"],
-                f"For your {', '.join(next_item['symptoms'])}, {next_item['text']}",
-                prev_user_text=answer
-            )
-            await sio.emit("ask_question", {**next_item, "question": phrased}, to=sid)
-        else:
-            await _send_doctor_summary_and_finish(sid)
+            # next question or finish
+            if not finished:
+                await ask_next_question(sid, sess, consult_info["name"])
+            else:
+                await _send_doctor_summary_and_finish(sid, sess, consult)
 
     except Exception:
         traceback.print_exc()
+        metrics.SOCKET_EVENT_ERRORS.labels("answer_question").inc()
         await sio.emit("bot_message", {"msg": "❌ Error while recording answer."}, to=sid)
 
 
 # ---------------- Summary ---------------- #
-async def _send_doctor_summary_and_finish(sid):
-    consult_info = SID_TO_CONSULT.get(sid)
+def _patient_info(patient) -> dict:
+    return {"name": patient.name, "age": patient.age, "email": patient.email} if patient else {}
+
+
+def render_doctor_summary(patient_info: dict, consult, follow_up_answers: dict, hits) -> str:
+    """
+    Doctor-facing text for a consult. Escalations come from the recorded
+    consult_rule_hits, so no rule is re-evaluated here.
+    """
+    summary_lines = [
+        "🩺 Doctor Summary",
+        f"Patient: {patient_info.get('name')}",
+        f"Age: {patient_info.get('age')}" if patient_info.get("age") else "Age: Not provided",
+        f"Email: {patient_info.get('email')}",
+        f"Urgency: {(consult.urgency or 'normal').upper()}",
+        "Symptoms reported: " + (", ".join(consult.symptoms or []) if consult.symptoms else "None"),
+        ""
+    ]
+
+    # 📝 Regular Q/A answers
+    for s in (consult.symptoms or []):
+        summary_lines.append(f"--- {s} ---")
+        answers = follow_up_answers.get(s, [])
+        if not isinstance(answers, list) or not answers:
+            summary_lines.append("No follow-up answers provided.")
+        else:
+            answers = merge_related_answers(answers)
+            for i, qa in enumerate(answers, start=1):
+                if not isinstance(qa, dict):
+                    continue
+                qtxt = qa.get("question") or "Follow-up question"
+                atxt = qa.get("answer") or ""
+                if atxt.strip():
+                    summary_lines.append(f"Q{i}: {qtxt}")
+                    summary_lines.append(f"A{i}: {atxt}")
+                    doc_note = qa.get("doctor_note")
+                    if doc_note:
+                        summary_lines.append(f"🧾 Doctor Note: {doc_note}")
+            summary_lines.append("")
+
+    # 🆙 Add escalation info separately
+    escalation_notes = []
+    for h in hits:
+        how = "Answer matched" if h["match_type"] == "regex" else "Answer judged by LLM"
+        escalation_notes.append(
+            f"{h['symptom_key']}: Escalated → {(h['new_urgency'] or 'normal').upper()} (Q matched '{h['question_pattern']}', {how})"
+        )
+
+    if escalation_notes:
+        summary_lines.append("⚠️ Escalations Applied:")
+        summary_lines.extend(escalation_notes)
+
+    return "\n".join(summary_lines)
+
+
+async def _send_doctor_summary_and_finish(sid, sess, consult=None):
+    """
+    Called with the caller's locked session; clears it when done. A caller
+    that already loaded the consult and marked it completed passes it in.
+    The rendered summary is stored on the consult for GET /consults/{id}/summary.
+    """
+    consult_info = sess.get("consult")
     if not consult_info:
         return
     consult_id = consult_info["id"]
     try:
+        row = None
         async with AsyncSessionLocal() as db:
-            res = await db.execute(
-                select(Consult).options(selectinload(Consult.patient)).where(Consult.id == consult_id)
-            )
-            consult = res.scalar_one_or_none()
-            if not consult:
-                return
-
-            summary_lines = [
-                "🩺 Doctor Summary",
-                f"Patient: {consult_info.get('name')}",
-                f"Age: {consult_info.get('age')}" if consult_info.get("age") else "Age: Not provided",
-                f"Email: {consult_info.get('email')}",
-                f"Urgency: {(consult.urgency or 'normal').upper()}",
-                "Symptoms reported: " + (", ".join(consult.symptoms or []) if consult.symptoms else "None"),
-                ""
-            ]
-
-            # 📝 Regular Q/A answers
-            for s in (consult.symptoms or []):
-                summary_lines.append(f"--- {s} ---")
-                answers = (consult.follow_up_answers or {}).get(s, [])
-                if not isinstance(answers, list) or not answers:
-                    summary_lines.append("No follow-up answers provided.")
-                else:
-                    answers = merge_related_answers(answers)
-                    for i, qa in enumerate(answers, start=1):
-                        if not isinstance(qa, dict):
-                            continue
-                        qtxt = qa.get("question") or "Follow-up question"
-                        atxt = qa.get("answer") or ""
-                        if atxt.strip():
-                            summary_lines.append(f"Q{i}: {qtxt}")
-                            summary_lines.append(f"A{i}: {atxt}")
-                            doc_note = qa.get("doctor_note")
-                            if doc_note:
-                                summary_lines.append(f"🧾 Doctor Note: {doc_note}")
-                    summary_lines.append("")
-
-            # 🆙 Add escalation info separately
-            res = await db.execute(select(FollowUpRule))
-            followup_rules = res.scalars().all()
-
-            escalation_notes = []
-            for s, answers in (consult.follow_up_answers or {}).items():
-                for qa in answers:
-                    q = qa.get("question", "")
-                    a = qa.get("answer", "")
-
-                    for rule in followup_rules:
-                        if rule.symptom_key != s:
-                            continue
-                        if re.search(rule.question_pattern, q, re.I) and any(
-                            tv.lower() in a.lower() for tv in rule.trigger_values
-                        ):
-                            escalation_notes.append(
-                                f"{s}: Escalated → {rule.new_urgency.upper()} (Q matched '{rule.question_pattern}', Answer matched)"
-                            )
-
-            if escalation_notes:
-                summary_lines.append("⚠️ Escalations Applied:")
-                summary_lines.extend(escalation_notes)
-
-            # Finalize
-            summary_text = "\n".join(summary_lines)
-            await sio.emit("bot_message", {"msg": summary_text}, to=sid)
-            await sio.emit("bot_message", {"msg": "✅ Thanks — I have all your answers. I'll notify the doctor."}, to=sid)
-
-            consult.status = "completed"
+            repo = ConsultRepository(db)
+            if consult is None:
+                consult = await repo.get_consult(consult_id)
+                if not consult:
+                    return
+                row = await repo.set_status(consult_id, "completed")
+                notify.enqueue_consult_notifications(db, consult_id)
+            follow_up_answers = await repo.load_answers(consult_id, consult.symptoms)
+            hits = await repo.load_rule_hits(consult_id)
+            summary_text = render_doctor_summary(consult_info, consult, follow_up_answers, hits)
+            await repo.store_summary(consult_id, summary_text)
             await db.commit()
+        if row is not None:
+            await publish_triage(row)
+
+        await sio.emit("bot_message", {"msg": summary_text}, to=sid)
+        await sio.emit("bot_message", {"msg": "✅ Thanks — I have all your answers. I'll notify the doctor."}, to=sid)
     except Exception as e:
         traceback.print_exc()
         await sio.emit("bot_message", {"msg": f"❌ Failed to prepare doctor summary: {e}"}, to=sid)
     finally:
-        CONSULT_QUEUES.pop(sid, None)
-        SID_TO_STATE.pop(sid, None)
-        SID_TO_CONSULT.pop(sid, None)
-        LAST_QUESTION.pop(sid, None)
-        RETRY_COUNT.pop(sid, None)
+        if prefetcher:
+            prefetcher.cancel(sid)
+        sess.clear()
 
 def merge_related_answers(symptom_answers: list[dict]) -> list[dict]:
     """
@@ -540,7 +930,6 @@ def merge_related_answers(symptom_answers: list[dict]) -> list[dict]:
 
     return merged
 
-import re
 from models import Patient, Consult, SymptomRule, FollowUpRule
 
 # ---------------- Helpers ---------------- #
@@ -570,57 +959,119 @@ async def judge_rule_match(question: str, answer: str, rule: FollowUpRule) -> bo
     """
 
     try:
-        raw = await call_llm(prompt, system="You are a strict JSON generator.", max_tokens=50)
+        raw = await call_llm(prompt, system="You are a strict JSON generator.", max_tokens=50, use_cache=True,
+                             kind="judge")
         import json
         data = json.loads(raw)
         return data.get("match", False)
+    except llm.LLMUnavailable:
+        return False  # regex-only while the LLM is unavailable
     except Exception as e:
         logger.warning("LLM rule match failed: %s", e)
         return False
 
 
-async def determine_urgency(symptoms, follow_up_answers, db):
-    # 1. Base urgency from symptom rules
-    res = await db.execute(select(SymptomRule))
-    symptom_rules = res.scalars().all()
+def _max_urgency(a: str, b: str) -> str:
+    return b if URGENCY_RANK.get(b, 0) > URGENCY_RANK.get(a, 0) else a
+
+
+def base_urgency(symptoms, symptom_rules) -> str:
+    """Urgency implied by the reported symptoms alone."""
     urgency = "normal"
+    by_key = symptom_rules if isinstance(symptom_rules, dict) else {r.symptom_key: r for r in symptom_rules}
+    for s in symptoms or []:
+        rule = by_key.get(s)
+        if rule:
+            urgency = _max_urgency(urgency, rule.urgency or "normal")
+    return urgency
 
-    urgency_rank = {
-        "normal": 0,
-        "semi-urgent": 1,
-        "urgent": 2,
-        "very_urgent": 3,
-        "high": 4
-    }
 
+def llm_rule_candidates(question: str, answer: str, symptoms, rule_index, urgency: str) -> list:
+    """
+    Rules whose question pattern matches but whose triggers don't literally
+    appear in the answer, and that could still raise `urgency`: the ones
+    that need an LLM verdict.
+    """
+    a = (answer or "").lower()
+    out = []
     for s in symptoms:
-        rule = next((r for r in symptom_rules if r.symptom_key == s), None)
-        if rule and urgency_rank.get(rule.urgency, 0) > urgency_rank[urgency]:
-            urgency = rule.urgency
+        for rule in rule_index.followups_for(s):
+            if (rule.matches_question(question) and not rule.matches_answer(a)
+                    and URGENCY_RANK.get(rule.new_urgency, 0) > URGENCY_RANK.get(urgency, 0)):
+                out.append(rule)
+    return out
 
-    # 2. Escalation from follow-up answers
-    res = await db.execute(select(FollowUpRule))
-    followup_rules = res.scalars().all()
 
-    for s, answers in (follow_up_answers or {}).items():
-        for qa in answers:
-            q = qa.get("question", "")
-            a = (qa.get("answer") or "").lower()
+async def escalate_urgency(urgency: str, entries, rule_index, judged: dict | None = None,
+                           hits: list | None = None) -> str:
+    """
+    Raise `urgency` by whatever the given (symptom_key, qa) entries trigger.
+    Only these entries are evaluated, so callers can feed just the new answer.
+    A rule counts when its question pattern matches, its answer matches
+    (literally, or by LLM verdict) and it is above the `urgency` passed in;
+    the same test for both match types, so hits don't depend on entry order.
+    `judged` holds {(symptom_key, seq, rule_id): match} verdicts already
+    returned by llm.evaluate_answer; only the rest go to judge_rule_match.
+    Matching rules are appended to `hits` as consult_rule_hits rows (the qa's
+    "seq" is the answer reference).
+    """
+    judged = judged or {}
+    floor = URGENCY_RANK.get(urgency, 0)
+
+    matched, llm_candidates = [], []
+    for s, qa in entries:
+        q = qa.get("question", "")
+        a = (qa.get("answer") or "").lower()
+
+        for rule in rule_index.followups_for(s):
+            if URGENCY_RANK.get(rule.new_urgency, 0) <= floor or not rule.matches_question(q):
+                continue
+            # --- literal regex + string match ---
+            if rule.matches_answer(a):
+                matched.append((s, qa, rule, "regex"))
+                continue
+            verdict = judged.get((s, qa.get("seq"), rule.id))
+            if verdict is None:
+                llm_candidates.append((s, qa, rule))
+            elif verdict:
+                matched.append((s, qa, rule, "llm"))
+
+    # --- 🔥 LLM semantic fallback, judged concurrently ---
+    verdicts = await llm.gather_limited(
+        [judge_rule_match(qa.get("question", ""), (qa.get("answer") or "").lower(), rule) for _, qa, rule in llm_candidates],
+        default=False,
+    )
+    matched += [(s, qa, rule, "llm") for (s, qa, rule), ok in zip(llm_candidates, verdicts) if ok]
+
+    for s, qa, rule, match_type in matched:
+        urgency = _max_urgency(urgency, rule.new_urgency)
+        if hits is not None:
+            hits.append({"symptom_key": s, "answer_seq": qa.get("seq"), "rule_id": rule.id,
+                         "new_urgency": rule.new_urgency, "match_type": match_type,
+                         "question_pattern": rule.question_pattern})
+    return urgency
+
 
-            for rule in followup_rules:
-                if rule.symptom_key != s:
-                    continue
+async def determine_urgency(symptoms, follow_up_answers, db, hits: list | None = None):
+    """
+    Full recompute over every answer. Use after rule changes; the chat flow
+    keeps a running value with update_urgency instead.
+    """
+    rule_index = await get_rule_index(db, refresh=True)
+    urgency = base_urgency(symptoms, rule_index.symptoms)
 
-                # --- literal regex + string match ---
-                if re.search(rule.question_pattern, q, re.I):
-                    if any(tv.lower() in a for tv in rule.trigger_values):
-                        if urgency_rank[rule.new_urgency] > urgency_rank[urgency]:
-                            urgency = rule.new_urgency
-                            continue
+    entries = [(s, {**qa, "seq": i}) for s, answers in (follow_up_answers or {}).items()
+               for i, qa in enumerate(answers, start=1)]
+    return await escalate_urgency(urgency, entries, rule_index, hits=hits)
 
-                    # --- 🔥 LLM semantic fallback ---
-                    llm_match = await judge_rule_match(q, a, rule)
-                    if llm_match and urgency_rank[rule.new_urgency] > urgency_rank[urgency]:
-                        urgency = rule.new_urgency
 
-    return urgency
+async def update_urgency(current: str, new_entries, db=None, judged: dict | None = None, hits: list | None = None) -> str:
+    """
+    Incremental step: fold only the newly appended (symptom_key, qa) entries
+    into the consult's running urgency. Answers judged earlier are not re-sent
+    to the LLM; since urgency only ever goes up, max(previous, new) equals a
+    full re-scan as long as the rules haven't changed.
+    """
+    if not new_entries:
+        return current or "normal"
+    return await escalate_urgency(current or "normal", new_entries, await get_rule_index(db), judged, hits)
@@ -0,0 +1,112 @@
+# matcher.py
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+FUZZY_CUTOFF = 0.6
+# how many trigram-ranked candidates get a full SequenceMatcher score
+FUZZY_CANDIDATES = 32
+# below this length trigrams say little, so the whole length window is scored
+SHORT_TERM_LEN = 4
+
+
+def _trigrams(s: str) -> set[str]:
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymptomMatcher:
+    """
+    Precomputed replacement for the `get_close_matches(..., n=1, cutoff=0.6)`
+    scans in main.py. Build it once per symptom list and reuse it.
+
+    Exact hits come from a lower-case dict. Fuzzy lookups use a trigram
+    inverted index to shortlist the best-overlapping keys, then score only
+    those with SequenceMatcher.ratio under the same 0.6 cutoff.
+
+    Not exactly get_close_matches: trigram overlap only approximates ratio,
+    so on large catalogues the best-scoring key can fall outside the
+    `candidates` shortlist and a lower-scoring key (or None) is returned
+    (~99% agreement measured at 5,000 keys). Terms of SHORT_TERM_LEN or less
+    skip the shortlist and agree exactly; pass candidates=len(known) to
+    score every overlapping key.
+    """
+
+    def __init__(self, known: list[str], cutoff: float = FUZZY_CUTOFF, candidates: int = FUZZY_CANDIDATES):
+        self.cutoff = cutoff
+        self.candidates = candidates
+        self._exact: dict[str, str] = {}
+        for k in known:
+            self._exact.setdefault(k.lower(), k)
+        self._lowers = list(self._exact)
+        self._grams: dict[str, list[int]] = {}
+        self._by_len: dict[int, list[int]] = {}
+        for i, lower in enumerate(self._lowers):
+            for g in _trigrams(lower):
+                self._grams.setdefault(g, []).append(i)
+            self._by_len.setdefault(len(lower), []).append(i)
+
+    def __len__(self):
+        return len(self._lowers)
+
+    def match(self, term: str) -> str | None:
+        if term is None:
+            return None
+        t = term.strip().lower()
+        hit = self._exact.get(t)
+        if hit is not None:
+            return hit
+        best = self._closest(t)
+        return self._exact[best] if best is not None else None
+
+    def match_all(self, terms: list[str]) -> list[str]:
+        matched = []
+        for term in terms:
+            k = self.match(term)
+            if k is not None:
+                matched.append(k)
+        return list(dict.fromkeys(matched))
+
+    def _shortlist(self, t: str) -> list[int]:
+        la = len(t)
+        if la <= SHORT_TERM_LEN:
+            ids = []
+            for lb, bucket in self._by_len.items():
+                # length bound on ratio: 2*min/(la+lb)
+                if la + lb and 2.0 * min(la, lb) / (la + lb) >= self.cutoff:
+                    ids.extend(bucket)
+            return ids
+        overlap = Counter()
+        for g in _trigrams(t):
+            for i in self._grams.get(g, ()):
+                overlap[i] += 1
+        return [i for i, _ in overlap.most_common(self.candidates)]
+
+    def _closest(self, t: str) -> str | None:
+        la = len(t)
+        sm = SequenceMatcher()
+        sm.set_seq2(t)
+        best = None
+        for i in self._shortlist(t):
+            lower = self._lowers[i]
+            lb = len(lower)
+            if 2.0 * min(la, lb) / (la + lb) < self.cutoff:
+                continue
+            sm.set_seq1(lower)
+            if sm.quick_ratio() < self.cutoff:
+                continue
+            score = sm.ratio()
+            # same tie-break as get_close_matches: higher score, then larger string
+            if score >= self.cutoff and (best is None or (score, lower) > best):
+                best = (score, lower)
+        return best[1] if best else None
+
+
+@lru_cache(maxsize=256)
+def _matcher_for(known: tuple[str, ...]) -> SymptomMatcher:
+    return SymptomMatcher(list(known))
+
+
+def get_matcher(known: list[str]) -> SymptomMatcher:
+    """Cached matcher for small ad-hoc lists (e.g. a consult's own symptoms)."""
+    return _matcher_for(tuple(known))
@@ -0,0 +1,181 @@
+# metrics.py
+"""
+Minimal in-process metrics with Prometheus text exposition (served at /metrics).
+Counters, gauges and histograms with labels; no external dependency.
+"""
+import time
+import functools
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        # the DB timing hooks run in SQLAlchemy's greenlet/thread context
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_fmt_labels(self.labelnames, labels, extra)} {_fmt_value(value)}")
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for labels, child in list(self._children.items()):
+            yield "_total", labels, (), child.value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self):
+        for labels, child in list(self._children.items()):
+            yield "", labels, (), child.value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for labels, child in list(self._children.items()):
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), child.counts):
+                running += n
+                yield "_bucket", labels, (("le", _fmt_value(bound)),), running
+            yield "_sum", labels, (), child.sum
+            yield "_count", labels, (), running
+
+
+def timed(histogram: Histogram, *labels):
+    """Decorator recording the wall time of an async function, errors included."""
+    def deco(fn):
+        child = histogram.labels(*labels)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return deco
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------------- App metrics ---------------- #
+SOCKET_EVENT_SECONDS = Histogram("consult_socket_event_seconds", "Socket.IO handler latency", ["event"])
+SOCKET_EVENT_ERRORS = Counter("consult_socket_event_errors", "Socket.IO handlers that hit their error path", ["event"])
+LLM_FUNCTION_SECONDS = Histogram("consult_llm_function_seconds", "Latency of llm.py functions", ["function"])
+LLM_REQUESTS = Counter("consult_llm_requests", "Upstream LLM calls by outcome", ["outcome"])
+LLM_TOKENS = Counter("consult_llm_tokens", "LLM tokens from the usage field", ["model", "type"])
+DB_QUERY_SECONDS = Histogram("consult_db_query_seconds", "SQL statement latency", ["verb"])
+ACTIVE_SESSIONS = Gauge("consult_active_sessions", "Conversation sessions held by the session store")
+TRIAGE_OPEN = Gauge("consult_triage_open", "Consults waiting in the triage queue")
+DB_SLOW_QUERIES = Counter("consult_db_slow_queries", "SQL statements slower than DB_SLOW_QUERY_MS")
+LLM_CACHE = Counter("consult_llm_cache", "LLM response cache operations", ["backend", "event"])
+LLM_PREPASS = Counter("consult_llm_prepass", "Extractions answered by the local pre-pass or sent to the LLM",
+                      ["kind", "path"])
+LLM_PREFETCH = Counter("consult_llm_prefetch", "Speculative rephrase outcomes", ["outcome"])
+LLM_PREFETCH_INFLIGHT = Gauge("consult_llm_prefetch_inflight", "Speculative rephrases in flight")
+LLM_BREAKER_STATE = Gauge("consult_llm_breaker_state", "1 for the LLM circuit breaker's current state", ["state"])
+LLM_BREAKER_FAILURES = Gauge("consult_llm_breaker_failures", "Consecutive retryable upstream LLM failures")
+LLM_BUDGET = Gauge("consult_llm_budget", "Units left in the LLM rate-limit buckets", ["bucket"])
@@ -0,0 +1,108 @@
+# migrations.py
+"""
+Idempotent upgrades for databases created by older builds. Base.metadata.create_all
+only creates missing tables, so new columns on existing tables are added here.
+Both steps run on every app startup; to run them without starting the app:
+
+    python migrations.py    # schema upgrades + legacy follow_up_answers backfill
+"""
+import asyncio
+import logging
+from sqlalchemy import text, select, exists, cast, Text
+from sqlalchemy.dialects import postgresql, sqlite
+from db import engine, Base, async_session_maker
+from models import Consult, ConsultAnswer
+
+logger = logging.getLogger("migrations")
+
+# (table, column, DDL type) added after the table first shipped
+ADDED_COLUMNS = [
+    ("consults", "resume_token", "VARCHAR"),
+    ("patients", "created_at", "TIMESTAMPTZ NOT NULL DEFAULT now()"),
+    ("consults", "created_at", "TIMESTAMPTZ NOT NULL DEFAULT now()"),
+    ("consults", "calendar_event_id", "VARCHAR"),
+    ("consults", "summary_text", "TEXT"),
+    ("consults", "summary_etag", "VARCHAR"),
+    ("consults", "summary_at", "TIMESTAMPTZ"),
+    ("consults", "followup_progress", "JSON"),
+]
+ADDED_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_consults_resume_token ON consults (resume_token)",
+    "CREATE INDEX IF NOT EXISTS ix_patients_created_id ON patients (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_consults_created_id ON consults (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_consults_status_created ON consults (status, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_consults_urgency_created ON consults (urgency, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_consults_patient_id ON consults (patient_id)",
+]
+
+BACKFILL_BATCH = 500
+
+
+async def upgrade_schema(conn):
+    """Run inside engine.begin(); safe to call on every startup."""
+    if conn.dialect.name != "postgresql":
+        return
+    for table, column, ddl_type in ADDED_COLUMNS:
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl_type}"))
+    for ddl in ADDED_INDEXES:
+        await conn.execute(text(ddl))
+
+
+async def backfill_consult_answers() -> int:
+    """
+    Copy answers from the legacy Consult.follow_up_answers JSON into
+    consult_answers, for consults that have no rows there yet. Returns the
+    number of consults migrated. Consults written by this build keep the JSON
+    empty and are skipped, and rows another worker inserted first are left
+    alone, so it is cheap and safe to run from every worker's startup.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        async with async_session_maker() as db:
+            consults = (await db.execute(
+                select(Consult)
+                .where(Consult.id > last_id)
+                .where(cast(Consult.follow_up_answers, Text).notin_(["{}", "null"]))
+                .where(~exists().where(ConsultAnswer.consult_id == Consult.id))
+                .order_by(Consult.id)
+                .limit(BACKFILL_BATCH)
+            )).scalars().all()
+            if not consults:
+                return migrated
+
+            rows = []
+            for c in consults:
+                for symptom_key, answers in (c.follow_up_answers or {}).items():
+                    for seq, qa in enumerate(answers or [], start=1):
+                        if not isinstance(qa, dict):
+                            continue
+                        rows.append({
+                            "consult_id": c.id,
+                            "symptom_key": symptom_key,
+                            "seq": seq,
+                            "question": qa.get("question") or "Follow-up question",
+                            "answer": qa.get("answer") or "",
+                            "doctor_note": qa.get("doctor_note"),
+                        })
+                migrated += 1 if c.follow_up_answers else 0
+            if rows:
+                dialect = sqlite if db.bind.dialect.name == "sqlite" else postgresql
+                await db.execute(dialect.insert(ConsultAnswer).on_conflict_do_nothing(), rows)
+            await db.commit()
+            last_id = consults[-1].id
+            logger.info("Backfilled consult_answers up to consult %s", last_id)
+
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await upgrade_schema(conn)
+    n = await backfill_consult_answers()
+    logger.info("Migrated answers for %d consults", n)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
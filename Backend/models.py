@@ -1,7 +1,17 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON, ARRAY
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, ARRAY, Index, UniqueConstraint, func
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 from db import Base
 
+# Postgres ARRAY in production; SQLite (local runs, benchmarks) stores the list as JSON
+StringList = ARRAY(String).with_variant(JSON(), "sqlite")
+# SQLite keeps timestamps as text; bind them in CURRENT_TIMESTAMP's format so keyset
+# cursors compare equal to the server-defaulted values they were read from
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 
 class Patient(Base):
     __tablename__ = "patients"
@@ -10,10 +20,16 @@ class Patient(Base):
     name = Column(String, nullable=False)
     age = Column(String, nullable=False)
     email = Column(String, unique=True, index=True)
+    created_at = Column(Timestamp, server_default=func.now(), nullable=False)
 
     # ✅ relationship back to Consult
     consults = relationship("Consult", back_populates="patient", cascade="all, delete-orphan")
 
+    # keyset pagination walks (created_at, id) newest first
+    __table_args__ = (
+        Index("ix_patients_created_id", "created_at", "id"),
+    )
+
 
 class Consult(Base):
     __tablename__ = "consults"
@@ -24,7 +40,8 @@ class Consult(Base):
     # Store list of reported symptoms
     symptoms = Column(JSON, default=list)  # or Column(JSON) if your DB doesn’t support ARRAY
 
-    # Dict of {symptom_key: [ {question, answer, doctor_note?}, ... ]}
+    # Legacy {symptom_key: [ {question, answer, doctor_note?}, ... ]} blob; answers now
+    # live in consult_answers (see migrations.py) and this is no longer written
     follow_up_answers = Column(JSON, default={})
 
     status = Column(String, default="in_progress")
@@ -32,7 +49,63 @@ class Consult(Base):
     # ✅ urgency added
     urgency = Column(String, default="normal")  # normal | semi-urgent | urgent | very_urgent
 
+    # Handed to the client so a reconnecting socket can pick the consult back up
+    resume_token = Column(String, unique=True, index=True, nullable=True)
+
+    # {symptom_key: follow-up questions asked so far}; resume skips exactly these
+    followup_progress = Column(JSON, nullable=True)
+
+    created_at = Column(Timestamp, server_default=func.now(), nullable=False)
+
+    # Set once the notification worker booked the doctor's calendar
+    calendar_event_id = Column(String, nullable=True)
+
+    # Rendered doctor summary, stored on completion and served with its ETag
+    summary_text = Column(Text, nullable=True)
+    summary_etag = Column(String, nullable=True)
+    summary_at = Column(Timestamp, nullable=True)
+
     patient = relationship("Patient", back_populates="consults")
+    answers = relationship(
+        "ConsultAnswer", back_populates="consult", cascade="all, delete-orphan",
+        order_by="(ConsultAnswer.symptom_key, ConsultAnswer.seq)",
+    )
+
+    # listing filters (status / urgency / date range) all page by (created_at, id)
+    __table_args__ = (
+        Index("ix_consults_created_id", "created_at", "id"),
+        Index("ix_consults_status_created", "status", "created_at", "id"),
+        Index("ix_consults_urgency_created", "urgency", "created_at", "id"),
+        Index("ix_consults_patient_id", "patient_id"),
+    )
+
+
+class ConsultAnswer(Base):
+    __tablename__ = "consult_answers"
+
+    id = Column(Integer, primary_key=True)
+    consult_id = Column(Integer, ForeignKey("consults.id", ondelete="CASCADE"), nullable=False)
+    symptom_key = Column(String, nullable=False)
+
+    # 1-based position of the answer within (consult, symptom)
+    seq = Column(Integer, nullable=False)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False, default="")
+    doctor_note = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    consult = relationship("Consult", back_populates="answers")
+
+    __table_args__ = (
+        UniqueConstraint("consult_id", "symptom_key", "seq", name="uq_consult_answers_seq"),
+        Index("ix_consult_answers_symptom_created", "symptom_key", "created_at"),
+    )
+
+    def as_dict(self) -> dict:
+        qa = {"question": self.question, "answer": self.answer}
+        if self.doctor_note:
+            qa["doctor_note"] = self.doctor_note
+        return qa
 
 
 class SymptomRule(Base):
@@ -42,7 +115,7 @@ class SymptomRule(Base):
     symptom_key = Column(String, unique=True, index=True, nullable=False)
 
     # List of follow-up questions for this symptom
-    follow_up_questions = Column(ARRAY(String))
+    follow_up_questions = Column(StringList)
 
     # Base urgency if symptom is present
     urgency = Column(String, default="normal")  # normal | semi-urgent | urgent | very_urgent
@@ -60,7 +133,59 @@ class FollowUpRule(Base):
     question_pattern = Column(String, nullable=False)
 
     # Answers that trigger escalation
-    trigger_values = Column(ARRAY(String), nullable=False)
+    trigger_values = Column(StringList, nullable=False)
 
     # Escalated urgency
     new_urgency = Column(String, nullable=False)  # high, medium, low OR normal | semi-urgent | urgent | very_urgent
+
+
+class RuleVersion(Base):
+    __tablename__ = "rule_version"
+
+    # Single row, bumped whenever symptom/follow-up rules change so every worker can notice
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True)
+    consult_id = Column(Integer, ForeignKey("consults.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # telegram | calendar
+    payload = Column(JSON, default=dict)
+    status = Column(String, nullable=False, default="pending")  # pending | sent | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    # the worker polls due pending rows
+    __table_args__ = (
+        Index("ix_outbox_status_due", "status", "next_attempt_at"),
+    )
+
+
+class RuleHit(Base):
+    __tablename__ = "consult_rule_hits"
+
+    # One row per follow-up rule an answer triggered, recorded when it was evaluated
+    id = Column(Integer, primary_key=True)
+    consult_id = Column(Integer, ForeignKey("consults.id", ondelete="CASCADE"), nullable=False, index=True)
+    rule_id = Column(Integer, ForeignKey("followup_rules.id", ondelete="SET NULL"), nullable=True)
+    # (consult_id, symptom_key, answer_seq) points at the consult_answers row
+    symptom_key = Column(String, nullable=False)
+    answer_seq = Column(Integer, nullable=True)
+    match_type = Column(String, nullable=False)  # regex | llm
+    new_urgency = Column(String, nullable=False)
+    # snapshot, the rule may be edited or deleted later
+    question_pattern = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def as_dict(self) -> dict:
+        return {
+            "rule_id": self.rule_id, "symptom_key": self.symptom_key, "answer_seq": self.answer_seq,
+            "match_type": self.match_type, "new_urgency": self.new_urgency,
+            "question_pattern": self.question_pattern,
+        }
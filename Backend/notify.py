@@ -1,69 +1,279 @@
 # notify.py
-import os, requests, json
-from datetime import datetime, timedelta
-from sqlalchemy.ext.asyncio import AsyncSession
-from db import AsyncSessionLocal
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import os
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+import httpx
+from sqlalchemy import update
+from sqlalchemy.future import select
+from db import async_session_maker as AsyncSessionLocal
+from models import Consult, Patient, NotificationOutbox
+from repository import ConsultRepository
+from scheduler import SlotScheduler, _rfc3339, _parse_ts
 
+logger = logging.getLogger("notify")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 DOCTOR_CHAT_ID = os.getenv("DOCTOR_CHAT_ID")
 SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
-DOCTOR_CALENDAR_ID = os.getenv("DOCTOR_CALENDAR_ID")
-
-def send_telegram_text(text):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    r = requests.post(url, json={"chat_id": DOCTOR_CHAT_ID, "text": text, "parse_mode": "Markdown"})
-    return r.json()
-
-def find_next_slot_and_create_event(patient_email, description, patient_name, event_minutes=15, start_after_hours=1):
-    creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=["https://www.googleapis.com/auth/calendar"])
-    service = build("calendar", "v3", credentials=creds)
-    now = datetime.utcnow() + timedelta(hours=start_after_hours)
-    # round to next 15 min
-    minutes = ((now.minute // 15) + 1) * 15
-    candidate = now.replace(minute=0, second=0, microsecond=0) + timedelta(minutes=minutes)
-    end_search = candidate + timedelta(days=7)
-    while candidate < end_search:
-        tmin = candidate.isoformat() + "Z"
-        tmax = (candidate + timedelta(minutes=event_minutes)).isoformat() + "Z"
-        fb = service.freebusy().query(body={"timeMin": tmin, "timeMax": tmax, "items":[{"id": DOCTOR_CALENDAR_ID}]}).execute()
-        busy = fb["calendars"][DOCTOR_CALENDAR_ID]["busy"]
-        if not busy:
-            event = {
-                "summary": f"Cardio consult: {patient_name}",
-                "description": description,
-                "start": {"dateTime": tmin},
-                "end": {"dateTime": tmax},
-                "attendees": [{"email": patient_email}, {"email": DOCTOR_CALENDAR_ID}],
-            }
-            ev = service.events().insert(calendarId=DOCTOR_CALENDAR_ID, body=event, sendUpdates="all").execute()
-            return ev
-        candidate = candidate + timedelta(minutes=event_minutes)
-    return None
-
-async def send_telegram_and_schedule(consult_id: int):
-    async with AsyncSessionLocal() as db:
-        # fetch consult + patient
-        consult = await db.get(Consult, consult_id)
-        await db.refresh(consult)
-        patient = await db.get(Patient, consult.patient_id)
-        # build message
-        lines = [f"*New Cardiology Consult*\n*Patient*: {patient.name}\n*Email*: {patient.email}\n*Symptoms*: {', '.join(consult.symptoms)}\n", "*Follow-ups:*"]
-        for k, answers in (consult.follow_up_answers or {}).items():
-            lines.append(f"_{k}_")
-            for i, a in enumerate(answers):
-                lines.append(f"{i+1}. {a}")
-        text = "\n".join(lines)
-        send_telegram_text(text)
-        # create calendar event
-        description = "\n".join(lines)
-        ev = find_next_slot_and_create_event(patient.email, description, patient.name)
+
+# live | fake | off  (defaults to live only when Telegram is configured)
+NOTIFY_BACKEND = os.getenv("NOTIFY_BACKEND", "live" if TELEGRAM_TOKEN else "off")
+NOTIFY_POLL_SECONDS = float(os.getenv("NOTIFY_POLL_SECONDS", "2"))
+NOTIFY_BATCH = int(os.getenv("NOTIFY_BATCH", "20"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "5"))
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", "900"))
+# a claimed row is retried by any worker if its sender dies mid-flight
+NOTIFY_LEASE_SECONDS = float(os.getenv("NOTIFY_LEASE_SECONDS", "120"))
+
+
+# ---------------- Transports ---------------- #
+class TelegramTransport:
+    def __init__(self, token: str = TELEGRAM_TOKEN, chat_id: str = DOCTOR_CHAT_ID):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self._client: httpx.AsyncClient | None = None
+
+    async def send(self, text: str) -> dict:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0)
+        r = await self._client.post(self.url, json={"chat_id": self.chat_id, "text": text, "parse_mode": "Markdown"})
+        r.raise_for_status()
+        return r.json()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class GoogleCalendarTransport:
+    """
+    The Google API client is blocking, so every call runs in a worker thread
+    and the event loop stays free.
+    """
+
+    def __init__(self, service_account_file: str = SERVICE_ACCOUNT_FILE):
+        self.service_account_file = service_account_file
+        self._service = None
+
+    def _get_service(self):
+        if self._service is None:
+            from google.oauth2 import service_account
+            from googleapiclient.discovery import build
+            creds = service_account.Credentials.from_service_account_file(
+                self.service_account_file, scopes=["https://www.googleapis.com/auth/calendar"]
+            )
+            self._service = build("calendar", "v3", credentials=creds, cache_discovery=False)
+        return self._service
+
+    async def freebusy(self, calendar_id: str, time_min: datetime, time_max: datetime) -> list[tuple[datetime, datetime]]:
+        def _query():
+            body = {"timeMin": _rfc3339(time_min), "timeMax": _rfc3339(time_max), "items": [{"id": calendar_id}]}
+            return self._get_service().freebusy().query(body=body).execute()
+        fb = await asyncio.to_thread(_query)
+        return [(_parse_ts(b["start"]), _parse_ts(b["end"])) for b in fb["calendars"][calendar_id]["busy"]]
+
+    async def insert_event(self, calendar_id: str, event: dict) -> dict:
+        def _insert():
+            return self._get_service().events().insert(calendarId=calendar_id, body=event, sendUpdates="all").execute()
+        return await asyncio.to_thread(_insert)
+
+    async def close(self):
+        pass
+
+
+class FakeTelegram:
+    """Local stand-in: records messages instead of sending them."""
+
+    def __init__(self, fail_times: int = 0):
+        self.sent: list[str] = []
+        self.fail_times = fail_times
+
+    async def send(self, text: str) -> dict:
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise httpx.ConnectError("fake telegram outage")
+        self.sent.append(text)
+        return {"ok": True, "result": {"message_id": len(self.sent)}}
+
+    async def close(self):
+        pass
+
+
+class FakeCalendar:
+    """Local stand-in with an in-memory busy list per calendar."""
+
+    def __init__(self, busy: dict[str, list[tuple[datetime, datetime]]] | None = None):
+        self.busy = busy or {}
+        self.events: list[dict] = []
+        self.freebusy_calls = 0
+
+    async def freebusy(self, calendar_id: str, time_min: datetime, time_max: datetime):
+        self.freebusy_calls += 1
+        return [(s, e) for s, e in self.busy.get(calendar_id, []) if s < time_max and e > time_min]
+
+    async def insert_event(self, calendar_id: str, event: dict) -> dict:
+        start = _parse_ts(event["start"]["dateTime"])
+        end = _parse_ts(event["end"]["dateTime"])
+        self.busy.setdefault(calendar_id, []).append((start, end))
+        ev = {**event, "id": f"fake-{len(self.events) + 1}"}
+        self.events.append(ev)
+        return ev
+
+    async def close(self):
+        pass
+
+
+# ---------------- Outbox ---------------- #
+def enqueue_consult_notifications(db, consult_id: int):
+    """
+    Add the doctor notifications to the caller's transaction, so they are
+    durable exactly when the consult's completion is.
+    """
+    if NOTIFY_BACKEND == "off":
+        return
+    db.add(NotificationOutbox(consult_id=consult_id, kind="telegram", payload={}))
+    db.add(NotificationOutbox(consult_id=consult_id, kind="calendar", payload={}))
+
+
+async def build_consult_message(db, consult_id: int):
+    consult = await db.get(Consult, consult_id)
+    patient = await db.get(Patient, consult.patient_id)
+    answers = await ConsultRepository(db).load_answers(consult_id, consult.symptoms)
+    lines = [
+        f"*New Cardiology Consult*\n*Patient*: {patient.name}\n*Email*: {patient.email}\n"
+        f"*Urgency*: {(consult.urgency or 'normal').upper()}\n*Symptoms*: {', '.join(consult.symptoms or [])}\n",
+        "*Follow-ups:*",
+    ]
+    for k, qas in answers.items():
+        lines.append(f"_{k}_")
+        for i, qa in enumerate(qas):
+            lines.append(f"{i+1}. {qa['question']} — {qa['answer']}")
+    return consult, patient, "\n".join(lines)
+
+
+def _backoff(attempts: int) -> float:
+    # full jitter exponential backoff
+    return random.uniform(0, min(NOTIFY_BACKOFF_MAX, NOTIFY_BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+class NotificationWorker:
+    """
+    Background task draining notification_outbox. Rows are leased with a
+    conditional UPDATE so several workers can share the table; failures are
+    retried with jittered exponential backoff until NOTIFY_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, telegram=None, calendar=None, on_status_change=None):
+        self.telegram = telegram
+        self.calendar = calendar
+        self.scheduler = SlotScheduler(calendar) if calendar is not None else None
+        self.on_status_change = on_status_change
+        self._task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for t in (self.telegram, self.calendar):
+            if t is not None:
+                await t.close()
+
+    async def run(self):
+        while not self._stopping.is_set():
+            try:
+                done = await self.process_due()
+            except Exception:
+                logger.exception("Notification worker iteration failed")
+                done = 0
+            if not done:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), NOTIFY_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _lease_batch(self) -> list[NotificationOutbox]:
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as db:
+            due = (await db.execute(
+                select(NotificationOutbox.id)
+                .where(NotificationOutbox.status == "pending", NotificationOutbox.next_attempt_at <= now)
+                .order_by(NotificationOutbox.id)
+                .limit(NOTIFY_BATCH)
+            )).scalars().all()
+            if not due:
+                return []
+            res = await db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(due), NotificationOutbox.status == "pending",
+                       NotificationOutbox.next_attempt_at <= now)
+                .values(attempts=NotificationOutbox.attempts + 1,
+                        next_attempt_at=now + timedelta(seconds=NOTIFY_LEASE_SECONDS))
+                .returning(NotificationOutbox)
+            )
+            rows = res.scalars().all()
+            await db.commit()
+            return rows
+
+    async def process_due(self) -> int:
+        rows = await self._lease_batch()
+        for row in rows:
+            await self._deliver(row)
+        return len(rows)
+
+    async def _deliver(self, row: NotificationOutbox):
+        async with AsyncSessionLocal() as db:
+            try:
+                if row.kind == "telegram":
+                    _, _, text = await build_consult_message(db, row.consult_id)
+                    await self.telegram.send(text)
+                elif row.kind == "calendar":
+                    await self._schedule(db, row.consult_id)
+                else:
+                    raise ValueError(f"unknown notification kind {row.kind!r}")
+                values = {"status": "sent", "sent_at": datetime.now(timezone.utc), "last_error": None}
+            except Exception as e:
+                logger.warning("Notification %s (%s) attempt %s failed: %s", row.id, row.kind, row.attempts, e)
+                await db.rollback()
+                if row.attempts >= NOTIFY_MAX_ATTEMPTS:
+                    values = {"status": "failed", "last_error": str(e)}
+                else:
+                    values = {"last_error": str(e),
+                              "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=_backoff(row.attempts))}
+            await db.execute(update(NotificationOutbox).where(NotificationOutbox.id == row.id).values(**values))
+            await db.commit()
+
+    async def _schedule(self, db, consult_id: int):
+        consult, patient, description = await build_consult_message(db, consult_id)
+        if consult.calendar_event_id:
+            return  # booked on an earlier attempt
+        ev = await self.scheduler.book(patient.email, description, patient.name)
+        repo = ConsultRepository(db)
         if ev:
-            consult.calendar_event_id = ev.get("id")
-            consult.status = "scheduled"
+            row = await repo.set_status(consult_id, "scheduled", calendar_event_id=ev.get("id"))
         else:
-            consult.status = "needs_manual_schedule"
+            row = await repo.set_status(consult_id, "needs_manual_schedule")
         await db.commit()
-        
+        if self.on_status_change and row is not None:
+            await self.on_status_change(row)
+
+
+def build_worker(on_status_change=None) -> NotificationWorker | None:
+    if NOTIFY_BACKEND == "off":
+        return None
+    if NOTIFY_BACKEND == "fake":
+        return NotificationWorker(FakeTelegram(), FakeCalendar(), on_status_change)
+    return NotificationWorker(TelegramTransport(), GoogleCalendarTransport(), on_status_change)
@@ -0,0 +1,83 @@
+# prefetch.py
+import os
+import asyncio
+import logging
+import metrics
+
+logger = logging.getLogger("prefetch")
+
+LLM_PREFETCH = os.getenv("LLM_PREFETCH", "true").lower() in ("1", "true", "yes")
+# how many upcoming questions per sid are rephrased ahead of time
+LLM_PREFETCH_DEPTH = int(os.getenv("LLM_PREFETCH_DEPTH", "1"))
+# process-wide cap; past it new prefetches are skipped, not queued
+LLM_PREFETCH_MAX_INFLIGHT = int(os.getenv("LLM_PREFETCH_MAX_INFLIGHT", "64"))
+# longest a handler waits (holding its session lock) for an in-flight prefetch before rephrasing itself
+LLM_PREFETCH_WAIT = float(os.getenv("LLM_PREFETCH_WAIT", "2"))
+
+
+class RephrasePrefetcher:
+    """
+    Speculatively rephrases the next queued follow-up question(s) while the
+    patient is still typing. Tasks are keyed by (sid, text); a question that
+    is no longer at the head of the queue has its task cancelled. Tasks live
+    in this process only, which is fine because a socket stays on its worker.
+    """
+
+    def __init__(self, rephrase, depth: int = LLM_PREFETCH_DEPTH, max_inflight: int = LLM_PREFETCH_MAX_INFLIGHT):
+        self.rephrase = rephrase  # async (patient_name, text) -> str
+        self.depth = depth
+        self.max_inflight = max_inflight
+        self._tasks: dict[str, dict[str, asyncio.Task]] = {}
+
+    def inflight(self) -> int:
+        return sum(1 for tasks in self._tasks.values() for t in tasks.values() if not t.done())
+
+    def schedule(self, sid: str, patient_name: str, upcoming: list[str]):
+        """Make the first `depth` texts of `upcoming` the only ones prefetched for this sid."""
+        wanted = upcoming[:self.depth]
+        tasks = self._tasks.setdefault(sid, {})
+        for text in list(tasks):
+            if text not in wanted:
+                self._discard(tasks.pop(text))
+        for text in wanted:
+            if text in tasks:
+                continue
+            if self.inflight() >= self.max_inflight:
+                metrics.LLM_PREFETCH.labels("skipped").inc()
+                break
+            tasks[text] = asyncio.create_task(self.rephrase(patient_name, text))
+            metrics.LLM_PREFETCH.labels("scheduled").inc()
+        if not tasks:
+            self._tasks.pop(sid, None)
+
+    async def take(self, sid: str, text: str, timeout: float | None = None) -> str | None:
+        """
+        The prefetched phrasing of `text`, waiting for it if still in flight.
+        None if nothing was prefetched for it or the prefetch failed.
+        """
+        tasks = self._tasks.get(sid, {})
+        task = tasks.pop(text, None)
+        if not tasks:
+            self._tasks.pop(sid, None)
+        if task is None:
+            metrics.LLM_PREFETCH.labels("miss").inc()
+            return None
+        try:
+            phrased = await asyncio.wait_for(task, timeout) if timeout else await task
+        except Exception as e:
+            logger.info("Prefetched rephrase unusable for %s: %s", sid, e)
+            metrics.LLM_PREFETCH.labels("miss").inc()
+            return None
+        metrics.LLM_PREFETCH.labels("hit").inc()
+        return phrased or None
+
+    def cancel(self, sid: str):
+        for task in self._tasks.pop(sid, {}).values():
+            self._discard(task)
+
+    def _discard(self, task: asyncio.Task):
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # retrieve it so asyncio doesn't warn about an unread error
+        metrics.LLM_PREFETCH.labels("discarded").inc()
@@ -0,0 +1,216 @@
+# prefilter.py
+import re
+from functools import lru_cache
+from word2number import w2n
+import metrics
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+INT_RE = re.compile(r"\d+")
+# only an explicit introduction is answered locally; "call me Al", "It's Bob" go to the LLM
+NAME_INTRO_RE = re.compile(r"^(?:(?:hi|hello|hey)[,!\s]+)?(?:my name is|my name's|name is|name:)\s*(.*?)[.!]?$", re.I)
+NAME_TOKEN_RE = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+
+AGE_FILLER = {"i", "am", "i'm", "im", "my", "age", "is", "it's", "its", "years", "year", "yrs", "yr", "old", "aged", "and", "a", "about"}
+NAME_STOPWORDS = {
+    "i", "i'm", "im", "am", "my", "is", "name", "not", "no", "yes", "ok", "okay", "fine", "sure", "the", "a", "an",
+    "hi", "hello", "hey", "years", "old",
+}
+SYMPTOM_FILLER = {
+    "i", "i'm", "im", "am", "have", "has", "had", "having", "is", "are", "was", "been", "my", "a", "an",
+    "the", "and", "also", "with", "some", "feel", "feeling", "felt", "experiencing", "got", "getting",
+    "me", "it", "bit", "little", "plus", "too", "both", "as", "well", "lot", "of", "or",
+}
+MAX_AGE = 130
+
+UNITS = {"one", "two", "three", "four", "five", "six", "seven", "eight", "nine"}
+TEENS = {"ten", "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"}
+TENS = {"twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"}
+AGE_NUMBER_WORDS = UNITS | TEENS | TENS | {"hundred"}
+
+
+# ---------------- Field pre-pass ---------------- #
+def _local_email(text: str) -> str | None:
+    found = set(EMAIL_RE.findall(text))
+    return found.pop() if len(found) == 1 else None
+
+
+def _is_age_phrase(words: list[str]) -> bool:
+    """
+    [unit hundred [and]] (teen | tens [unit] | unit). w2n itself is lenient
+    ("forty and two" -> 42, "two forty"), so the shape is checked first.
+    """
+    if len(words) >= 2 and words[0] in UNITS and words[1] == "hundred":
+        words = words[2:]
+        if not words:
+            return True
+        if words[0] == "and":
+            words = words[1:]
+    if len(words) == 1:
+        return words[0] in UNITS | TEENS | TENS
+    return len(words) == 2 and words[0] in TENS and words[1] in UNITS
+
+
+def _local_age(text: str) -> str | None:
+    t = text.strip().lower()
+    ints = INT_RE.findall(t)
+    if ints:
+        if len(ints) != 1:
+            return None
+        rest = re.sub(r"[^\w'\s]", " ", INT_RE.sub(" ", t)).split()
+        if all(w in AGE_FILLER for w in rest) and 0 < int(ints[0]) <= MAX_AGE:
+            return str(int(ints[0]))
+        return None
+
+    words = re.sub(r"[^\w'\s-]", " ", t).replace("-", " ").split()
+    found = [i for i, w in enumerate(words) if w in AGE_NUMBER_WORDS]
+    if not found:
+        return None
+    # one contiguous number phrase, nothing but filler around it
+    number, rest = words[found[0]:found[-1] + 1], words[:found[0]] + words[found[-1] + 1:]
+    if not _is_age_phrase(number) or not all(w in AGE_FILLER for w in rest):
+        return None
+    try:
+        age = w2n.word_to_num(" ".join(number))
+    except ValueError:
+        return None
+    return str(age) if 0 < age <= MAX_AGE else None
+
+
+@lru_cache(maxsize=32)
+def _symptom_words(known: tuple[str, ...]) -> frozenset[str]:
+    return frozenset(w for k in known for w in k.lower().split())
+
+
+def _local_name(text: str, known_symptoms: tuple[str, ...] = ()) -> str | None:
+    m = NAME_INTRO_RE.match(text.strip())
+    if not m:
+        return None
+    tokens = m.group(1).split()
+    if not 1 <= len(tokens) <= 3 or not all(NAME_TOKEN_RE.fullmatch(w) for w in tokens):
+        return None
+    symptom_words = _symptom_words(known_symptoms)
+    if any(w.lower() in NAME_STOPWORDS or w.lower() in symptom_words for w in tokens):
+        return None
+    return " ".join(w[:1].upper() + w[1:] for w in tokens)
+
+
+_FIELD_EXTRACTORS = {"email": _local_email, "age": _local_age, "name": _local_name}
+
+
+def prefill_field(field: str, user_text: str, known_symptoms=()) -> str | None:
+    """
+    Deterministic extraction for unambiguous input. None means "ask the LLM".
+    known_symptoms keeps symptom words from being taken for a name.
+    """
+    fn = _FIELD_EXTRACTORS.get(field)
+    value = None
+    if fn and user_text:
+        value = fn(user_text, tuple(known_symptoms)) if field == "name" else fn(user_text)
+    metrics.LLM_PREPASS.labels("extract_field", "local" if value is not None else "llm").inc()
+    return value
+
+
+# ---------------- Symptom pre-pass ---------------- #
+class AhoCorasick:
+    """
+    Multi-pattern substring search over the lower-cased symptom keys,
+    one pass over the text regardless of catalogue size.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[list[str]] = [[]]
+        for p in patterns:
+            if p:
+                self._add(p)
+        self._build()
+
+    def _add(self, pattern: str):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = nxt
+        self.out[node].append(pattern)
+
+    def _build(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if node else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text: str) -> list[tuple[int, int, str]]:
+        """All (start, end, pattern) occurrences."""
+        hits = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for p in self.out[node]:
+                hits.append((i - len(p) + 1, i + 1, p))
+        return hits
+
+
+class SymptomScanner:
+    def __init__(self, known: list[str]):
+        self.by_lower: dict[str, str] = {}
+        for k in known:
+            self.by_lower.setdefault(k.lower(), k)
+        self.automaton = AhoCorasick(list(self.by_lower))
+
+    def scan(self, text: str) -> tuple[list[str], str]:
+        """
+        Whole-word, leftmost-longest key matches plus the text left over
+        once they are cut out.
+        """
+        t = text.lower()
+        hits = [
+            h for h in self.automaton.find(t)
+            if (h[0] == 0 or not t[h[0] - 1].isalnum()) and (h[1] == len(t) or not t[h[1]].isalnum())
+        ]
+        hits.sort(key=lambda h: (h[0], -(h[1] - h[0])))
+        matched, pieces, pos = [], [], 0
+        for start, end, p in hits:
+            if start < pos:
+                continue
+            matched.append(self.by_lower[p])
+            pieces.append(t[pos:start])
+            pos = end
+        pieces.append(t[pos:])
+        return list(dict.fromkeys(matched)), " ".join(pieces)
+
+
+@lru_cache(maxsize=32)
+def _scanner_for(known: tuple[str, ...]) -> SymptomScanner:
+    return SymptomScanner(list(known))
+
+
+def prefill_symptoms(user_text: str, known_symptoms: list[str]) -> list[str] | None:
+    """
+    Known keys found verbatim, when nothing but filler words is left over.
+    Anything else (negations, durations, unknown complaints) returns None
+    so the LLM sees it.
+    """
+    matched = []
+    if user_text and known_symptoms:
+        matched, rest = _scanner_for(tuple(known_symptoms)).scan(user_text)
+        words = re.sub(r"[^\w'\s]", " ", rest).split()
+        if matched and not all(w in SYMPTOM_FILLER for w in words):
+            matched = []
+    metrics.LLM_PREPASS.labels("extract_symptoms", "local" if matched else "llm").inc()
+    return matched or None
@@ -0,0 +1,184 @@
+# repository.py
+import hashlib
+from sqlalchemy import insert, update, delete, func, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.future import select
+from sqlalchemy.orm.attributes import set_committed_value
+from models import Patient, Consult, ConsultAnswer, RuleHit
+
+# Set by /triage/claim; nothing the chat flow or the notification worker writes later may undo it
+CLAIMED_STATUS = "claimed"
+# What the triage queue needs; status writes return it so callers publish the stored state
+TRIAGE_COLUMNS = (Consult.id, Consult.patient_id, Consult.urgency, Consult.status, Consult.created_at)
+
+
+def serialize_answers(rows, symptoms: list[str] | None = None) -> dict:
+    """
+    consult_answers rows -> the {symptom_key: [ {question, answer, doctor_note?}, ... ]}
+    shape ConsultOut.follow_up_answers has always exposed.
+    """
+    out = {k: [] for k in (symptoms or [])}
+    for r in sorted(rows, key=lambda r: (r.symptom_key, r.seq)):
+        out.setdefault(r.symptom_key, []).append(r.as_dict())
+    return out
+
+
+def summary_etag(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+
+def _unless_claimed(status: str):
+    # decided by the row at UPDATE time, so a claim that landed mid-turn still wins
+    return case((Consult.status == CLAIMED_STATUS, Consult.status), else_=status)
+
+
+def _insert_for(db, table):
+    # ON CONFLICT is dialect specific; Postgres in prod, SQLite for local runs
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+class ConsultRepository:
+    """
+    Persistence for the chat flow. Every method is a single statement on the
+    caller's session, so a socket turn costs at most one read plus one commit.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def upsert_patient(self, name: str, age: str | None, email: str) -> int:
+        """
+        Insert the patient or reuse the row with the same email, filling in
+        the age only if the stored one is empty. Returns the patient id.
+        """
+        stmt = _insert_for(self.db, Patient).values(name=name, age=age or "", email=email)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Patient.email],
+            set_={"age": func.coalesce(func.nullif(Patient.age, ""), stmt.excluded.age)},
+        ).returning(Patient.id)
+        return (await self.db.execute(stmt)).scalar_one()
+
+    async def create_consult(self, patient_id: int, resume_token: str):
+        """Returns the new row's TRIAGE_COLUMNS."""
+        stmt = _insert_for(self.db, Consult).values(
+            patient_id=patient_id, symptoms=[], resume_token=resume_token,
+        ).returning(*TRIAGE_COLUMNS)
+        return (await self.db.execute(stmt)).one()
+
+    async def get_consult(self, consult_id: int) -> Consult | None:
+        # plain row, no relationship loading
+        return (await self.db.execute(select(Consult).where(Consult.id == consult_id))).scalar_one_or_none()
+
+    async def set_symptoms(self, consult_id: int, symptoms: list[str], urgency: str):
+        res = await self.db.execute(
+            update(Consult)
+            .where(Consult.id == consult_id)
+            .values(symptoms=symptoms, urgency=urgency, followup_progress={})
+            .returning(*TRIAGE_COLUMNS)
+        )
+        return res.one()
+
+    async def append_answers(self, consult_id: int, rows: list[dict]):
+        """Append-only: one multi-row INSERT of {symptom_key, seq, question, answer, doctor_note}."""
+        if rows:
+            await self.db.execute(insert(ConsultAnswer), [{"consult_id": consult_id, **r} for r in rows])
+
+    async def update_consult(self, consult: Consult, urgency: str, status: str | None = None,
+                             progress: dict | None = None):
+        """
+        The turn's one consult UPDATE; a new status never replaces a claim.
+        Returns the stored TRIAGE_COLUMNS and refreshes the loaded `consult`.
+        """
+        values = {"urgency": urgency}
+        if status:
+            values["status"] = _unless_claimed(status)
+        if progress is not None:
+            values["followup_progress"] = progress
+        res = await self.db.execute(
+            update(Consult)
+            .where(Consult.id == consult.id)
+            .values(**values)
+            .returning(*TRIAGE_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+        row = res.one()
+        set_committed_value(consult, "urgency", row.urgency)
+        set_committed_value(consult, "status", row.status)
+        if progress is not None:
+            set_committed_value(consult, "followup_progress", progress)
+        return row
+
+    async def load_answers(self, consult_id: int, symptoms: list[str] | None = None) -> dict:
+        rows = (await self.db.execute(
+            select(ConsultAnswer)
+            .where(ConsultAnswer.consult_id == consult_id)
+            .order_by(ConsultAnswer.symptom_key, ConsultAnswer.seq)
+        )).scalars().all()
+        return serialize_answers(rows, symptoms)
+
+    async def answer_counts(self, consult_id: int) -> dict[str, int]:
+        res = await self.db.execute(
+            select(ConsultAnswer.symptom_key, func.max(ConsultAnswer.seq))
+            .where(ConsultAnswer.consult_id == consult_id)
+            .group_by(ConsultAnswer.symptom_key)
+        )
+        return {k: n for k, n in res.all()}
+
+    async def set_status(self, consult_id: int, status: str, **values):
+        """
+        Status change (plus any other `values`) that leaves a claimed consult
+        claimed. Returns the stored TRIAGE_COLUMNS, or None if there is no such consult.
+        """
+        res = await self.db.execute(
+            update(Consult)
+            .where(Consult.id == consult_id)
+            .values(status=_unless_claimed(status), **values)
+            .returning(*TRIAGE_COLUMNS)
+        )
+        return res.one_or_none()
+
+    async def claim(self, consult_id: int, from_statuses, status: str = CLAIMED_STATUS):
+        """
+        Conditional status flip so two workers can't hand out the same consult.
+        Returns the claimed row, or None if someone else got there first.
+        """
+        res = await self.db.execute(
+            update(Consult)
+            .where(Consult.id == consult_id, Consult.status.in_(from_statuses))
+            .values(status=status)
+            .returning(*TRIAGE_COLUMNS)
+        )
+        return res.one_or_none()
+
+    async def add_rule_hits(self, consult_id: int, hits: list[dict]):
+        if hits:
+            await self.db.execute(insert(RuleHit), [{"consult_id": consult_id, **h} for h in hits])
+
+    async def replace_rule_hits(self, consult_id: int, hits: list[dict]):
+        await self.db.execute(delete(RuleHit).where(RuleHit.consult_id == consult_id))
+        await self.add_rule_hits(consult_id, hits)
+
+    async def load_rule_hits(self, consult_id: int) -> list[dict]:
+        rows = (await self.db.execute(
+            select(RuleHit).where(RuleHit.consult_id == consult_id).order_by(RuleHit.id)
+        )).scalars().all()
+        return [r.as_dict() for r in rows]
+
+    async def store_summary(self, consult_id: int, text: str) -> str:
+        etag = summary_etag(text)
+        await self.db.execute(
+            update(Consult)
+            .where(Consult.id == consult_id)
+            .values(summary_text=text, summary_etag=etag, summary_at=func.now())
+        )
+        return etag
+
+    async def get_summary(self, consult_id: int):
+        """(status, summary_text, summary_etag, summary_at) without loading the rest of the row."""
+        res = await self.db.execute(
+            select(Consult.status, Consult.summary_text, Consult.summary_etag, Consult.summary_at)
+            .where(Consult.id == consult_id)
+        )
+        return res.one_or_none()
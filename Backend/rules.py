@@ -0,0 +1,138 @@
+# rules.py
+import os
+import re
+import time
+import asyncio
+import logging
+from sqlalchemy import update
+from sqlalchemy.future import select
+from db import async_session_maker
+from models import SymptomRule, FollowUpRule, RuleVersion
+from matcher import SymptomMatcher
+
+logger = logging.getLogger("rules")
+
+URGENCY_RANK = {
+    "normal": 0,
+    "semi-urgent": 1,
+    "urgent": 2,
+    "very_urgent": 3,
+    "high": 4
+}
+
+# How often a worker asks the DB whether another worker changed the rules
+RULE_INDEX_POLL_SECONDS = float(os.getenv("RULE_INDEX_POLL_SECONDS", "5"))
+
+
+class CompiledSymptomRule:
+    __slots__ = ("id", "symptom_key", "follow_up_questions", "urgency")
+
+    def __init__(self, rule: SymptomRule):
+        self.id = rule.id
+        self.symptom_key = rule.symptom_key
+        self.follow_up_questions = list(rule.follow_up_questions or [])
+        self.urgency = rule.urgency or "normal"
+
+
+class CompiledFollowUpRule:
+    """
+    Detached copy of a FollowUpRule with the regex compiled and triggers
+    lower-cased once. Keeps the ORM attribute names so prompt builders
+    (judge_rule_match) can take either.
+    """
+    __slots__ = ("id", "symptom_key", "question_pattern", "pattern", "trigger_values", "new_urgency")
+
+    def __init__(self, rule: FollowUpRule):
+        self.id = rule.id
+        self.symptom_key = rule.symptom_key
+        self.question_pattern = rule.question_pattern
+        self.trigger_values = [tv.lower() for tv in (rule.trigger_values or [])]
+        self.new_urgency = rule.new_urgency
+        try:
+            self.pattern = re.compile(rule.question_pattern, re.I)
+        except re.error as e:
+            logger.warning("Skipping follow-up rule %s with invalid pattern %r: %s", rule.id, rule.question_pattern, e)
+            self.pattern = None
+
+    def matches_question(self, question: str) -> bool:
+        return self.pattern is not None and self.pattern.search(question) is not None
+
+    def matches_answer(self, answer: str) -> bool:
+        a = answer.lower()
+        return any(tv in a for tv in self.trigger_values)
+
+
+class RuleIndex:
+    def __init__(self, version: int, symptom_rules, followup_rules):
+        self.version = version
+        self.symptoms: dict[str, CompiledSymptomRule] = {}
+        for r in symptom_rules:
+            self.symptoms[r.symptom_key] = CompiledSymptomRule(r)
+        self.followups: dict[str, list[CompiledFollowUpRule]] = {}
+        for r in followup_rules:
+            self.followups.setdefault(r.symptom_key, []).append(CompiledFollowUpRule(r))
+        self.symptom_keys = list(self.symptoms)
+        self._matcher: SymptomMatcher | None = None
+
+    @property
+    def matcher(self) -> SymptomMatcher:
+        # built lazily, once per rule version
+        if self._matcher is None:
+            self._matcher = SymptomMatcher(self.symptom_keys)
+        return self._matcher
+
+    def followups_for(self, symptom_key: str) -> list[CompiledFollowUpRule]:
+        return self.followups.get(symptom_key, [])
+
+    def all_followups(self) -> list[CompiledFollowUpRule]:
+        return [r for rules in self.followups.values() for r in rules]
+
+
+_index: RuleIndex | None = None
+_checked_at = 0.0
+_lock = asyncio.Lock()
+
+
+async def _current_version(db) -> int:
+    version = (await db.execute(select(RuleVersion.version).where(RuleVersion.id == 1))).scalar_one_or_none()
+    return version or 0
+
+
+async def get_rule_index(db=None, refresh: bool = False) -> RuleIndex:
+    """
+    Process-wide compiled view of the rule tables. Rebuilt when this worker
+    changed the rules, or when the shared version row moved (polled at most
+    every RULE_INDEX_POLL_SECONDS). Without `db` a short-lived session is
+    opened only if the index actually needs checking.
+    """
+    global _index, _checked_at
+    now = time.monotonic()
+    if not refresh and _index is not None and now - _checked_at < RULE_INDEX_POLL_SECONDS:
+        return _index
+    if db is None:
+        async with async_session_maker() as own_db:
+            return await get_rule_index(own_db, refresh=refresh)
+
+    async with _lock:
+        if not refresh and _index is not None and time.monotonic() - _checked_at < RULE_INDEX_POLL_SECONDS:
+            return _index
+        version = await _current_version(db)
+        if refresh or _index is None or _index.version != version:
+            symptom_rules = (await db.execute(select(SymptomRule))).scalars().all()
+            followup_rules = (await db.execute(select(FollowUpRule))).scalars().all()
+            _index = RuleIndex(version, symptom_rules, followup_rules)
+            logger.info("Rule index built (version %s, %d symptoms)", version, len(_index.symptoms))
+        _checked_at = time.monotonic()
+        return _index
+
+
+async def bump_rule_version(db):
+    """Call inside the transaction that edits rules, then invalidate_rule_index() after commit."""
+    res = await db.execute(update(RuleVersion).where(RuleVersion.id == 1).values(version=RuleVersion.version + 1))
+    if not res.rowcount:
+        db.add(RuleVersion(id=1, version=1))
+
+
+def invalidate_rule_index():
+    global _index
+    _index = None
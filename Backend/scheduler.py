@@ -0,0 +1,175 @@
+# scheduler.py
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger("scheduler")
+
+# Comma separated; the first free least-loaded doctor gets the consult
+DOCTOR_CALENDAR_IDS = [c.strip() for c in os.getenv(
+    "DOCTOR_CALENDAR_IDS", os.getenv("DOCTOR_CALENDAR_ID", "")
+).split(",") if c.strip()]
+SCHEDULER_BUSY_TTL = float(os.getenv("SCHEDULER_BUSY_TTL", "300"))
+
+EVENT_MINUTES = 15
+START_AFTER_HOURS = 1
+SEARCH_DAYS = 7
+
+
+class BusyIndex:
+    """
+    One calendar's busy time as sorted, merged, non-overlapping intervals
+    kept in two parallel lists. Inserts merge neighbours in place; lookups
+    bisect to the first interval that can collide and walk forward.
+    """
+
+    def __init__(self):
+        self.starts: list[datetime] = []
+        self.ends: list[datetime] = []
+        self.covered_until: datetime | None = None
+        self.fetched_at = 0.0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start: datetime, end: datetime):
+        if end <= start:
+            return
+        # every interval touching [start, end] is folded into one
+        lo = bisect_left(self.ends, start)
+        hi = bisect_right(self.starts, end)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+
+    def prune(self, before: datetime):
+        """Drop intervals that ended before `before`."""
+        i = bisect_right(self.ends, before)
+        if i:
+            del self.starts[:i]
+            del self.ends[:i]
+
+    def busy_minutes(self, start: datetime, end: datetime) -> float:
+        total = 0.0
+        for i in range(bisect_right(self.ends, start), len(self.starts)):
+            if self.starts[i] >= end:
+                break
+            total += (min(end, self.ends[i]) - max(start, self.starts[i])).total_seconds() / 60
+        return total
+
+    def first_free(self, after: datetime, until: datetime, minutes: int = EVENT_MINUTES,
+                   origin: datetime | None = None) -> datetime | None:
+        """
+        Earliest slot of `minutes` starting at or after `after` on the grid
+        origin + k*minutes that overlaps no busy interval and ends by `until`.
+        """
+        step = timedelta(minutes=minutes)
+        origin = origin or after
+        candidate = origin + -(-(after - origin) // step) * step
+        i = bisect_right(self.ends, candidate)  # first interval still busy at candidate
+        while candidate + step <= until:
+            if i >= len(self.starts) or self.starts[i] >= candidate + step:
+                return candidate
+            candidate = origin + -(-(self.ends[i] - origin) // step) * step
+            i += 1
+        return None
+
+
+def search_window(now: datetime | None = None):
+    now = (now or datetime.now(timezone.utc)) + timedelta(hours=START_AFTER_HOURS)
+    # round to next 15 min
+    minutes = ((now.minute // 15) + 1) * 15
+    start = now.replace(minute=0, second=0, microsecond=0) + timedelta(minutes=minutes)
+    return start, start + timedelta(days=SEARCH_DAYS)
+
+
+class SlotScheduler:
+    """
+    Local booking engine over one or more doctor calendars. Busy windows are
+    cached per doctor for SCHEDULER_BUSY_TTL; inside the TTL only the part of
+    the search window not yet covered is fetched, and our own bookings are
+    added locally, so a burst of consults costs one freebusy call per doctor.
+    """
+
+    def __init__(self, calendar, calendar_ids: list[str] | None = None,
+                 ttl: float = SCHEDULER_BUSY_TTL, minutes: int = EVENT_MINUTES):
+        self.calendar = calendar
+        self.calendar_ids = calendar_ids or DOCTOR_CALENDAR_IDS
+        self.ttl = ttl
+        self.minutes = minutes
+        self._busy: dict[str, BusyIndex] = {}
+        # pick + insert must not interleave or two consults get the same slot
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, calendar_id: str | None = None):
+        if calendar_id is None:
+            self._busy.clear()
+        else:
+            self._busy.pop(calendar_id, None)
+
+    async def busy_index(self, calendar_id: str, start: datetime, end: datetime) -> BusyIndex:
+        idx = self._busy.get(calendar_id)
+        if idx is None or time.monotonic() - idx.fetched_at > self.ttl:
+            idx = BusyIndex()
+            fetch_from = start
+        elif idx.covered_until < end:
+            fetch_from = idx.covered_until
+        else:
+            idx.prune(start)
+            return idx
+        for s, e in await self.calendar.freebusy(calendar_id, fetch_from, end):
+            idx.add(s, e)
+        if idx.covered_until is None:
+            idx.fetched_at = time.monotonic()
+        idx.covered_until = end
+        idx.prune(start)
+        self._busy[calendar_id] = idx
+        return idx
+
+    async def pick(self, start: datetime, end: datetime):
+        """(calendar_id, slot) of the least-loaded doctor with a free slot, earliest slot breaking ties."""
+        indexes = await asyncio.gather(*(self.busy_index(c, start, end) for c in self.calendar_ids))
+        best = None
+        for cid, idx in zip(self.calendar_ids, indexes):
+            slot = idx.first_free(start, end, self.minutes, origin=start)
+            if slot is None:
+                continue
+            key = (idx.busy_minutes(start, end), slot)
+            if best is None or key < best[0]:
+                best = (key, cid, slot)
+        return (best[1], best[2]) if best else (None, None)
+
+    async def book(self, patient_email: str, description: str, patient_name: str) -> dict | None:
+        if not self.calendar_ids:
+            logger.warning("No doctor calendars configured")
+            return None
+        async with self._lock:
+            start, end = search_window()
+            calendar_id, slot = await self.pick(start, end)
+            if slot is None:
+                return None
+            slot_end = slot + timedelta(minutes=self.minutes)
+            event = {
+                "summary": f"Cardio consult: {patient_name}",
+                "description": description,
+                "start": {"dateTime": _rfc3339(slot)},
+                "end": {"dateTime": _rfc3339(slot_end)},
+                "attendees": [{"email": patient_email}, {"email": calendar_id}],
+            }
+            ev = await self.calendar.insert_event(calendar_id, event)
+            self._busy[calendar_id].add(slot, slot_end)
+            return {**ev, "calendarId": calendar_id}
+
+
+def _rfc3339(ts: datetime) -> str:
+    return ts.astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def _parse_ts(value: str) -> datetime:
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
@@ -44,7 +44,7 @@ class PatientOut(BaseModel):
     name: str
     age: Optional[str]
     email: str
-    created_at: datetime
+    created_at: Optional[datetime] = None
     class Config:
         orm_mode = True
 
@@ -56,7 +56,18 @@ class ConsultOut(BaseModel):
     follow_up_answers: Dict[str, Any]
     urgency: str
     status: str
-    created_at: datetime
+    created_at: Optional[datetime] = None
+    class Config:
+        orm_mode = True
+
+
+class ConsultListOut(BaseModel):
+    id: int
+    patient_id: int
+    symptoms: Optional[List[str]] = []
+    urgency: str
+    status: str
+    created_at: Optional[datetime] = None
     class Config:
         orm_mode = True
 
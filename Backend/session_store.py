@@ -0,0 +1,196 @@
+# session_store.py
+import os
+import json
+import time
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("sessions")
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory | redis
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+# Redis lock lease; renewed every third of it while a handler holds the lock
+SESSION_LOCK_TIMEOUT = float(os.getenv("SESSION_LOCK_TIMEOUT", "60"))
+
+
+def new_session() -> dict:
+    """
+    Everything the chat flow keeps per socket:
+      state         -> { stage, name, age, email }
+      consult       -> { id, name, age, email }
+      queue         -> list of pending follow-up questions
+      last_question -> last asked question
+      retry_count   -> vagueness retry attempts
+    Values must stay JSON-serialisable so shared backends can hold them.
+    """
+    return {"state": {}, "consult": None, "queue": [], "last_question": None, "retry_count": 0}
+
+
+class SessionStore:
+    """
+    Per-sid conversation state. Handlers use `async with store.session(sid)`
+    which locks the sid, loads the session, and writes it back on exit;
+    clearing the dict inside the block drops the session instead.
+    """
+
+    async def get(self, sid: str) -> dict | None:
+        raise NotImplementedError
+
+    async def set(self, sid: str, session: dict):
+        raise NotImplementedError
+
+    async def delete(self, sid: str):
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+    def lock(self, sid: str):
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def session(self, sid: str, create: bool = False):
+        async with self.lock(sid):
+            sess = await self.get(sid)
+            if sess is None:
+                sess = new_session() if create else {}
+            yield sess
+            if sess:
+                await self.set(sid, sess)
+            else:
+                await self.delete(sid)
+
+    async def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions are kept as JSON like the Redis backend, so a handler never
+    holds the stored dict itself: a handler that raises leaves the previous
+    state behind, and non-JSON values fail here too.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+        self._data: dict[str, tuple[float, str]] = {}
+        # locks vanish once no handler holds or waits on them
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+    def _expired(self, sid: str) -> bool:
+        item = self._data.get(sid)
+        if item and item[0] < time.monotonic():
+            self._data.pop(sid, None)
+            return True
+        return False
+
+    async def get(self, sid: str) -> dict | None:
+        if self._expired(sid):
+            return None
+        item = self._data.get(sid)
+        return json.loads(item[1]) if item else None
+
+    async def set(self, sid: str, session: dict):
+        self._data[sid] = (time.monotonic() + self.ttl, json.dumps(session))
+
+    async def delete(self, sid: str):
+        self._data.pop(sid, None)
+
+    async def count(self) -> int:
+        for sid in list(self._data):
+            self._expired(sid)
+        return len(self._data)
+
+    def lock(self, sid: str):
+        lock = self._locks.get(sid)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[sid] = lock
+        return lock
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Shared backend so several workers can serve the same sid. Works with any
+    redis.asyncio-compatible client (fakeredis works as a local stand-in).
+    """
+
+    def __init__(self, client=None, url: str = SESSION_REDIS_URL, ttl: int = SESSION_TTL, prefix: str = "consult-session:",
+                 lock_timeout: float = SESSION_LOCK_TIMEOUT):
+        if client is None:
+            import redis.asyncio as redis  # optional dependency
+            client = redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        # sid -> expiry time, so count() needn't SCAN the keyspace
+        self.index_key = f"{prefix.rstrip(':')}-index"
+
+    def _key(self, sid: str) -> str:
+        return f"{self.prefix}{sid}"
+
+    async def get(self, sid: str) -> dict | None:
+        raw = await self.redis.get(self._key(sid))
+        return json.loads(raw) if raw else None
+
+    async def set(self, sid: str, session: dict):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(sid), json.dumps(session), ex=self.ttl)
+            pipe.zadd(self.index_key, {sid: time.time() + self.ttl})
+            await pipe.execute()
+
+    async def delete(self, sid: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(sid))
+            pipe.zrem(self.index_key, sid)
+            await pipe.execute()
+
+    async def count(self) -> int:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self.index_key, "-inf", time.time())
+            pipe.zcard(self.index_key)
+            _, n = await pipe.execute()
+        return n
+
+    @asynccontextmanager
+    async def lock(self, sid: str):
+        """
+        Handlers hold the lock across LLM calls (retries and backoff included),
+        which can outlast any fixed lease, so the lease is renewed while held.
+        """
+        lock = self.redis.lock(f"{self.prefix.rstrip(':')}-lock:{sid}", timeout=self.lock_timeout,
+                               blocking_timeout=self.lock_timeout)
+        if not await lock.acquire():
+            raise TimeoutError(f"Timed out waiting for the session lock of {sid}")
+        keep_alive = asyncio.create_task(self._keep_alive(lock, sid))
+        try:
+            yield lock
+        finally:
+            keep_alive.cancel()
+            try:
+                await lock.release()
+            except Exception as e:
+                logger.warning("Session lock for %s was lost before release: %s", sid, e)
+
+    async def _keep_alive(self, lock, sid: str):
+        while True:
+            await asyncio.sleep(self.lock_timeout / 3)
+            try:
+                await lock.reacquire()
+            except Exception as e:
+                logger.error("Could not renew the session lock for %s: %s", sid, e)
+                return
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def build_session_store() -> SessionStore:
+    if SESSION_BACKEND == "redis":
+        logger.info("Using Redis session store at %s", SESSION_REDIS_URL)
+        return RedisSessionStore()
+    return MemorySessionStore()
@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules read their config at import; tests always run on a throwaway SQLite file and offline fakes
+_tmpdir = tempfile.mkdtemp(prefix="consult-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_tmpdir, 'test.db')}"
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["LLM_FAKE_LATENCY"] = "0"
+os.environ["NOTIFY_BACKEND"] = "off"
+os.environ["SESSION_BACKEND"] = "memory"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db_engine():
+    """Fresh schema on the shared test engine; disposed so no connection outlives the test's loop."""
+    from db import engine, Base
+    import models  # noqa: F401  (registers the tables)
+    from rules import invalidate_rule_index
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    invalidate_rule_index()
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Socket.IO emits captured as (event, data) instead of sent."""
+    import main
+
+    sent = []
+
+    async def emit(event, data=None, **kwargs):
+        sent.append((event, data))
+
+    monkeypatch.setattr(main.sio, "emit", emit)
+    return sent
+
+
+@pytest.fixture
+def start_followups(db_engine, emitted):
+    """
+    Factory: a consult for one symptom with the given follow-up questions,
+    its session at the first question, as if patient_symptoms just ran.
+    """
+    import main
+    from models import FollowUpRule, RuleVersion, SymptomRule
+    from repository import ConsultRepository
+
+    async def start(sid: str, questions: list[str], rules: list[tuple] = ()) -> int:
+        async with main.AsyncSessionLocal() as db:
+            db.add(RuleVersion(id=1, version=0))
+            db.add(SymptomRule(symptom_key="cough", follow_up_questions=questions))
+            for pattern, triggers, urgency in rules:
+                db.add(FollowUpRule(symptom_key="cough", question_pattern=pattern, trigger_values=triggers,
+                                    new_urgency=urgency))
+            repo = ConsultRepository(db)
+            patient_id = await repo.upsert_patient("Ann", "40", "ann@example.com")
+            consult = await repo.create_consult(patient_id, f"token-{sid}")
+            await repo.set_symptoms(consult.id, ["cough"], "normal")
+            await db.commit()
+            rule_index = await main.get_rule_index(db, refresh=True)
+
+        async with main.sessions.session(sid, create=True) as sess:
+            sess["consult"] = {"id": consult.id, "name": "Ann", "age": "40", "email": "ann@example.com"}
+            sess["state"] = {"stage": "followups"}
+            sess["queue"] = main.build_question_queue([rule_index.symptoms["cough"]])
+            await main.ask_next_question(sid, sess, "Ann")
+        return consult.id
+
+    return start
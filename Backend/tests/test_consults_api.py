@@ -0,0 +1,48 @@
+import httpx
+import pytest
+
+import main
+from repository import ConsultRepository
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(db_engine):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+
+
+async def add_consults(n: int) -> list[int]:
+    ids = []
+    async with main.AsyncSessionLocal() as db:
+        repo = ConsultRepository(db)
+        for i in range(n):
+            patient_id = await repo.upsert_patient(f"Patient {i}", "40", f"p{i}@example.com")
+            ids.append((await repo.create_consult(patient_id, f"token-{i}")).id)
+        await db.commit()
+    return ids
+
+
+async def test_get_consult_returns_created_at(client):
+    [consult_id] = await add_consults(1)
+    r = await client.get(f"/consults/{consult_id}")
+    assert r.status_code == 200
+    assert r.json()["created_at"] is not None
+
+
+@pytest.mark.parametrize("path", ["/patients", "/consults"])
+async def test_keyset_pages_round_trip(client, path):
+    # one transaction, so every row shares the same created_at and only the id breaks ties
+    ids = await add_consults(5)
+    seen, cursor = [], None
+    for _ in range(10):
+        r = await client.get(path, params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        seen.extend(row["id"] for row in r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 5
+    if path == "/consults":
+        assert seen == sorted(ids, reverse=True)
@@ -0,0 +1,81 @@
+import json
+
+import httpx
+import pytest
+
+import llm
+import llm_cache
+import main
+from llm_backends import FakeBackend, OpenAIBackend
+from models import FollowUpRule
+
+pytestmark = pytest.mark.anyio
+
+RULE = FollowUpRule(id=1, symptom_key="cough", question_pattern="fever", trigger_values=["39"], new_urgency="urgent")
+
+
+async def rephrase_stream():
+    return "".join([d async for d in llm.rephrase_followup_stream("Ann", "Any fever?")])
+
+
+# every prompt llm.py sends, with the kind it must be tagged as
+HELPERS = {
+    "extract_symptoms": lambda: llm.extract_symptoms("my chest feels tight", ["chest pain"]),
+    "rephrase": lambda: llm.rephrase_followup("Ann", "Any fever?"),
+    "explain": lambda: llm.explain_answer("Any fever?", "a bit", "cough"),
+    "vague": lambda: llm.is_vague_answer("Any fever?", "a bit"),
+    "evaluate": lambda: llm.evaluate_answer("Any fever?", "a bit", ["cough"], [RULE]),
+    "extract_field": lambda: llm.extract_field("name", "people call me Bob, I guess"),
+    "judge": lambda: main.judge_rule_match("Any fever?", "a bit", RULE),
+}
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(llm_cache, "cache", None)
+    backend = FakeBackend(latency="0", error_rate=0)
+    previous = llm.set_backend(backend)
+    yield backend
+    llm.set_backend(previous)
+
+
+def test_every_kind_is_covered():
+    assert sorted(HELPERS) == sorted(FakeBackend.KINDS)
+
+
+@pytest.mark.parametrize("kind", sorted(HELPERS))
+async def test_helper_tags_its_prompt_kind(fake, kind):
+    await HELPERS[kind]()
+    assert dict(fake.calls) == {kind: 1}
+
+
+async def test_streamed_rephrase_is_tagged(fake):
+    assert await rephrase_stream() == "Any fever?"
+    assert dict(fake.calls) == {"rephrase": 1}
+
+
+async def test_untagged_prompt_is_other(fake):
+    await llm.call_llm("hello", use_cache=False)
+    assert dict(fake.calls) == {"other": 1}
+
+
+async def test_openai_backend_does_not_send_metadata():
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        if bodies[-1].get("stream"):
+            chunk = {"choices": [{"delta": {"content": "hi"}}]}
+            return httpx.Response(200, text=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n")
+        return httpx.Response(200, json={"choices": [{"message": {"content": "hi"}}]})
+
+    backend = OpenAIBackend(api_key="test", url="http://upstream/v1/chat/completions")
+    backend._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    payload = {"model": "m", "messages": [], "metadata": {"kind": "judge"}}
+    try:
+        await backend.complete(payload)
+        assert [d async for d in backend.stream(payload)] == ["hi"]
+    finally:
+        await backend.close()
+    assert [sorted(b) for b in bodies] == [["messages", "model"], ["messages", "model", "stream", "stream_options"]]
+    assert payload["metadata"] == {"kind": "judge"}
@@ -0,0 +1,91 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from llm_cache import MemoryCache, SQLiteCache, make_key
+
+pytestmark = pytest.mark.anyio
+
+SCHEMA = {"type": "json_schema", "json_schema": {"name": "answer_evaluation", "schema": {"type": "object"}}}
+
+
+def test_key_ignores_param_order():
+    assert make_key("m", "sys", "hi", max_tokens=10, temperature=0.0) == \
+        make_key("m", "sys", "hi", temperature=0.0, max_tokens=10)
+
+
+def test_key_covers_every_input():
+    base = make_key("m", "sys", "hi", max_tokens=10, temperature=0.0)
+    assert len({
+        base,
+        make_key("m2", "sys", "hi", max_tokens=10, temperature=0.0),
+        make_key("m", "sys2", "hi", max_tokens=10, temperature=0.0),
+        make_key("m", "sys", "hi2", max_tokens=10, temperature=0.0),
+        make_key("m", "sys", "hi", max_tokens=11, temperature=0.0),
+        make_key("m", "sys", "hi", max_tokens=10, temperature=0.0, response_format=SCHEMA),
+    }) == 6
+
+
+def test_key_is_stable_for_response_format():
+    reordered = {"json_schema": {"schema": {"type": "object"}, "name": "answer_evaluation"}, "type": "json_schema"}
+    assert make_key("m", "sys", "hi", response_format=SCHEMA) == make_key("m", "sys", "hi", response_format=reordered)
+
+
+async def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_size=2)
+    await cache.set("a", "1")
+    await cache.set("b", "2")
+    assert await cache.get("a") == "1"  # b is now the oldest
+    await cache.set("c", "3")
+    assert len(cache) == 2
+    assert await cache.get("b") is None
+    assert (await cache.get("a"), await cache.get("c")) == ("1", "3")
+
+
+async def test_memory_cache_expires_entries():
+    cache = MemoryCache(ttl=60)
+    await cache.set("short", "1", ttl=0.01)
+    await cache.set("long", "2")
+    await asyncio.sleep(0.02)
+    assert await cache.get("short") is None
+    assert await cache.get("long") == "2"
+    assert len(cache) == 1
+
+
+def row_count(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+async def test_sqlite_cache_trims_every_n_writes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, max_size=3, trim_every=4)
+    for i in range(3):
+        await cache.set(f"k{i}", str(i))
+    assert await cache.get("k0") == "0"  # k1 is now the least recently used
+
+    await cache.set("k3", "3")  # fourth write trims back to max_size
+    assert row_count(path) == 3
+    assert await cache.get("k1") is None
+    assert [await cache.get(k) for k in ("k0", "k2", "k3")] == ["0", "2", "3"]
+
+    for i in range(4, 7):
+        await cache.set(f"k{i}", str(i))
+    assert row_count(path) == 6  # no trim until the next multiple
+    await cache.set("k7", "7")
+    assert row_count(path) == 3
+
+
+async def test_sqlite_cache_expires_entries(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, ttl=60, trim_every=3)
+    await cache.set("short", "1", ttl=0.01)
+    await asyncio.sleep(0.02)
+    assert await cache.get("short") is None
+
+    await cache.set("stale", "2", ttl=0.01)
+    await asyncio.sleep(0.02)
+    await cache.set("long", "3")  # third write: the trim also drops expired rows
+    assert row_count(path) == 1
+    assert await cache.get("long") == "3"
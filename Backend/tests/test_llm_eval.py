@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+import llm
+import llm_cache
+import main
+from llm_backends import FakeBackend
+from models import Consult, ConsultAnswer, FollowUpRule
+
+pytestmark = pytest.mark.anyio
+
+QUESTIONS = ["When did it start?", "Do you have a fever?"]
+FEVER_RULE = ("fever", ["39"], "urgent")
+EVALUATION = {"vague": False, "clarify": None, "notes": [{"symptom": "cough", "note": "Batched note."}],
+              "rule_matches": [{"rule_id": 1, "match": True}]}
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    """Factory: install a scripted FakeBackend with the response cache off."""
+    monkeypatch.setattr(llm_cache, "cache", None)
+    previous = []
+
+    def install(**script):
+        backend = FakeBackend(latency="0", error_rate=0, script=script)
+        previous.append(llm.set_backend(backend))
+        return backend
+
+    yield install
+    if previous:
+        llm.set_backend(previous[0])
+
+
+@pytest.mark.parametrize("raw", [
+    '{"vague": true}',
+    '```json\n{"vague": true}\n```',
+    '```\n{"vague": true}\n```',
+    'Sure! Here is the JSON: {"vague": true} Let me know if you need more.',
+])
+def test_parse_json_object_recovers_the_object(raw):
+    assert llm.parse_json_object(raw) == {"vague": True}
+
+
+@pytest.mark.parametrize("raw", ["", "no json here", "[1, 2]", '{"vague": tru'])
+def test_parse_json_object_gives_up(raw):
+    assert llm.parse_json_object(raw) is None
+
+
+async def test_evaluate_answer_keeps_only_known_symptoms_and_rules(fake):
+    fake(evaluate="```json\n" + json.dumps({
+        "vague": False, "clarify": "",
+        "notes": [{"symptom": "cough", "note": " Dry cough. "}, {"symptom": "rash", "note": "?"}],
+        "rule_matches": [{"rule_id": 1, "match": True}, {"rule_id": 9, "match": True}, {"rule_id": 2}],
+    }) + "\n```")
+    rules = [FollowUpRule(id=1, symptom_key="cough"), FollowUpRule(id=2, symptom_key="cough")]
+    result = await llm.evaluate_answer("Q?", "A", ["cough"], rules)
+    assert result == {"vague": False, "clarify": None, "notes": {"cough": "Dry cough."}, "rule_matches": {1: True}}
+
+
+@pytest.mark.parametrize("reply", ["not json at all", '{"notes": []}', '{"vague": "no"}'])
+async def test_evaluate_answer_returns_none_on_bad_output(fake, reply):
+    fake(evaluate=reply)
+    assert await llm.evaluate_answer("Q?", "A", ["cough"]) is None
+
+
+async def test_evaluate_answer_returns_none_when_the_call_fails(fake):
+    backend = fake()
+    backend.error_rate = 1
+    assert await llm.evaluate_answer("Q?", "A", ["cough"]) is None
+
+
+async def answer_fever(start_followups, sid, answer="I feel very hot"):
+    consult_id = await start_followups(sid, QUESTIONS, rules=[FEVER_RULE])
+    await main.answer_question(sid, {"symptoms": ["cough"], "questionText": QUESTIONS[1], "answerText": answer})
+    async with main.AsyncSessionLocal() as db:
+        consult = await db.get(Consult, consult_id)
+        note = (await db.execute(select(ConsultAnswer.doctor_note)
+                                 .where(ConsultAnswer.consult_id == consult_id))).scalar_one()
+    return consult.urgency, note
+
+
+async def test_batched_evaluation_replaces_the_individual_calls(fake, start_followups):
+    backend = fake(evaluate=EVALUATION)
+    assert await answer_fever(start_followups, "sid-eval") == ("urgent", "Batched note.")
+    assert backend.calls["evaluate"] == 1
+    assert backend.calls["vague"] == backend.calls["explain"] == backend.calls["judge"] == 0
+
+
+async def test_missing_notes_fall_back_to_explain_answer(fake, start_followups):
+    backend = fake(evaluate=dict(EVALUATION, notes=[]), explain="Explained note.")
+    assert await answer_fever(start_followups, "sid-notes") == ("urgent", "Explained note.")
+    assert backend.calls["explain"] == 1
+    assert backend.calls["vague"] == backend.calls["judge"] == 0
+
+
+async def test_missing_verdicts_fall_back_to_judge_rule_match(fake, start_followups):
+    backend = fake(evaluate=dict(EVALUATION, rule_matches=[]), judge={"match": True})
+    assert await answer_fever(start_followups, "sid-verdicts") == ("urgent", "Batched note.")
+    assert backend.calls["judge"] == 1
+    assert backend.calls["vague"] == backend.calls["explain"] == 0
+
+
+async def test_unparseable_evaluation_falls_back_to_every_call(fake, start_followups):
+    backend = fake(evaluate="Sorry, I can't help with that.", vague={"vague": False},
+                   explain="Explained note.", judge={"match": True})
+    assert await answer_fever(start_followups, "sid-parse") == ("urgent", "Explained note.")
+    assert backend.calls["evaluate"] == 1
+    assert backend.calls["vague"] == backend.calls["explain"] == backend.calls["judge"] == 1
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import llm
+import llm_limits
+from llm_backends import LLMBackend
+from llm_limits import CircuitBreaker, LLMUnavailable, TokenBucket
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_timeout_bounds_wait_behind_a_sleeping_caller():
+    bucket = TokenBucket(60, capacity=1)  # one unit per second
+    await bucket.acquire(1)
+    patient = asyncio.create_task(bucket.acquire(1))
+    await asyncio.sleep(0.01)
+
+    start = time.monotonic()
+    with pytest.raises(LLMUnavailable):
+        await bucket.acquire(1, timeout=0.2)
+    assert time.monotonic() - start < 0.2
+
+    patient.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await patient
+    # neither the timed-out nor the cancelled caller kept its units
+    bucket._refill()
+    assert bucket.tokens > 0
+
+
+async def test_waiters_are_served_in_arrival_order():
+    bucket = TokenBucket(600, capacity=1)  # one unit per 0.1s
+    await bucket.acquire(1)
+    served = []
+
+    async def take(i):
+        await bucket.acquire(1, timeout=1)
+        served.append(i)
+
+    start = time.monotonic()
+    await asyncio.gather(*(take(i) for i in range(3)))
+    assert served == [0, 1, 2]
+    # reservations queue: the third waiter waits for three refills, not one
+    assert time.monotonic() - start >= 0.25
+
+
+class FlakyBackend(LLMBackend):
+    """Answers 503 for the first `fail_times` calls."""
+
+    def __init__(self, fail_times):
+        self.fail_times = fail_times
+        self.calls = 0
+
+    async def complete(self, payload, timeout=None):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            req = httpx.Request("POST", "http://upstream/v1/chat/completions")
+            raise httpx.HTTPStatusError("upstream 503", request=req, response=httpx.Response(503, request=req))
+        return {"choices": [{"message": {"content": "ok"}}], "usage": {}}
+
+
+@pytest.fixture
+def gated(monkeypatch):
+    """Fresh buckets and breaker with acquisitions counted; retries without delay."""
+    acquired = {"requests": 0, "tokens": 0}
+    for name in ("requests", "tokens"):
+        bucket = TokenBucket(1000)
+
+        async def acquire(n=1, timeout=None, name=name, real=bucket.acquire):
+            acquired[name] += 1
+            await real(n, timeout)
+
+        bucket.acquire = acquire
+        monkeypatch.setattr(llm_limits, f"{name}_bucket", bucket)
+    monkeypatch.setattr(llm_limits, "breaker", CircuitBreaker(threshold=5, cooldown=60))
+    monkeypatch.setattr(llm_limits, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_limits, "retry_delay", lambda e, attempt: 0)
+    return acquired
+
+
+async def test_every_retry_is_admitted(gated):
+    backend = FlakyBackend(fail_times=2)
+    previous = llm.set_backend(backend)
+    try:
+        assert await llm.call_llm("hi", use_cache=False) == "ok"
+    finally:
+        llm.set_backend(previous)
+    assert backend.calls == 3
+    assert gated == {"requests": 3, "tokens": 3}
+    assert (llm_limits.breaker.state, llm_limits.breaker.failures) == ("closed", 0)
+
+
+async def test_breaker_counts_each_failed_attempt(gated):
+    llm_limits.breaker.threshold = 2
+    backend = FlakyBackend(fail_times=10)
+    previous = llm.set_backend(backend)
+    try:
+        with pytest.raises(LLMUnavailable):
+            await llm.call_llm("hi", use_cache=False)
+    finally:
+        llm.set_backend(previous)
+    # two failures open the circuit, so the third attempt never reaches upstream
+    assert backend.calls == 2
+    assert gated == {"requests": 2, "tokens": 2}
+    assert llm_limits.breaker.state == "open"
+
+
+async def test_rejected_call_returns_its_request_unit(monkeypatch):
+    monkeypatch.setattr(llm_limits, "requests_bucket", TokenBucket(60, capacity=5))
+    monkeypatch.setattr(llm_limits, "tokens_bucket", TokenBucket(60, capacity=10))
+    monkeypatch.setattr(llm_limits, "breaker", CircuitBreaker())
+    monkeypatch.setattr(llm_limits, "LLM_QUEUE_TIMEOUT", 0.05)
+    llm_limits.tokens_bucket.tokens = 0
+
+    with pytest.raises(LLMUnavailable):
+        async with llm_limits.admit(10):
+            pass
+    assert llm_limits.requests_bucket.tokens == pytest.approx(5)
@@ -0,0 +1,70 @@
+import random
+import string
+from difflib import get_close_matches
+
+import pytest
+
+from matcher import SymptomMatcher
+
+SYMPTOMS = [
+    "Chest Pain", "chest pain", "Chest Tightness", "Shortness of Breath", "Palpitations", "Dizziness", "Fainting",
+    "Swelling", "Leg Swelling", "Ankle Swelling", "Fatigue", "Cough", "Fever", "Nausea", "Sweating", "Headache",
+    "Back Pain", "Arm Pain", "Jaw Pain", "Neck Pain", "Flu", "Ache", "Abcx", "Abcy", "Chest Pains", "Chest Paint",
+    "Rash Arma", "Rash Arms",
+]
+TERMS = [
+    "chest pain", "CHEST PAIN ", "chest pian", "chest", "shortnes of breath", "palpitation", "dizzy", "faint",
+    "swollen legs", "leg sweling", "tired", "coughing", "fevr", "nausia", "sweats", "head ache", "back pains",
+    # short terms (<= 4 chars): scored over the whole length window
+    "flu", "fl", "ache", "ach", "cgh", "sob", "jaw", "arm", "pain", "",
+    # ties: equal ratios, the larger string wins as in get_close_matches
+    "abc", "rash arm", "chest painz",
+]
+
+
+def difflib_match(term: str, known: list[str]) -> str | None:
+    """The scan SymptomMatcher replaced (main.py before it): exact, else get_close_matches(n=1, cutoff=0.6)."""
+    t = term.strip().lower()
+    for k in known:
+        if t == k.lower():
+            return k
+    close = get_close_matches(t, [k.lower() for k in known], n=1, cutoff=0.6)
+    return next((k for k in known if close and k.lower() == close[0]), None)
+
+
+def generated(n: int, seed: int) -> tuple[list[str], list[str]]:
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(max(40, n // 4))]
+    known = sorted({" ".join(rng.sample(words, rng.randint(1, 3))) for _ in range(n)})
+    terms = []
+    for _ in range(100):
+        k = rng.choice(known)
+        i = rng.randrange(len(k))
+        terms += [k[:i] + rng.choice(string.ascii_lowercase) + k[i + 1:], k[:i] + k[i + 1:], k[:4], k[:3]]
+    return known, terms
+
+
+@pytest.mark.parametrize("term", TERMS)
+def test_matches_difflib_on_fixed_corpus(term):
+    assert SymptomMatcher(SYMPTOMS).match(term) == difflib_match(term, SYMPTOMS)
+
+
+def test_ties_go_to_the_larger_string():
+    m = SymptomMatcher(SYMPTOMS)
+    assert m.match("abc") == "Abcy"
+    assert m.match("rash arm") == "Rash Arms"
+    assert m.match("CHEST PAIN") == "Chest Pain"  # exact hits keep the first spelling
+
+
+def test_matches_difflib_on_generated_corpus():
+    # small enough that every overlapping key fits in the FUZZY_CANDIDATES shortlist
+    known, terms = generated(200, seed=6)
+    m = SymptomMatcher(known)
+    assert [m.match(t) for t in terms] == [difflib_match(t, known) for t in terms]
+
+
+def test_unbounded_shortlist_matches_difflib_at_scale():
+    # the default shortlist may diverge here (see SymptomMatcher); scoring every overlapping key does not
+    known, terms = generated(2000, seed=6)
+    m = SymptomMatcher(known, candidates=len(known))
+    assert [m.match(t) for t in terms] == [difflib_match(t, known) for t in terms]
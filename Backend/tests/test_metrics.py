@@ -0,0 +1,22 @@
+import httpx
+import pytest
+
+import main
+from prefilter import prefill_field
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics_exposes_llm_and_db_series(db_engine):
+    prefill_field("age", "42")
+    prefill_field("age", "about forty, maybe fifty")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        await client.get("/patients")
+        r = await client.get("/metrics")
+    assert r.status_code == 200
+    body = r.text
+    assert 'consult_llm_prepass_total{kind="extract_field",path="local"}' in body
+    assert 'consult_llm_prepass_total{kind="extract_field",path="llm"}' in body
+    assert 'consult_db_query_seconds_count{verb="SELECT"}' in body
+    assert 'consult_llm_breaker_state{state="closed"} 1' in body
+    assert 'consult_llm_budget{bucket="requests"}' in body
@@ -0,0 +1,46 @@
+import httpx
+import pytest
+from sqlalchemy import func, select
+
+import main
+from migrations import backfill_consult_answers
+from models import Consult, ConsultAnswer, Patient
+
+pytestmark = pytest.mark.anyio
+
+LEGACY = {"cough": [{"question": "When did it start?", "answer": "Monday", "doctor_note": "Onset Monday."},
+                    {"question": "Any fever?", "answer": "No"}]}
+
+
+async def add_consult(email, follow_up_answers) -> int:
+    async with main.AsyncSessionLocal() as db:
+        patient = Patient(name="Ann", age="40", email=email)
+        db.add(patient)
+        await db.flush()
+        consult = Consult(patient_id=patient.id, symptoms=["cough"], follow_up_answers=follow_up_answers)
+        db.add(consult)
+        await db.commit()
+        return consult.id
+
+
+async def answer_rows() -> int:
+    async with main.AsyncSessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(ConsultAnswer))).scalar_one()
+
+
+async def test_startup_backfills_legacy_answers(db_engine):
+    legacy_id = await add_consult("ann@example.com", LEGACY)
+    await add_consult("bob@example.com", {})
+
+    await main.on_startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            r = await client.get(f"/consults/{legacy_id}")
+    finally:
+        await main.on_shutdown()
+    assert r.json()["follow_up_answers"] == LEGACY
+
+    # idempotent: a second run (another worker, the next restart) adds nothing
+    assert await answer_rows() == 2
+    assert await backfill_consult_answers() == 0
+    assert await answer_rows() == 2
@@ -0,0 +1,191 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, select, update
+
+import main
+import notify
+from models import Consult, NotificationOutbox, Patient
+from notify import FakeCalendar, FakeTelegram, NotificationWorker
+from scheduler import SlotScheduler
+
+pytestmark = pytest.mark.anyio
+
+QUESTIONS = ["When did it start?", "Do you have a fever?"]
+
+
+async def add_consult(status="completed", kinds=("telegram",)) -> int:
+    """A finished consult with pending outbox rows of the given kinds."""
+    async with main.AsyncSessionLocal() as db:
+        patient = Patient(name="Ann", age="40", email="ann@example.com")
+        db.add(patient)
+        await db.flush()
+        consult = Consult(patient_id=patient.id, symptoms=["cough"], urgency="normal", status=status)
+        db.add(consult)
+        await db.flush()
+        for kind in kinds:
+            db.add(NotificationOutbox(consult_id=consult.id, kind=kind, payload={}))
+        await db.commit()
+        return consult.id
+
+
+async def make_due():
+    """Skip the backoff: every pending row is due now."""
+    async with main.AsyncSessionLocal() as db:
+        await db.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.status == "pending")
+            .values(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        await db.commit()
+
+
+async def outbox_rows(consult_id):
+    async with main.AsyncSessionLocal() as db:
+        res = await db.execute(
+            select(NotificationOutbox).where(NotificationOutbox.consult_id == consult_id).order_by(NotificationOutbox.id)
+        )
+        return res.scalars().all()
+
+
+async def get_consult(consult_id):
+    async with main.AsyncSessionLocal() as db:
+        return await db.get(Consult, consult_id)
+
+
+def booking_worker(on_status_change=None) -> NotificationWorker:
+    worker = NotificationWorker(FakeTelegram(), FakeCalendar(), on_status_change)
+    worker.scheduler = SlotScheduler(worker.calendar, calendar_ids=["dr@example.com"])
+    return worker
+
+
+def test_backoff_is_bounded():
+    for attempts in range(1, 12):
+        limit = min(notify.NOTIFY_BACKOFF_MAX, notify.NOTIFY_BACKOFF_BASE * 2 ** (attempts - 1))
+        assert 0 <= notify._backoff(attempts) <= limit
+
+
+async def test_outbox_rows_commit_with_completion(db_engine, start_followups, emitted, monkeypatch):
+    monkeypatch.setattr(notify, "NOTIFY_BACKEND", "fake")
+    consult_id = await start_followups("sid-outbox", QUESTIONS)
+    for question in QUESTIONS[:-1]:
+        await main.answer_question("sid-outbox", {"symptoms": ["cough"], "questionText": question, "answerText": "No"})
+
+    log = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        log.append((statement.lstrip().split(None, 3)[:3], parameters))
+
+    def on_commit(conn):
+        log.append("COMMIT")
+
+    engine = db_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", on_execute)
+    event.listen(engine, "commit", on_commit)
+    try:
+        await main.answer_question("sid-outbox", {"symptoms": ["cough"], "questionText": QUESTIONS[-1],
+                                                  "answerText": "No"})
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+        event.remove(engine, "commit", on_commit)
+
+    completed = next(i for i, e in enumerate(log)
+                     if e != "COMMIT" and e[0][:2] == ["UPDATE", "consults"] and "completed" in str(e[1]))
+    inserts = [i for i, e in enumerate(log) if e != "COMMIT" and e[0][:3] == ["INSERT", "INTO", "notification_outbox"]]
+    assert inserts
+    first, last = min([completed] + inserts), max([completed] + inserts)
+    # the status flip and the outbox rows land in one transaction
+    assert "COMMIT" not in log[first:last]
+    assert "COMMIT" in log[last:]
+
+    assert (await get_consult(consult_id)).status == "completed"
+    rows = await outbox_rows(consult_id)
+    assert sorted(r.kind for r in rows) == ["calendar", "telegram"]
+    assert {r.status for r in rows} == {"pending"}
+
+
+async def test_failed_send_is_retried_with_backoff(db_engine, monkeypatch):
+    delays = []
+
+    def backoff(attempts):
+        delays.append(attempts)
+        return 60
+
+    monkeypatch.setattr(notify, "_backoff", backoff)
+    consult_id = await add_consult()
+    worker = NotificationWorker(FakeTelegram(fail_times=2), None)
+
+    assert await worker.process_due() == 1
+    row, = await outbox_rows(consult_id)
+    assert (row.status, row.attempts) == ("pending", 1)
+    assert "outage" in row.last_error
+    # not due again until the backoff has passed
+    assert await worker.process_due() == 0
+
+    await make_due()
+    assert await worker.process_due() == 1
+    await make_due()
+    assert await worker.process_due() == 1
+
+    row, = await outbox_rows(consult_id)
+    assert (row.status, row.attempts, row.last_error) == ("sent", 3, None)
+    assert delays == [1, 2]
+    assert len(worker.telegram.sent) == 1
+
+
+async def test_send_fails_at_max_attempts(db_engine, monkeypatch):
+    monkeypatch.setattr(notify, "NOTIFY_MAX_ATTEMPTS", 3)
+    consult_id = await add_consult()
+    worker = NotificationWorker(FakeTelegram(fail_times=10), None)
+
+    for _ in range(3):
+        assert await worker.process_due() == 1
+        await make_due()
+
+    row, = await outbox_rows(consult_id)
+    assert (row.status, row.attempts) == ("failed", 3)
+    assert "outage" in row.last_error
+    assert await worker.process_due() == 0
+    assert worker.telegram.sent == []
+
+
+async def test_calendar_is_not_booked_twice(db_engine):
+    published = []
+
+    async def on_status_change(row):
+        published.append((row.id, row.status))
+
+    consult_id = await add_consult(kinds=("calendar",))
+    worker = booking_worker(on_status_change)
+    assert await worker.process_due() == 1
+
+    consult = await get_consult(consult_id)
+    assert (consult.status, consult.calendar_event_id) == ("scheduled", "fake-1")
+    assert published == [(consult_id, "scheduled")]
+
+    # the worker died after booking but before marking the row sent: it is delivered again
+    async with main.AsyncSessionLocal() as db:
+        await db.execute(update(NotificationOutbox).values(status="pending"))
+        await db.commit()
+    await make_due()
+    assert await worker.process_due() == 1
+
+    assert len(worker.calendar.events) == 1
+    assert (await get_consult(consult_id)).calendar_event_id == "fake-1"
+    row, = await outbox_rows(consult_id)
+    assert row.status == "sent"
+
+
+async def test_booking_leaves_claimed_consult_claimed(db_engine):
+    published = []
+
+    async def on_status_change(row):
+        published.append((row.id, row.status))
+
+    consult_id = await add_consult(status="claimed", kinds=("calendar",))
+    worker = booking_worker(on_status_change)
+    assert await worker.process_due() == 1
+
+    consult = await get_consult(consult_id)
+    assert (consult.status, consult.calendar_event_id) == ("claimed", "fake-1")
+    assert published == [(consult_id, "claimed")]
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+from prefetch import RephrasePrefetcher
+
+pytestmark = pytest.mark.anyio
+
+QUESTIONS = ["When did it start?", "Do you have a fever?", "Any blood?"]
+
+
+def asked(emitted):
+    return [d["question"] for e, d in emitted if e == "ask_question"]
+
+
+async def test_slow_prefetch_falls_back_within_the_wait(start_followups, emitted, monkeypatch):
+    async def stuck(patient_name, text):
+        await asyncio.sleep(30)
+
+    monkeypatch.setattr(main, "prefetcher", RephrasePrefetcher(stuck))
+    monkeypatch.setattr(main, "LLM_PREFETCH_WAIT", 0.05)
+    await start_followups("sid-slow", QUESTIONS)
+
+    start = time.monotonic()
+    await main.answer_question("sid-slow", {"symptoms": ["cough"], "questionText": QUESTIONS[0], "answerText": "Monday"})
+    assert time.monotonic() - start < 5
+    # the fake backend echoes the question it was asked to rephrase
+    assert asked(emitted)[-1] == f"For your cough, {QUESTIONS[1]}"
+    main.prefetcher.cancel("sid-slow")
+
+
+async def test_prefetched_and_direct_phrasing_use_the_same_inputs(start_followups, emitted, monkeypatch):
+    calls = []
+
+    async def rephrase_followup(patient_name, text, prev_user_text=None):
+        calls.append((patient_name, text, prev_user_text))
+        return text
+
+    monkeypatch.setattr(main, "rephrase_followup", rephrase_followup)
+    monkeypatch.setattr(main, "prefetcher", None)
+    await start_followups("sid-direct", QUESTIONS)
+    for question in QUESTIONS[:-1]:
+        await main.answer_question("sid-direct", {"symptoms": ["cough"], "questionText": question, "answerText": "No"})
+
+    # the prefetcher calls rephrase(patient_name, text): no previous answer on either path
+    asked_calls = [c for c in calls if c[1].startswith("For your")]
+    assert len(asked_calls) == len(QUESTIONS)
+    assert {c[2] for c in asked_calls} == {None}
@@ -0,0 +1,63 @@
+import pytest
+
+from prefilter import prefill_field, prefill_symptoms
+
+KNOWN = ["chest pain", "shortness of breath", "cough"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("My name is Ann Lee", "Ann Lee"),
+    ("hi, my name is ann", "Ann"),
+    ("name: Mary-Jane O'Neil.", "Mary-Jane O'Neil"),
+    # no explicit introduction: the LLM decides
+    ("Ann", None),
+    ("call me Al", None),
+    ("It's Bob", None),
+    ("chest pain", None),
+    ("my name is chest pain", None),
+    ("my name is not telling", None),
+    ("my name is Ann and I have a cough", None),
+    ("my name is R2D2", None),
+])
+def test_name(text, expected):
+    assert prefill_field("name", text, KNOWN) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("42", "42"),
+    ("I'm 42 years old", "42"),
+    ("forty two", "42"),
+    ("forty-two", "42"),
+    ("I am forty two years old", "42"),
+    ("one hundred and two", "102"),
+    ("nineteen", "19"),
+    ("forty and two", None),
+    ("two forty", None),
+    ("forty two and three", None),
+    ("42 and 43", None),
+    ("about forty, maybe fifty", None),
+    ("200", None),
+    ("old enough", None),
+])
+def test_age(text, expected):
+    assert prefill_field("age", text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ann@example.com", "ann@example.com"),
+    ("it's ann@example.com thanks", "ann@example.com"),
+    ("ann@example.com or ann@work.org", None),
+])
+def test_email(text, expected):
+    assert prefill_field("email", text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I have chest pain and a cough", ["chest pain", "cough"]),
+    ("Chest pain", ["chest pain"]),
+    ("no chest pain", None),
+    ("chest pain for three days", None),
+    ("coughing", None),
+])
+def test_symptoms(text, expected):
+    assert prefill_symptoms(text, KNOWN) == expected
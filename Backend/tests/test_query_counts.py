@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import event
+
+import main
+from repository import ConsultRepository
+
+pytestmark = pytest.mark.anyio
+
+QUESTIONS = ["When did it start?", "Have you coughed up blood?", "Do you have a fever?"]
+
+# one consult read, the answer rows, the rule hits, one consult UPDATE
+MAX_STATEMENTS_PER_ANSWER = 4
+# ... plus the summary: answers, rule hits, stored text
+MAX_STATEMENTS_LAST_ANSWER = 7
+
+
+@pytest.fixture
+def statements(db_engine):
+    seen = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(db_engine.sync_engine, "before_cursor_execute", count)
+    yield seen
+    event.remove(db_engine.sync_engine, "before_cursor_execute", count)
+
+
+async def test_statements_per_answered_question(start_followups, statements, emitted):
+    consult_id = await start_followups("sid-queries", QUESTIONS, rules=[("blood", ["yes"], "urgent")])
+    answers = ["Since Monday", "Yes, a little", "No"]
+
+    for i, (question, answer) in enumerate(zip(QUESTIONS, answers)):
+        statements.clear()
+        await main.answer_question("sid-queries", {"symptoms": ["cough"], "questionText": question, "answerText": answer})
+        last = i == len(QUESTIONS) - 1
+        bound = MAX_STATEMENTS_LAST_ANSWER if last else MAX_STATEMENTS_PER_ANSWER
+        assert len(statements) <= bound, f"answer {i + 1}: {len(statements)} statements\n" + "\n".join(statements)
+        # the consult row is read once per turn, never re-fetched
+        assert sum(s.lstrip().upper().startswith("SELECT CONSULTS.") for s in statements) == 1
+
+    assert not [d for e, d in emitted if e == "bot_message" and str(d.get("msg", "")).startswith(("❌", "⚠️"))]
+    async with main.AsyncSessionLocal() as db:
+        consult = await ConsultRepository(db).get_consult(consult_id)
+        assert consult.status == "completed"
+        assert consult.urgency == "urgent"
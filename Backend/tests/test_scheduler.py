@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from notify import FakeCalendar
+from scheduler import BusyIndex, SlotScheduler
+
+pytestmark = pytest.mark.anyio
+
+T0 = datetime(2026, 1, 5, 9, 0, tzinfo=timezone.utc)
+
+
+def at(minutes: int) -> datetime:
+    return T0 + timedelta(minutes=minutes)
+
+
+def intervals(idx: BusyIndex):
+    return [((s - T0).total_seconds() / 60, (e - T0).total_seconds() / 60) for s, e in zip(idx.starts, idx.ends)]
+
+
+def test_add_merges_overlapping_and_touching_intervals():
+    idx = BusyIndex()
+    idx.add(at(60), at(90))
+    idx.add(at(0), at(15))
+    idx.add(at(30), at(45))
+    assert intervals(idx) == [(0, 15), (30, 45), (60, 90)]
+
+    idx.add(at(15), at(30))  # touches both neighbours
+    assert intervals(idx) == [(0, 45), (60, 90)]
+    idx.add(at(70), at(80))  # contained
+    idx.add(at(50), at(50))  # empty
+    assert intervals(idx) == [(0, 45), (60, 90)]
+    idx.add(at(40), at(120))  # swallows the rest
+    assert intervals(idx) == [(0, 120)]
+
+
+def test_prune_and_busy_minutes():
+    idx = BusyIndex()
+    idx.add(at(0), at(30))
+    idx.add(at(60), at(90))
+    assert idx.busy_minutes(at(15), at(75)) == 30
+    idx.prune(at(30))
+    assert intervals(idx) == [(60, 90)]
+
+
+@pytest.mark.parametrize("after, expected", [
+    (0, 0),      # free right away
+    (15, 15),    # slot ends exactly where the busy block starts
+    (30, 60),    # inside the block: next grid slot at its end
+    (45, 60),
+    (60, 60),    # starts exactly where the block ends
+])
+def test_first_free_around_a_busy_block(after, expected):
+    idx = BusyIndex()
+    idx.add(at(30), at(60))
+    assert idx.first_free(at(after), at(240), 15, origin=at(0)) == at(expected)
+
+
+def test_first_free_when_busy_spans_the_window_start():
+    idx = BusyIndex()
+    idx.add(at(-30), at(40))
+    # rounded up onto the origin's 15-minute grid past the block's end
+    assert idx.first_free(at(0), at(240), 15, origin=at(0)) == at(45)
+
+
+def test_first_free_respects_the_window_end():
+    idx = BusyIndex()
+    idx.add(at(0), at(50))
+    # the next grid slot after the block is 60-75
+    assert idx.first_free(at(0), at(74), 15, origin=at(0)) is None
+    assert idx.first_free(at(0), at(75), 15, origin=at(0)) == at(60)
+
+
+class RecordingCalendar(FakeCalendar):
+    def __init__(self, busy=None):
+        super().__init__(busy)
+        self.windows = []
+
+    async def freebusy(self, calendar_id, time_min, time_max):
+        self.windows.append((calendar_id, time_min, time_max))
+        return await super().freebusy(calendar_id, time_min, time_max)
+
+
+async def test_busy_cache_fetches_only_the_uncovered_tail():
+    cal = RecordingCalendar({"dr-a": [(at(30), at(60)), (at(300), at(330))]})
+    scheduler = SlotScheduler(cal, ["dr-a"], ttl=300)
+
+    idx = await scheduler.busy_index("dr-a", at(0), at(120))
+    assert cal.windows == [("dr-a", at(0), at(120))]
+    assert await scheduler.busy_index("dr-a", at(10), at(120)) is idx
+    assert len(cal.windows) == 1  # inside the TTL and the covered window
+
+    await scheduler.busy_index("dr-a", at(0), at(360))
+    assert cal.windows[1:] == [("dr-a", at(120), at(360))]
+    assert intervals(idx) == [(30, 60), (300, 330)]
+
+
+async def test_busy_cache_refetches_after_the_ttl():
+    cal = RecordingCalendar()
+    scheduler = SlotScheduler(cal, ["dr-a"], ttl=0)
+    await scheduler.busy_index("dr-a", at(0), at(120))
+    await scheduler.busy_index("dr-a", at(0), at(120))
+    assert cal.windows == [("dr-a", at(0), at(120))] * 2
+
+
+async def test_pick_prefers_the_least_loaded_doctor():
+    cal = FakeCalendar({"dr-a": [(at(15), at(75))], "dr-b": [(at(0), at(30))]})
+    scheduler = SlotScheduler(cal, ["dr-a", "dr-b"])
+    # dr-a is free first, but dr-b has less booked time in the window
+    assert await scheduler.pick(at(0), at(240)) == ("dr-b", at(30))
+
+
+async def test_pick_breaks_load_ties_by_earliest_slot():
+    cal = FakeCalendar({"dr-a": [(at(0), at(30))], "dr-b": [(at(30), at(60))]})
+    scheduler = SlotScheduler(cal, ["dr-a", "dr-b"])
+    assert await scheduler.pick(at(0), at(240)) == ("dr-b", at(0))
+
+
+async def test_pick_skips_fully_booked_doctors():
+    cal = FakeCalendar({"dr-a": [(at(0), at(240))], "dr-b": [(at(0), at(230))]})
+    scheduler = SlotScheduler(cal, ["dr-a", "dr-b"])
+    assert await scheduler.pick(at(0), at(240)) == (None, None)
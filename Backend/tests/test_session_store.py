@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from session_store import MemorySessionStore, RedisSessionStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # redis-py locks run Lua scripts
+    return RedisSessionStore(client=fakeredis.FakeAsyncRedis(decode_responses=True), lock_timeout=0.3)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "redis":
+        return request.getfixturevalue("redis_store")
+    return MemorySessionStore()
+
+
+async def test_handler_error_keeps_the_previous_state(store):
+    async with store.session("sid", create=True) as sess:
+        sess["state"] = {"stage": "ask_age", "name": "Ann"}
+
+    with pytest.raises(RuntimeError):
+        async with store.session("sid") as sess:
+            sess["state"]["stage"] = "ask_email"
+            sess["queue"].append({"text": "half-built"})
+            raise RuntimeError("handler failed")
+
+    sess = await store.get("sid")
+    assert sess["state"] == {"stage": "ask_age", "name": "Ann"}
+    assert sess["queue"] == []
+
+
+async def test_get_returns_a_copy(store):
+    async with store.session("sid", create=True) as sess:
+        sess["state"] = {"stage": "ask_age"}
+    (await store.get("sid"))["state"]["stage"] = "changed"
+    assert (await store.get("sid"))["state"] == {"stage": "ask_age"}
+
+
+async def test_memory_round_trip():
+    store = MemorySessionStore()
+    async with store.session("sid", create=True) as sess:
+        sess["retry_count"] = 2
+    async with store.session("sid") as sess:
+        assert sess["retry_count"] == 2
+        sess.clear()
+    assert await store.get("sid") is None
+
+
+async def test_redis_round_trip_and_delete(redis_store):
+    async with redis_store.session("sid", create=True) as sess:
+        sess["state"] = {"stage": "ask_age", "name": "Ann"}
+    assert (await redis_store.get("sid"))["state"] == {"stage": "ask_age", "name": "Ann"}
+    assert await redis_store.count() == 1
+
+    async with redis_store.session("sid") as sess:
+        sess.clear()
+    assert await redis_store.get("sid") is None
+    assert await redis_store.count() == 0
+
+
+async def test_redis_lock_outlives_its_lease_while_held(redis_store):
+    key = f"{redis_store.prefix.rstrip(':')}-lock:sid"
+    async with redis_store.lock("sid") as lock:
+        await asyncio.sleep(1.0)  # > 3x the 0.3s lease
+        # another worker must still be kept out
+        rival = redis_store.redis.lock(key, timeout=0.3)
+        assert not await rival.acquire(blocking=False)
+        assert await lock.owned()
+    assert not await lock.locked()
+
+
+async def test_redis_lock_serialises_handlers(redis_store):
+    order = []
+
+    async def handler(name, hold):
+        async with redis_store.session("sid", create=True) as sess:
+            order.append(f"{name}:start")
+            await asyncio.sleep(hold)
+            sess.setdefault("seen", []).append(name)
+            order.append(f"{name}:end")
+
+    first = asyncio.create_task(handler("slow", 0.1))
+    await asyncio.sleep(0.02)
+    await handler("fast", 0)
+    await first
+
+    assert order == ["slow:start", "slow:end", "fast:start", "fast:end"]
+    assert (await redis_store.get("sid"))["seen"] == ["slow", "fast"]
+
+
+async def test_redis_count_does_not_scan(redis_store, monkeypatch):
+    def scan_iter(*args, **kwargs):
+        raise AssertionError("count() must not SCAN the keyspace")
+
+    monkeypatch.setattr(redis_store.redis, "scan_iter", scan_iter)
+    redis_store.ttl = 1
+    for sid in ("a", "b"):
+        async with redis_store.session(sid, create=True):
+            pass
+    assert await redis_store.count() == 2
+    await redis_store.delete("a")
+    assert await redis_store.count() == 1
+    await asyncio.sleep(1.1)  # "b" expires without a delete
+    assert await redis_store.count() == 0
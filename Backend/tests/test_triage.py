@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import main
+from repository import ConsultRepository
+from triage import TriageQueue
+
+pytestmark = pytest.mark.anyio
+
+QUESTIONS = ["When did it start?", "Do you have a fever?"]
+
+
+def test_queue_orders_by_urgency_then_age():
+    q = TriageQueue()
+    now = datetime.now(timezone.utc)
+    q.upsert(1, "normal", "in_progress", now - timedelta(minutes=5), 10)
+    q.upsert(2, "urgent", "in_progress", now, 20)
+    q.upsert(3, "normal", "completed", now - timedelta(minutes=9), 30)
+    assert [i["id"] for i in q.snapshot()] == [2, 3, 1]
+    assert q.upsert(2, "urgent", "claimed", now, 20) is None
+    assert [i["id"] for i in q.snapshot()] == [3, 1]
+
+
+async def test_claimed_consult_stays_claimed(start_followups, emitted):
+    consult_id = await start_followups("sid-claim", QUESTIONS)
+    async with main.AsyncSessionLocal() as db:
+        await main.triage.rebuild(db)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        r = await client.post("/triage/claim")
+        assert r.status_code == 200 and r.json()["id"] == consult_id
+
+        # the patient keeps answering, including the last answer that completes the consult
+        for question in QUESTIONS:
+            await main.answer_question("sid-claim", {"symptoms": ["cough"], "questionText": question, "answerText": "No"})
+
+        async with main.AsyncSessionLocal() as db:
+            consult = await ConsultRepository(db).get_consult(consult_id)
+        assert consult.status == "claimed"
+        assert consult_id not in {i["id"] for i in main.triage.snapshot()}
+        assert (await client.post("/triage/claim")).status_code == 404
@@ -0,0 +1,65 @@
+import pytest
+
+import main
+from models import FollowUpRule, SymptomRule
+from rules import RuleIndex
+
+pytestmark = pytest.mark.anyio
+
+FEVER = "Do you have a fever?"
+BLOOD = "Have you coughed up blood?"
+
+
+def rule_index():
+    return RuleIndex(1, [SymptomRule(id=1, symptom_key="cough", urgency="normal", follow_up_questions=[])], [
+        FollowUpRule(id=1, symptom_key="cough", question_pattern="blood", trigger_values=["yes"], new_urgency="urgent"),
+        FollowUpRule(id=2, symptom_key="cough", question_pattern="fever", trigger_values=["39"],
+                     new_urgency="semi-urgent"),
+    ])
+
+
+@pytest.fixture
+def judge(monkeypatch):
+    """judge_rule_match stand-in: matches any answer mentioning "hot"; records what it was asked."""
+    asked = []
+
+    async def judge_rule_match(question, answer, rule):
+        asked.append((answer, rule.id))
+        return "hot" in answer
+
+    monkeypatch.setattr(main, "judge_rule_match", judge_rule_match)
+    return asked
+
+
+def hit_keys(hits):
+    return sorted((h["answer_seq"], h["rule_id"], h["match_type"]) for h in hits)
+
+
+@pytest.mark.parametrize("order", [1, -1])
+async def test_hits_do_not_depend_on_entry_order(judge, order):
+    entries = [("cough", {"question": BLOOD, "answer": "Yes", "seq": 1}),
+               ("cough", {"question": FEVER, "answer": "Very hot", "seq": 2})][::order]
+    hits = []
+    urgency = await main.escalate_urgency("normal", entries, rule_index(), hits=hits)
+    assert urgency == "urgent"
+    # the LLM match is recorded although the regex match already reached a higher level
+    assert hit_keys(hits) == [(1, 1, "regex"), (2, 2, "llm")]
+
+
+async def test_rules_not_above_the_starting_level_are_ignored_for_both_match_types(judge):
+    entries = [("cough", {"question": FEVER, "answer": "39 degrees", "seq": 1}),
+               ("cough", {"question": FEVER, "answer": "hot", "seq": 2})]
+    hits = []
+    assert await main.escalate_urgency("semi-urgent", entries, rule_index(), hits=hits) == "semi-urgent"
+    assert hits == []
+    assert judge == []
+
+
+async def test_verdicts_are_applied_per_entry(judge):
+    entries = [("cough", {"question": BLOOD, "answer": "a little", "seq": 1}),
+               ("cough", {"question": BLOOD, "answer": "not really", "seq": 2})]
+    judged = {("cough", 1, 1): True, ("cough", 2, 1): False}
+    hits = []
+    assert await main.escalate_urgency("normal", entries, rule_index(), judged, hits) == "urgent"
+    assert hit_keys(hits) == [(1, 1, "llm")]
+    assert judge == []
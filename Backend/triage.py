@@ -0,0 +1,102 @@
+# triage.py
+import heapq
+import itertools
+from datetime import datetime
+from sqlalchemy.future import select
+from models import Consult
+from rules import URGENCY_RANK
+
+# Consults doctors still have to look at (scheduling by the notification worker doesn't close them)
+TRIAGE_STATUSES = ("in_progress", "completed", "scheduled", "needs_manual_schedule")
+
+
+class TriageQueue:
+    """
+    In-process priority queue of open consults: highest urgency first, then
+    oldest first. Heap entries are never updated in place; a change pushes a
+    new entry and stale ones are skipped when they surface.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple] = []
+        self._items: dict[int, dict] = {}
+        self._versions: dict[int, int] = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _sort_key(item: dict) -> tuple:
+        created = item["created_at"]
+        ts = created.timestamp() if isinstance(created, datetime) else 0.0
+        return (-URGENCY_RANK.get(item["urgency"] or "normal", 0), ts, item["id"])
+
+    def upsert(self, consult_id: int, urgency: str | None, status: str | None,
+               created_at: datetime, patient_id: int) -> dict | None:
+        """
+        Add or update a consult from its stored row (every field, so a
+        re-queued consult keeps its real age and patient); returns the
+        stored item, or None if it left the queue.
+        """
+        item = {
+            "id": consult_id,
+            "patient_id": patient_id,
+            "urgency": urgency or "normal",
+            "status": status or "in_progress",
+            "created_at": created_at,
+        }
+        if item["status"] not in TRIAGE_STATUSES:
+            self.remove(consult_id)
+            return None
+        version = next(self._counter)
+        self._items[consult_id] = item
+        self._versions[consult_id] = version
+        heapq.heappush(self._heap, (*self._sort_key(item), version))
+        return item
+
+    def remove(self, consult_id: int) -> bool:
+        self._versions.pop(consult_id, None)
+        return self._items.pop(consult_id, None) is not None
+
+    def _prune(self):
+        while self._heap:
+            *_, consult_id, version = self._heap[0]
+            if self._versions.get(consult_id) == version:
+                return
+            heapq.heappop(self._heap)
+
+    def peek(self) -> dict | None:
+        self._prune()
+        return self._items[self._heap[0][-2]] if self._heap else None
+
+    def pop(self) -> dict | None:
+        self._prune()
+        if not self._heap:
+            return None
+        *_, consult_id, _ = heapq.heappop(self._heap)
+        self._versions.pop(consult_id, None)
+        return self._items.pop(consult_id)
+
+    def snapshot(self, limit: int = 50) -> list[dict]:
+        return heapq.nsmallest(limit, self._items.values(), key=self._sort_key)
+
+    def clear(self):
+        self._heap.clear()
+        self._items.clear()
+        self._versions.clear()
+
+    async def rebuild(self, db):
+        """Reload from the consults table (startup, or after a manual fix-up)."""
+        self.clear()
+        res = await db.execute(
+            select(Consult.id, Consult.patient_id, Consult.urgency, Consult.status, Consult.created_at)
+            .where(Consult.status.in_(TRIAGE_STATUSES))
+        )
+        for row in res.all():
+            self.upsert(row.id, row.urgency, row.status, row.created_at, row.patient_id)
+
+
+def serialize_item(item: dict) -> dict:
+    created = item["created_at"]
+    return {**item, "created_at": created.isoformat() if isinstance(created, datetime) else created}
@@ -3,11 +3,14 @@ import io from "socket.io-client";
 import axios from "axios";
 
 const socket = io("http://localhost:8000"); // FastAPI backend WebSocket
+const PAGE_SIZE = 50;
 
 function App() {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState("");
   const [currentQuestion, setCurrentQuestion] = useState(null); // track which question is being asked
+  const [patients, setPatients] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null); // X-Next-Cursor of the last page fetched
 
   useEffect(() => {
     socket.on("bot_message", (data) => {
@@ -57,11 +60,15 @@ function App() {
     setInput("");
   };
 
-  const fetchPatients = async () => {
+  // One page per click; "Load more" follows X-Next-Cursor. Full exports use format=ndjson.
+  const fetchPatients = async (cursor = null) => {
     try {
-      const res = await axios.get("http://localhost:8000/patients");
+      const res = await axios.get("http://localhost:8000/patients", {
+        params: { limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      setPatients((prev) => (cursor ? [...prev, ...res.data] : res.data));
+      setNextCursor(res.headers["x-next-cursor"] || null);
       console.log("Patients:", res.data);
-      alert("Patients fetched. Check console.");
     } catch (err) {
       console.error(err);
     }
@@ -97,9 +104,25 @@ function App() {
         </button>
       </div>
 
-      <button style={styles.fetchButton} onClick={fetchPatients}>
+      <button style={styles.fetchButton} onClick={() => fetchPatients()}>
         Fetch Patients (REST API)
       </button>
+
+      {patients.length > 0 && (
+        <ul style={styles.patientList}>
+          {patients.map((p) => (
+            <li key={p.id}>
+              {p.name} ({p.email})
+            </li>
+          ))}
+        </ul>
+      )}
+
+      {nextCursor && (
+        <button style={styles.fetchButton} onClick={() => fetchPatients(nextCursor)}>
+          Load more
+        </button>
+      )}
     </div>
   );
 }
@@ -147,6 +170,10 @@ const styles = {
     color: "white",
     cursor: "pointer",
   },
+  patientList: {
+    marginTop: "10px",
+    paddingLeft: "20px",
+  },
   fetchButton: {
     marginTop: "15px",
     width: "100%",